@@ -0,0 +1,260 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading as th
+import time
+from collections import OrderedDict
+from typing import Sequence
+
+import dns.asyncresolver
+import dns.exception
+import dns.name
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+import dns.zone
+
+
+class DNSResolver:
+    """
+    This class implements the caching stub resolver shared by everything in LiSB that queries DNS. Answers (and
+    non-existent names) are cached in-process for as long as their TTLs allow, concurrent identical queries share a
+    single upstream query, and records can be served from a zone file, either in front of the upstream servers or
+    instead of them (offline mode).
+    """
+    nameservers: Sequence[str]
+    timeout: float
+    cache_size: int
+    max_ttl: float = 86400
+    negative_ttl: float
+    zone_file: str
+    offline: bool
+    _shared = None
+    _shared_lock = th.Lock()
+    _VOID_ERRORS = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+
+    def __init__(self, nameservers: Sequence[str] = None, timeout: float = 2.0, cache_size: int = 100000,
+                 negative_ttl: float = 300, zone_file: str = None, offline: bool = False):
+        """
+        This method creates a resolver.
+        :param nameservers: the IPs of the upstream name servers (None or empty uses those of the system)
+        :param timeout: the number of seconds after which a query to the upstream name servers is abandoned
+        :param cache_size: the maximum number of cached answers
+        :param negative_ttl: the number of seconds a non-existent name (or a name without records of the queried \
+        type) is cached for
+        :param zone_file: the path of a zone file (in master file format, with absolute names) whose records are \
+        served without querying the upstream name servers
+        :param offline: determines whether names not found in the zone file are answered as non-existent instead of \
+        being queried upstream
+        """
+        self.nameservers = nameservers if nameservers else []
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.negative_ttl = negative_ttl
+        self.zone_file = zone_file
+        self.offline = offline
+        # (name, type): (RRset or void lookup exception, expiry timestamp)
+        self._cache = OrderedDict()
+        # (name, type): concurrent Future of the upstream query in flight
+        self._pending_queries = {}
+        self._lock = th.Lock()
+        self._resolver = None
+        self._zone = {}
+        self._zone_names = set()
+        if zone_file:
+            self.load_zone_file(zone_file)
+
+    @classmethod
+    def get_shared(cls):
+        """
+        This class method returns the resolver shared by the whole process, creating a default one if none has been
+        configured
+        :return: the shared resolver
+        """
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """
+        This class method replaces the resolver shared by the whole process
+        :param kwargs: the parameters of the new resolver (see __init__)
+        :return: the new shared resolver
+        """
+        with cls._shared_lock:
+            cls._shared = cls(**kwargs)
+        return cls._shared
+
+    def load_zone_file(self, path: str):
+        """
+        This method loads the records of a zone file, replacing the ones previously loaded
+        :param path: the path of the zone file
+        """
+        zone = dns.zone.from_file(path, origin=dns.name.root, relativize=False, check_origin=False)
+        records = {}
+        for name, rdataset in zone.iterate_rdatasets():
+            rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
+            rrset.update(rdataset)
+            records[(name.to_text(omit_final_dot=True).lower(), dns.rdatatype.to_text(rdataset.rdtype))] = rrset
+        self._zone = records
+        self._zone_names = {name for name, rdtype in records}
+        logging.info(f"Loaded {len(records)} DNS record sets from '{path}'")
+
+    def _get_resolver(self) -> dns.asyncresolver.Resolver:
+        """
+        This method returns the resolver which queries the upstream name servers, creating it when it is first needed
+        :return: the upstream resolver
+        """
+        if self._resolver is None:
+            resolver = dns.asyncresolver.Resolver()
+            if self.nameservers:
+                resolver.nameservers = list(self.nameservers)
+            resolver.lifetime = self.timeout
+            self._resolver = resolver
+        return self._resolver
+
+    def resolve(self, name: str, rdtype: str = "A") -> dns.rrset.RRset:
+        """
+        This method resolves a query synchronously. It must not be called from a running asyncio event loop (use
+        resolve_async there).
+        :param name: the queried name
+        :param rdtype: the queried record type
+        :return: the records of the answer, whose TTL is the number of seconds they remain valid
+        :raises dns.resolver.NXDOMAIN: if the name doesn't exist
+        :raises dns.resolver.NoAnswer: if the name has no records of that type
+        :raises dns.exception.Timeout: if the upstream name servers don't answer in time
+        """
+        key = DNSResolver._get_key(name, rdtype)
+        answer = self._get_local(key)
+        if answer is not None:
+            return answer
+        return asyncio.run(self.resolve_async(name, rdtype))
+
+    async def resolve_async(self, name: str, rdtype: str = "A") -> dns.rrset.RRset:
+        """
+        This asynchronous method resolves a query. If an identical query is already in flight (in any thread), its
+        answer is awaited instead of querying the upstream name servers again.
+        :param name: the queried name
+        :param rdtype: the queried record type
+        :return: the records of the answer, whose TTL is the number of seconds they remain valid
+        :raises dns.resolver.NXDOMAIN: if the name doesn't exist
+        :raises dns.resolver.NoAnswer: if the name has no records of that type
+        :raises dns.exception.Timeout: if the upstream name servers don't answer in time
+        """
+        key = DNSResolver._get_key(name, rdtype)
+        answer = self._get_local(key)
+        if answer is not None:
+            return answer
+
+        with self._lock:
+            pending_query = self._pending_queries.get(key)
+            is_querying = pending_query is None
+            if is_querying:
+                pending_query = self._pending_queries[key] = concurrent.futures.Future()
+        if not is_querying:
+            # The shared query is shielded, so that a waiter whose deadline expires doesn't cancel it for the rest
+            return await asyncio.shield(asyncio.wrap_future(pending_query))
+
+        try:
+            answer = (await self._get_resolver().resolve(key[0], key[1])).rrset
+        except DNSResolver._VOID_ERRORS as e:
+            self._put(key, e, self.negative_ttl)
+            DNSResolver._complete(pending_query, exception=e)
+            raise
+        except BaseException as e:
+            # Cancellations (e.g. an evaluation deadline) are turned into timeouts for the queries sharing this one
+            DNSResolver._complete(pending_query, exception=e if isinstance(e, Exception) else dns.exception.Timeout())
+            raise
+        finally:
+            with self._lock:
+                del self._pending_queries[key]
+        self._put(key, answer, answer.ttl)
+        DNSResolver._complete(pending_query, answer=answer)
+        return answer
+
+    @staticmethod
+    def _complete(pending_query: concurrent.futures.Future, answer: dns.rrset.RRset = None,
+                  exception: Exception = None):
+        """
+        This static method passes the outcome of an upstream query to the queries sharing it, unless it has already
+        been completed
+        :param pending_query: the Future shared by the queries
+        :param answer: the records of the answer (if the query succeeded)
+        :param exception: the exception raised by the query (if it failed)
+        """
+        if pending_query.done():
+            return
+        try:
+            if exception is not None:
+                pending_query.set_exception(exception)
+            else:
+                pending_query.set_result(answer)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    @staticmethod
+    def _get_key(name: str, rdtype: str) -> tuple:
+        """
+        This static method normalizes a query into the key used by the zone and the cache
+        :param name: the queried name
+        :param rdtype: the queried record type
+        :return: the (name, type) key
+        """
+        return str(name).rstrip(".").lower(), rdtype.upper()
+
+    def _get_local(self, key: tuple) -> dns.rrset.RRset:
+        """
+        This method answers a query from the zone file or from the cache
+        :param key: the (name, type) key of the query
+        :return: the records of the answer. None if it has to be queried upstream.
+        :raises dns.resolver.NXDOMAIN: if the name is known not to exist
+        :raises dns.resolver.NoAnswer: if the name is known to have no records of that type
+        """
+        answer = self._zone.get(key)
+        if answer is not None:
+            return answer
+        if key[0] in self._zone_names:
+            raise dns.resolver.NoAnswer()
+        if self.offline:
+            raise dns.resolver.NXDOMAIN(qnames=[dns.name.from_text(key[0])])
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            answer, expiry_date = entry
+            remaining_ttl = expiry_date - time.time()
+            if remaining_ttl <= 0:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+        if isinstance(answer, Exception):
+            raise answer.with_traceback(None)
+        answer = answer.copy()
+        answer.ttl = int(remaining_ttl)
+        return answer
+
+    def _put(self, key: tuple, answer, ttl: float):
+        """
+        This method caches an answer, evicting the least recently used one if the cache is full
+        :param key: the (name, type) key of the query
+        :param answer: the records of the answer (or the void lookup exception)
+        :param ttl: the number of seconds the answer is valid for (it is capped at 'max_ttl')
+        """
+        if ttl <= 0 or self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (answer, time.time() + min(ttl, self.max_ttl))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def __len__(self) -> int:
+        """
+        This method returns the number of cached answers (including the expired ones not evicted yet)
+        :return: the number of cached answers
+        """
+        return len(self._cache)
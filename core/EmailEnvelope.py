@@ -1,17 +1,27 @@
 import re
 import sys
-import dns.resolver
+import email
 from typing import Sequence
 from email.message import EmailMessage
+from email.parser import BytesHeaderParser
 
 
 class EmailEnvelope:
-    peer: str = None
-    mail_from: str = None
-    rcpt_tos: Sequence[str] = None
-    email_msg: EmailMessage = None
-    kwargs = None
-    _sender_domain = None
+    __slots__ = (
+        "peer", "mail_from", "rcpt_tos", "_sender_domain", "_email_msg", "_headers", "_header_index",
+        "_raw_content", "_body_offset", "_cache"
+    )
+    peer: str
+    mail_from: str
+    rcpt_tos: Sequence[str]
+    _sender_domain: str
+    _email_msg: EmailMessage
+    _headers: EmailMessage
+    _header_index: dict
+    _raw_content: bytes
+    _body_offset: int
+    _cache: dict
+    _header_end_regex = re.compile(rb"\r?\n\r?\n")
     all_content_types = [
         "text/html", "text/plain", "multipart/mixed", "application/octet-stream",
         "multipart/alternative", "multipart/related", "image/jpeg", "image/gif", "message/rfc822",
@@ -31,20 +41,36 @@ class EmailEnvelope:
         "ai_check_return_path_equals_from_or_tos", "ai_check_email_client_id"
     ]
 
-    def __init__(self, peer, mail_from, rcpt_tos, email_msg):
+    def __init__(self, peer, mail_from, rcpt_tos, email_msg, raw_content: bytes = None):
         """
         This method creates a container for the email and envelope data
 
         :param peer: the remote host’s address
         :param mail_from: the SMTP envelope originator
         :param rcpt_tos: the SMTP envelope recipients
-        :param email_msg: the contents of the email in RFC 5321 format
-        :param kwargs: arbitrary keyword arguments
+        :param email_msg: the contents of the email in RFC 5321 format (None if it hasn't been received yet \
+        or if it is passed as raw_content)
+        :param raw_content: the raw bytes of the email. If passed, only its headers are parsed up front and the \
+        whole email is parsed when it is first needed.
         """
         self.peer = peer
         self.mail_from = mail_from
         self.rcpt_tos = rcpt_tos
-        self.email_msg = email_msg
+        self._email_msg = email_msg
+        self._headers = email_msg
+        self._raw_content = raw_content
+        self._body_offset = None
+        self._cache = {}
+        if raw_content is not None:
+            self._body_offset = EmailEnvelope.find_body_offset(raw_content)
+            self._headers = BytesHeaderParser().parsebytes(raw_content[:self._body_offset])
+
+        # Index the headers once by their lowercase name (keeping the first value, like Message.get does)
+        self._header_index = {}
+        if self._headers is not None:
+            for name, value in self._headers.items():
+                self._header_index.setdefault(name.lower(), value)
+
         if self.get_parsed_from() is not None:
             split_parsed_from = self.get_parsed_from().split("@")
             self._sender_domain = None if len(split_parsed_from) != 2 else split_parsed_from[1]
@@ -61,16 +87,89 @@ class EmailEnvelope:
                       f"-----------------------------------------------------"
         return msg_verbose
 
+    @classmethod
+    def from_bytes(cls, peer, mail_from, rcpt_tos, content: bytes):
+        """
+        This method creates a container for the email and envelope data from the raw bytes of the email, parsing
+        only its headers. The body and the MIME tree are only parsed when they are needed.
+
+        :param peer: the remote host’s address
+        :param mail_from: the SMTP envelope originator
+        :param rcpt_tos: the SMTP envelope recipients
+        :param content: the raw bytes of the email
+        :return: the EmailEnvelope
+        """
+        return cls(peer, mail_from, rcpt_tos, None, raw_content=content)
+
+    @staticmethod
+    def find_body_offset(content: bytes) -> int:
+        """
+        This utility method finds where the body of a raw email begins (right after the first empty line)
+
+        :param content: the raw bytes of the email
+        :return: the offset of the body in the raw bytes (their length if there is no body)
+        """
+        header_end = EmailEnvelope._header_end_regex.search(content)
+        return len(content) if header_end is None else header_end.end()
+
+    @property
+    def email_msg(self) -> EmailMessage:
+        """
+        This property returns the whole parsed email, parsing it from the raw bytes the first time it's needed
+
+        :return: The parsed email. None if it hasn't been received.
+        """
+        if self._email_msg is None and self._raw_content is not None:
+            self._email_msg = email.message_from_bytes(self._raw_content)
+        return self._email_msg
+
+    def as_bytes(self) -> bytes:
+        """
+        This method returns the email in bytes, as it was received if it was created from raw bytes
+
+        :return: The email bytes
+        """
+        return self._raw_content if self._raw_content is not None else self._email_msg.as_bytes()
+
+    def get_body_bytes(self) -> bytes:
+        """
+        This method returns the body of the email in bytes, without parsing it
+
+        :return: The body bytes
+        """
+        content = self.as_bytes()
+        body_offset = self._body_offset if self._raw_content is not None \
+            else EmailEnvelope.find_body_offset(content)
+        return content[body_offset:]
+
     def get_sender_domain(self):
         return self._sender_domain
 
+    def get_envelope_sender_domain(self):
+        """
+        This method returns the domain of the SMTP envelope originator, which is known before the message is received
+
+        :return: The envelope originator's domain. None if there is no valid originator.
+        """
+        if self.mail_from is not None:
+            split_mail_from = self.mail_from.split("@")
+            if len(split_mail_from) == 2:
+                return split_mail_from[1]
+        return None
+
     def get_parsed_from(self):
         """
         This method returns the parsed 'From' header (just email address)
 
         :return: The parsed 'From' header
         """
-        value = self.email_msg.get('From')
+        return self._get_cached("from", self._parse_from)
+
+    def _parse_from(self):
+        """
+        This method parses the 'From' header (just email address)
+        """
+        value = self._get_header('From')
         return EmailEnvelope.get_parsed_email_address(value)
 
     def get_parsed_to_list(self):
@@ -79,7 +178,13 @@ class EmailEnvelope:
 
         :return: The list of parsed recipients
         """
-        email_tos = self.email_msg.get("To")
+        return self._get_cached("to_list", self._parse_to_list)
+
+    def _parse_to_list(self):
+        """
+        This method parses the 'To' header (just email addresses)
+        """
+        email_tos = self._get_header("To")
         return None if email_tos is None \
             else [EmailEnvelope.get_parsed_email_address(to_parse) for to_parse in email_tos.split(",")]
 
@@ -89,9 +194,54 @@ class EmailEnvelope:
 
         :return: The parsed 'Return-Path' header. None if the email doesn't have it.
         """
-        value = self.email_msg.get('Return-Path')
+        return self._get_cached("return_path", self._parse_return_path)
+
+    def _parse_return_path(self):
+        """
+        This method parses the 'Return-Path' header (just email address)
+        """
+        value = self._get_header('Return-Path')
         return EmailEnvelope.get_parsed_email_address(value)
 
+    def get_parsed_reply_to(self):
+        """
+        This method returns the parsed 'Reply-To' header (just email address), if any
+
+        :return: The parsed 'Reply-To' header. None if the email doesn't have it.
+        """
+        return self._get_cached("reply_to", self._parse_reply_to)
+
+    def _parse_reply_to(self):
+        """
+        This method parses the 'Reply-To' header (just email address)
+        """
+        value = self._get_header('Reply-To')
+        return EmailEnvelope.get_parsed_email_address(value)
+
+    def _get_header(self, name):
+        """
+        This method returns the value of a header from the header index, without parsing the email body
+
+        :param name: the header name (case insensitive)
+        :return: the header value. None if the email doesn't have it (or hasn't been received).
+        """
+        return self._header_index.get(name.lower())
+
+    def _get_cached(self, field, parse):
+        """
+        This method returns a parsed field of the email, parsing it only the first time it is requested, so that all
+        the filters share the same parsed values
+
+        :param field: the name of the cached field
+        :param parse: the method that parses the field
+        :return: the parsed field
+        """
+        try:
+            return self._cache[field]
+        except KeyError:
+            value = self._cache[field] = parse()
+            return value
+
     @staticmethod
     def get_parsed_email_address(header_value):
         """
@@ -110,10 +260,17 @@ class EmailEnvelope:
         This method gets all X-headers from the email message
         :return: the X-headers in dictionary format
         """
+        return self._get_cached("x_headers", self._parse_x_headers)
+
+    def _parse_x_headers(self):
+        """
+        This method collects the names of all the X-headers
+        """
         x_headers = []
-        for header in self.email_msg:
-            if "X-" in header:
-                x_headers.append(header)
+        if self._headers is not None:
+            for header in self._headers.keys():
+                if "X-" in header:
+                    x_headers.append(header)
         return x_headers
 
     def get_dkim_params(self):
@@ -121,44 +278,20 @@ class EmailEnvelope:
         This method gets all DKIM parameters from the email message
         :return: the DKIM parameters in dictionary format
         """
+        return self._get_cached("dkim_params", self._parse_dkim_params)
+
+    def _parse_dkim_params(self):
+        """
+        This method parses the 'DKIM-Signature' header into a dictionary of tags
+        """
         dkim_params = {}
-        dkim_data = self.email_msg.get('DKIM-Signature')
+        dkim_data = self._get_header('DKIM-Signature')
         if dkim_data is not None:
             for to_parse in dkim_data.split(';'):
                 parsed = to_parse.replace("\n", "").strip().split('=')
                 dkim_params[parsed[0]] = parsed[1].strip()
         return dkim_params
 
-    def get_all_sender_ip_ranges(self):
-        """
-        This method gets through DNS queries all of the used ip ranges of the sender domain according to SPF.
-
-        :return: a list of all the sender domain's ip ranges
-        """
-        return EmailEnvelope.get_all_domain_ip_ranges(self._sender_domain)
-
-    @staticmethod
-    def get_all_domain_ip_ranges(domain):
-        """
-        This utility method gets through DNS queries all of the used ip ranges of a domain according to SPF.
-
-        :param domain: the domain to look the ip ranges for
-        :return: a list of all the domain's ip ranges
-        """
-        dig_data = {}
-        for to_parse in dns.resolver.query(domain, 'TXT'):
-            parsed = str(to_parse).replace("\"", "").split('=', 1)
-            dig_data[parsed[0]] = parsed[1] if len(parsed) > 1 else ''
-        ip_ranges = re.findall("ip[4|6]:([^ ]+)", dig_data['v'])
-        includes = re.findall("include:([^ ]+)", dig_data['v'])
-        redirect = re.findall("redirect=([^ ]+)", dig_data['v'])
-        if redirect:
-            ip_ranges.extend(EmailEnvelope.get_all_domain_ip_ranges(redirect[0]))
-        if includes:
-            for include in includes:
-                ip_ranges.extend(EmailEnvelope.get_all_domain_ip_ranges(include))
-        return ip_ranges
-
     # AI Methods
 
     def get_content_type_frequencies(self):
@@ -278,8 +411,8 @@ class EmailEnvelope:
         This method checks if header From equals to header Repply-To
         :return: True or false
         """
-        to_parse = self.email_msg.get('Reply-To')
-        parsed_reply_to = EmailEnvelope.get_parsed_email_address(to_parse)
+        to_parse = self._get_header('Reply-To')
+        parsed_reply_to = self.get_parsed_reply_to()
         if parsed_reply_to is not None:
             return to_parse == self.get_parsed_from()
         return False
@@ -1,4 +1,5 @@
 import signal
+import threading
 
 
 class GracefulKiller:
@@ -11,6 +12,7 @@ class GracefulKiller:
         """
         This method returns a GracefulKiller object, which handles SIGINT and SIGTERM signals.
         """
+        self._killed = threading.Event()
         signal.signal(signal.SIGINT, self.exit_gracefully)
         signal.signal(signal.SIGTERM, self.exit_gracefully)
 
@@ -19,3 +21,12 @@ class GracefulKiller:
         This method changes the sate of the kill_now flag, so that all of the processes that are listening to it can shutdown gracefully.
         """
         self.kill_now = True
+        self._killed.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        This method blocks the calling thread until a shutdown signal is received or the timeout expires.
+        :param timeout: the maximum number of seconds to wait for (None waits forever)
+        :return: True, if the shutdown signal was received; False, if the timeout expired
+        """
+        return self._killed.wait(timeout)
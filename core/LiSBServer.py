@@ -1,62 +1,260 @@
-import email
 import logging
 import logging.config
 import logging.handlers
 import multiprocessing
+import os
+import threading
 import time
 
 from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP, MISSING
 
+from core.DNSResolver import DNSResolver
 from core.GracefulKiller import GracefulKiller
 from core.EmailEnvelope import EmailEnvelope
 from core.MailForwarder import MailForwarder
+from core.RateLimiter import RateLimiter
 from core.filtering.FilteringManager import FilteringManager
 
 
 class LiSBServer(Controller):
     killer: GracefulKiller
+    reuse_port: bool
 
-    def __init__(self, conf):
+    def __init__(self, conf, reuse_port: bool = False, persist_state: bool = True):
         """
         This method creates an instance of the spam filter server
+        :param conf: The server configuration dictionary
+        :param reuse_port: determines whether the listening socket is bound with SO_REUSEPORT, so that several worker
+        processes can share the same local IP and port
+        :param persist_state: determines whether the filters' data is stored to disk by this server (only one of
+        several workers sharing the data directory should do it)
         """
         # Create killer
         self.killer = GracefulKiller()
+        self.reuse_port = reuse_port
         # Call parent constructor with Handler and pass killer
         super().__init__(
-            handler=LiSBHandler(conf, self.killer),
+            handler=LiSBHandler(conf, self.killer, persist_state),
             hostname=conf["server_params"]["local_ip"],
             port=conf["server_params"]["local_port"],
             server_kwargs=conf["server_params"]["SMTP_parameters"]
         )
 
+    def factory(self):
+        """
+        This method overrides the aiosmtpd protocol creation in order to use the LiSBSMTP protocol
+        """
+        return LiSBSMTP(self.handler, **self.SMTP_kwargs)
+
+    def _create_server(self):
+        """
+        This method overrides the aiosmtpd server creation so that the listening socket can be shared between workers
+        """
+        return self.loop.create_server(
+            self._factory_invoker,
+            host=self.hostname,
+            port=self.port,
+            ssl=self.ssl_context,
+            reuse_port=self.reuse_port
+        )
+
+    def _trigger_server(self):
+        """
+        This method overrides the aiosmtpd check that the server is responding. When the listening socket is shared
+        through SO_REUSEPORT, connecting to it could reach a sibling worker instead of this one, so the protocol
+        factory is invoked directly in this server's event loop.
+        """
+        if not self.reuse_port:
+            super()._trigger_server()
+        else:
+            self.loop.call_soon_threadsafe(self._factory_invoker)
+
     def launch_server(self):
         """
         This method launches the spam filter server instance and implements a safe shutdown mechanism
         """
-        # Star server
-        self.start()
+        # Star server (if it can't be started, stop the forwarders and daemons so that the process can exit)
+        try:
+            self.start()
+        except Exception:
+            self.killer.exit_gracefully(None, None)
+            self.handler.filtering_mgr.shutdown()
+            raise
         # Wait until the process is killed
-        while not self.killer.kill_now:
-            pass
+        self.killer.wait()
         # Shut down gracefully
         self.stop()
+        self.handler.filtering_mgr.shutdown()
         logging.info("Shutting down server...")
 
 
+class LiSBSMTP(SMTP):
+    """
+    This class extends the aiosmtpd SMTP protocol with a CONNECT hook, which is called before sending the greeting
+    """
+
+    async def _handle_client(self):
+        """
+        This asynchronous method calls the handler's CONNECT hook (if any) before handling the client. If the hook
+        returns a status, it is sent to the client as the greeting and the connection is closed.
+        """
+        status = await self._call_handler_hook("CONNECT")
+        if status is not MISSING and status is not None:
+            await self.push(status)
+            self.transport.close()
+            return
+        await super()._handle_client()
+
+
+class LiSBSupervisor:
+    conf: dict
+    killer: GracefulKiller
+    n_workers: int
+    workers: list
+    # A worker which dies within this number of seconds since it was started is restarted after a delay which doubles
+    # with each consecutive failure, up to the maximum delay
+    _STABLE_UPTIME = 60
+    _RESTART_DELAY = 1
+    _MAX_RESTART_DELAY = 300
+
+    def __init__(self, conf: dict):
+        """
+        This method creates a supervisor which runs several LiSBServer worker processes bound to the same local IP
+        and port through SO_REUSEPORT, so that the kernel balances the incoming connections between them.
+        :param conf: The server configuration dictionary
+        """
+        self.conf = conf
+        self.killer = GracefulKiller()
+        n_workers = conf["server_params"]["n_workers"]
+        self.n_workers = n_workers if n_workers > 0 else multiprocessing.cpu_count()
+        self.workers = []
+        self._start_times = []
+        self._n_failures = []
+        self._restart_times = []
+
+    def launch_workers(self):
+        """
+        This method launches all the worker processes, restarts the ones that die unexpectedly (backing off when they
+        keep failing right after being started) and, once a shutdown signal is received, propagates it to every worker
+        and waits for them to shut down gracefully
+        """
+        self.start_workers()
+        # Wait until the supervisor is killed, restarting any worker that dies in the meantime
+        while not self.killer.wait(1):
+            self.check_workers()
+        self.stop_workers()
+
+    def start_workers(self):
+        """
+        This method launches all the worker processes
+        """
+        logging.info(f"Launching {self.n_workers} LiSBServer workers")
+        self._start_times = [time.monotonic()] * self.n_workers
+        self._n_failures = [0] * self.n_workers
+        self._restart_times = [None] * self.n_workers
+        self.workers = [self._spawn_worker(worker_index) for worker_index in range(self.n_workers)]
+
+    def check_workers(self):
+        """
+        This method restarts the workers that have died, once their restart delays have elapsed (unless the
+        supervisor is being shut down)
+        """
+        for worker_index, worker in enumerate(self.workers):
+            if not self.killer.kill_now:
+                self._check_worker(worker_index, worker)
+
+    def stop_workers(self):
+        """
+        This method propagates the shutdown to all workers (SIGTERM) and waits for them
+        """
+        logging.info("Shutting down workers...")
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+    def _check_worker(self, worker_index: int, worker: multiprocessing.Process):
+        """
+        This method restarts a worker if it has died and its restart delay has elapsed
+        :param worker_index: the index of the worker
+        :param worker: the worker process
+        """
+        if worker.is_alive():
+            return
+        current_time = time.monotonic()
+        if self._restart_times[worker_index] is None:
+            if current_time - self._start_times[worker_index] >= LiSBSupervisor._STABLE_UPTIME:
+                self._n_failures[worker_index] = 0
+            restart_delay = min(LiSBSupervisor._RESTART_DELAY * 2 ** self._n_failures[worker_index],
+                                LiSBSupervisor._MAX_RESTART_DELAY)
+            self._n_failures[worker_index] += 1
+            self._restart_times[worker_index] = current_time + restart_delay
+            logging.error(f"{worker.name} exited unexpectedly with code {worker.exitcode}. "
+                          f"Restarting it in {restart_delay} s...")
+        if current_time >= self._restart_times[worker_index]:
+            self._restart_times[worker_index] = None
+            self._start_times[worker_index] = current_time
+            self.workers[worker_index] = self._spawn_worker(worker_index)
+
+    def _spawn_worker(self, worker_index: int) -> multiprocessing.Process:
+        """
+        This method creates and starts a new worker process. Only the first worker stores the filters' data to disk,
+        so that the workers don't overwrite each other's files.
+        :param worker_index: the index of the worker, used for naming it
+        :return: the started worker process
+        """
+        worker = multiprocessing.Process(
+            target=LiSBSupervisor._run_worker,
+            name=f"LiSBWorker-{worker_index}",
+            args=(self.conf, worker_index == 0)
+        )
+        worker.start()
+        return worker
+
+    @staticmethod
+    def _run_worker(conf: dict, persist_state: bool):
+        """
+        This static method is executed by each worker process. It creates its own LiSBServer (and hence its own
+        LiSBHandler, FilteringManager and MailForwarder) and serves until it receives a shutdown signal.
+        :param conf: The server configuration dictionary
+        :param persist_state: determines whether this worker stores the filters' data to disk
+        """
+        try:
+            server = LiSBServer(conf, reuse_port=True, persist_state=persist_state)
+            server.launch_server()
+        except Exception as e:
+            logging.error(f"{multiprocessing.current_process().name} failed: {e.__class__.__name__} - {e}")
+            # Its forwarder threads and daemons could keep the process alive, so that the supervisor would never
+            # notice the failure: exit right away instead
+            logging.shutdown()
+            os._exit(1)
+        # Unlike the main process, a worker process doesn't wait for its non-daemon threads before finalizing its
+        # resources, so wait for the forwarders and the storage daemon to finish their pending work
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and not thread.daemon:
+                thread.join()
+
+
 class LiSBHandler:
     conf: dict
     filtering_mgr: FilteringManager
     forwarder: MailForwarder
+    rate_limiter: RateLimiter = None
     _REJECTION_MSG_RFC_5321 = "450 Requested mail action not taken: mailbox unavailable (e.g., mailbox busy or " \
                               "temporarily blocked for policy reasons)"
+    _CONNECTION_REJECTION_MSG_RFC_5321 = "554 No SMTP service here"
+    _CONNECTION_RATE_LIMIT_MSG_RFC_5321 = "421 Service not available: too many connections, try again later"
+    _MESSAGE_RATE_LIMIT_MSG_RFC_5321 = "451 Requested action aborted: too many messages, try again later"
     _OK_MSG_RFC_5321 = "250 OK"
 
-    def __init__(self, conf: dict, killer: GracefulKiller):
+    def __init__(self, conf: dict, killer: GracefulKiller, persist_state: bool = True):
         """
         This method returns an instance of the spam filter handler, which implements methods for processing the SMTP transaction.
         :param conf: The server configuration dictionary
         :param killer: The GracefulKiller object for graceful shutdown
+        :param persist_state: determines whether the filters' data is stored to disk
         """
         logging.info("Setting up LiSBServer server")
         self.conf = conf
@@ -72,6 +270,16 @@ class LiSBHandler:
             killer=killer
         )
 
+        # Set up the DNS resolver shared by the filters (before they are created, so that they all use it)
+        DNSResolver.configure(**conf["filtering"]["dns"])
+
+        # Size the filtering processes of each server worker so that all of the workers together use every CPU once
+        n_filtering_processes = conf["filtering"]["process_pool"]["n_processes"]
+        if n_filtering_processes == 0:
+            n_workers = conf["server_params"]["n_workers"]
+            n_workers = n_workers if n_workers > 0 else multiprocessing.cpu_count()
+            n_filtering_processes = max(1, multiprocessing.cpu_count() // n_workers)
+
         # Create filtering manager, which will filter all incoming messages
         self.filtering_mgr = FilteringManager(
             enable_threading=conf["filtering"]["enable_threading"],
@@ -81,14 +289,111 @@ class LiSBHandler:
             time_limit=conf["filtering"]["time_limit"],
             disabled_filters=conf["filtering"]["disabled_filters"],
             exceptions=conf["filtering"]["exceptions"],
+            n_session_threads=conf["filtering"]["n_session_threads"],
+            n_filtering_threads=conf["filtering"]["n_filtering_threads"],
+            verdict_cache_size=conf["filtering"]["verdict_cache"]["max_size"],
+            verdict_cache_ttl=conf["filtering"]["verdict_cache"]["ttl"],
+            verdict_cache_stats_frequency=conf["filtering"]["verdict_cache"]["stats_frequency"],
+            reorder_frequency=conf["filtering"]["adaptive_ordering"]["reorder_frequency"],
+            pinned_filters=conf["filtering"]["adaptive_ordering"]["pinned_filters"],
+            tiers=conf["filtering"]["tiers"],
+            enable_process_pool=conf["filtering"]["process_pool"]["enabled"],
+            n_filtering_processes=n_filtering_processes,
+            block_list_sources=conf["filtering"]["block_lists"]["sources"],
+            block_list_refresh_frequency=conf["filtering"]["block_lists"]["refresh_frequency"],
+            shared_state_path=conf["filtering"]["shared_state"]["path"]
+            if conf["filtering"]["shared_state"]["enabled"] else None,
+            shared_state_poll_interval=conf["filtering"]["shared_state"]["poll_interval"],
+            enable_prefetch=conf["filtering"]["prefetch"]["enabled"],
+            persist_state=persist_state,
             killer=killer
         )
+
+        # Create rate limiter, which will limit the connections, messages and bytes per peer IP and network
+        rate_limits = conf["server_params"]["rate_limits"]
+        if rate_limits["enabled"]:
+            self.rate_limiter = RateLimiter(
+                per_ip=rate_limits["per_ip"],
+                per_network=rate_limits["per_network"],
+                ipv4_prefix=rate_limits["ipv4_prefix"],
+                ipv6_prefix=rate_limits["ipv6_prefix"]
+            )
         logging.info(
             f"Running LiSBServer server on "
             f"{(conf['server_params']['local_ip'], conf['server_params']['local_port'])}"
         )
         logging.info("Waiting for mails to filter...")
 
+    async def handle_CONNECT(self, server, session, envelope):
+        """
+        This asynchronous method implements the handler for the connection opening, before the greeting is sent.
+        During this stage, the filters that only need the peer address are applied.
+        :param server: The SMTP server instance
+        :param session: The session instance currently being handled
+        :param envelope: The envelope instance of the current SMTP Transaction
+        :return: None if the connection is accepted, or the rejection status
+        """
+        if not self._is_rate_limit_exempt(session) and not self.rate_limiter.allow_connection(session.peer[0]):
+            logging.warning(f"Peer {session.peer} exceeded the connection rate limit. "
+                            f"Rejecting connection with RFC 5321 code 421...")
+            return self._CONNECTION_RATE_LIMIT_MSG_RFC_5321
+        parsed_envelope = EmailEnvelope(session.peer, None, [], None)
+        if await self.filtering_mgr.apply_early_filters_async("CONNECT", parsed_envelope):
+            logging.warning(f"Connection from peer {session.peer} was detected as spam. "
+                            f"Rejecting connection with RFC 5321 code 554...")
+            return self._CONNECTION_REJECTION_MSG_RFC_5321
+        return None
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        """
+        This asynchronous method implements the handler for the MAIL part of the SMTP transaction. During this stage,
+        the filters that only need the peer address and the envelope originator are applied, and the lookups for the
+        sender domain are started in the background.
+        :param server: The SMTP server instance
+        :param session: The session instance currently being handled
+        :param envelope: The envelope instance of the current SMTP Transaction
+        :param address: The envelope originator
+        :param mail_options: The MAIL FROM parameters
+        """
+        if not self._is_rate_limit_exempt(session):
+            declared_size = 0
+            for mail_option in mail_options:
+                if mail_option.startswith("SIZE="):
+                    declared_size = int(mail_option[5:])
+            if not self.rate_limiter.allow_message(session.peer[0], declared_size):
+                logging.warning(f"Peer {session.peer} exceeded the message rate limit. "
+                                f"Rejecting sender '{address}' with RFC 5321 code 451...")
+                return self._MESSAGE_RATE_LIMIT_MSG_RFC_5321
+        parsed_envelope = EmailEnvelope(session.peer, address, [], None)
+        if await self.filtering_mgr.apply_early_filters_async("MAIL", parsed_envelope):
+            logging.warning(f"Sender '{address}' from peer {session.peer} was detected as spam. "
+                            f"Rejecting sender with RFC 5321 code 450...")
+            return self._REJECTION_MSG_RFC_5321
+        # Start looking up the sender domain's data, so that it is ready by the time the message is filtered
+        self.filtering_mgr.prefetch(parsed_envelope.get_envelope_sender_domain())
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return self._OK_MSG_RFC_5321
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        """
+        This asynchronous method implements the handler for the RCPT part of the SMTP transaction. During this stage,
+        the filters that only need the envelope data (without the message contents) are applied.
+        :param server: The SMTP server instance
+        :param session: The session instance currently being handled
+        :param envelope: The envelope instance of the current SMTP Transaction
+        :param address: The envelope recipient
+        :param rcpt_options: The RCPT TO parameters
+        """
+        parsed_envelope = EmailEnvelope(session.peer, envelope.mail_from, envelope.rcpt_tos + [address], None)
+        if await self.filtering_mgr.apply_early_filters_async("RCPT", parsed_envelope):
+            logging.warning(f"Recipient '{address}' for email from '{envelope.mail_from}' sent from peer "
+                            f"{session.peer} was detected as spam. Rejecting recipient with RFC 5321 code 450...")
+            return self._REJECTION_MSG_RFC_5321
+        envelope.rcpt_tos.append(address)
+        envelope.rcpt_options.extend(rcpt_options)
+        return self._OK_MSG_RFC_5321
+
     async def handle_DATA(self, server, session, envelope):
         """
         This asynchronous method implements the handler for the DATA part of the SMTP transaction. During this stage,
@@ -98,14 +403,18 @@ class LiSBHandler:
         :param envelope: The envelope instance of the current SMTP Transaction
         """
         logging.info("A new message has been received")
+        if not self._is_rate_limit_exempt(session):
+            self.rate_limiter.charge_bytes(session.peer[0], len(envelope.content))
 
-        # Parse message to EmailEnvelope
-        msg_data = email.message_from_bytes(envelope.content)
-        parsed_envelope = EmailEnvelope(session.peer, envelope.mail_from, envelope.rcpt_tos, msg_data)
+        # Parse message headers to EmailEnvelope (the body is only parsed if a filter needs it)
+        parsed_envelope = EmailEnvelope.from_bytes(session.peer, envelope.mail_from, envelope.rcpt_tos,
+                                                   envelope.content)
 
         # Check if parsed message is spam: reject it if it is (code 450), forward it if it isn't
         start_time = time.time()
-        is_spam = self.filtering_mgr.apply_filters(parsed_envelope)
+        # (The filters of the previous stages have already been applied by their respective handlers, unless deferred)
+        is_spam = await self.filtering_mgr.apply_filters_async(parsed_envelope,
+                                                               stages=self.filtering_mgr.get_data_stages())
         filtering_time = time.time() - start_time
         logging.debug(f"Filtering process lasted for {filtering_time} s")
         if is_spam:
@@ -115,3 +424,13 @@ class LiSBHandler:
         else:
             self.forwarder.forward(parsed_envelope)
             return self._OK_MSG_RFC_5321
+
+    def _is_rate_limit_exempt(self, session) -> bool:
+        """
+        This method determines whether a session is exempt from rate limiting, which happens when rate limiting is
+        disabled or when the peer IP is one of the filtering exceptions
+        :param session: The session instance currently being handled
+        :return: True, if the session is exempt; False, if it isn't
+        """
+        return self.rate_limiter is None or \
+            self.filtering_mgr.check_if_exception(peer_ip=session.peer[0], email_address=None, email_domain=None)
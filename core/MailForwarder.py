@@ -63,7 +63,7 @@ class MailForwarder:
                     try:
                         msg = msgs.get(timeout=5)
                         logging.info(f"Forwarding message")
-                        server.sendmail(from_addr=msg.mail_from, to_addrs=msg.rcpt_tos, msg=msg.email_msg.as_bytes())
+                        server.sendmail(from_addr=msg.mail_from, to_addrs=msg.rcpt_tos, msg=msg.as_bytes())
                         logging.info(f"Message forwarded")
                     except Empty:
                         logging.debug(f"Woken up but no emails to forward. Going back to sleep...")
@@ -0,0 +1,151 @@
+import ipaddress
+import time
+
+
+class RateLimiter:
+    """
+    This class implements token-bucket rate limits (connections/s, messages/s and bytes/s) per peer IP and per peer
+    network. Each tracked key is stored as a compact list [connection tokens, message tokens, byte tokens, last update].
+    """
+    _CONNECTIONS = 0
+    _MESSAGES = 1
+    _BYTES = 2
+    _LAST_UPDATE = 3
+    _SWEEPING_FREQUENCY = 60
+
+    def __init__(self, per_ip: dict, per_network: dict, ipv4_prefix: int = 24, ipv6_prefix: int = 64):
+        """
+        This method creates a rate limiter.
+
+        :param per_ip: the limits for each peer IP, as a dictionary with 'connections', 'messages' and 'bytes' \
+        limits, each of them with its 'rate' (tokens per second) and its 'burst' (bucket capacity)
+        :param per_network: the limits for each peer network, in the same format as per_ip
+        :param ipv4_prefix: the prefix length that defines the network of an IPv4 peer
+        :param ipv6_prefix: the prefix length that defines the network of an IPv6 peer
+        """
+        self.ipv4_prefix = ipv4_prefix
+        self.ipv6_prefix = ipv6_prefix
+        self._limits = {
+            "ip": RateLimiter._compile_limits(per_ip),
+            "network": RateLimiter._compile_limits(per_network)
+        }
+        self._buckets = {"ip": {}, "network": {}}
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _compile_limits(limits: dict) -> list:
+        """
+        This utility method converts the configured limits into a list of (rate, burst) tuples, indexed like the buckets
+        :param limits: the configured limits
+        :return: the list of (rate, burst) tuples for connections, messages and bytes
+        """
+        return [(limits[kind]["rate"], limits[kind]["burst"]) for kind in ("connections", "messages", "bytes")]
+
+    def get_network(self, peer_ip: str) -> str:
+        """
+        This method returns the network to which a peer IP belongs, according to the configured prefix lengths
+        :param peer_ip: the peer IP
+        :return: the peer network in CIDR notation
+        """
+        ip = ipaddress.ip_address(peer_ip)
+        prefix = self.ipv4_prefix if ip.version == 4 else self.ipv6_prefix
+        return ipaddress.ip_network(f"{peer_ip}/{prefix}", strict=False).compressed
+
+    def allow_connection(self, peer_ip: str) -> bool:
+        """
+        This method consumes a connection token from the peer IP and peer network buckets
+        :param peer_ip: the IP of the connecting peer
+        :return: True, if the connection is within the limits; False, if it must be rejected
+        """
+        buckets = self._get_buckets(peer_ip)
+        if all(bucket[RateLimiter._CONNECTIONS] >= 1 for bucket, limits in buckets):
+            for bucket, limits in buckets:
+                bucket[RateLimiter._CONNECTIONS] -= 1
+            return True
+        return False
+
+    def allow_message(self, peer_ip: str, declared_size: int = 0) -> bool:
+        """
+        This method consumes a message token from the peer IP and peer network buckets. The message is also rejected
+        if the byte buckets are exhausted or can't hold the declared message size.
+        :param peer_ip: the IP of the sending peer
+        :param declared_size: the message size declared through the SIZE parameter of MAIL FROM (0 if unknown)
+        :return: True, if the message is within the limits; False, if it must be rejected
+        """
+        buckets = self._get_buckets(peer_ip)
+        for bucket, limits in buckets:
+            byte_burst = limits[RateLimiter._BYTES][1]
+            if bucket[RateLimiter._MESSAGES] < 1 or bucket[RateLimiter._BYTES] <= 0 or \
+                    bucket[RateLimiter._BYTES] < min(declared_size, byte_burst):
+                return False
+        for bucket, limits in buckets:
+            bucket[RateLimiter._MESSAGES] -= 1
+        return True
+
+    def charge_bytes(self, peer_ip: str, n_bytes: int):
+        """
+        This method consumes the bytes of a received message from the peer IP and peer network byte buckets. The
+        buckets can go into debt, so that the following messages are rejected until they are refilled.
+        :param peer_ip: the IP of the sending peer
+        :param n_bytes: the number of bytes received
+        """
+        for bucket, limits in self._get_buckets(peer_ip):
+            bucket[RateLimiter._BYTES] -= n_bytes
+
+    def get_n_tracked(self) -> int:
+        """
+        This method returns the number of peer IPs and networks currently tracked
+        :return: the number of tracked keys
+        """
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+    def _get_buckets(self, peer_ip: str) -> list:
+        """
+        This method returns the refilled buckets of a peer IP and its network, creating them if they don't exist
+        :param peer_ip: the peer IP
+        :return: a list of (bucket, limits) tuples
+        """
+        now = time.monotonic()
+        if now - self._last_sweep > RateLimiter._SWEEPING_FREQUENCY:
+            self._sweep(now)
+        return [
+            (self._get_bucket(kind, key, now), self._limits[kind])
+            for kind, key in (("ip", peer_ip), ("network", self.get_network(peer_ip)))
+        ]
+
+    def _get_bucket(self, kind: str, key: str, now: float) -> list:
+        """
+        This method returns the refilled bucket of a key, creating it (full) if it doesn't exist
+        :param kind: either 'ip' or 'network'
+        :param key: the peer IP or network
+        :param now: the current monotonic time
+        :return: the bucket
+        """
+        limits = self._limits[kind]
+        bucket = self._buckets[kind].get(key)
+        if bucket is None:
+            bucket = [burst for rate, burst in limits] + [now]
+            self._buckets[kind][key] = bucket
+        else:
+            elapsed = now - bucket[RateLimiter._LAST_UPDATE]
+            for index, (rate, burst) in enumerate(limits):
+                bucket[index] = min(burst, bucket[index] + rate * elapsed)
+            bucket[RateLimiter._LAST_UPDATE] = now
+        return bucket
+
+    def _sweep(self, now: float):
+        """
+        This method forgets the buckets that have been idle long enough to be full again, since forgetting them
+        doesn't change any future decision
+        :param now: the current monotonic time
+        """
+        for kind, buckets in self._buckets.items():
+            limits = self._limits[kind]
+            expired = [
+                key for key, bucket in buckets.items()
+                if all(bucket[index] + rate * (now - bucket[RateLimiter._LAST_UPDATE]) >= burst
+                       for index, (rate, burst) in enumerate(limits))
+            ]
+            for key in expired:
+                del buckets[key]
+        self._last_sweep = now
@@ -1,4 +1,4 @@
-from core.LiSBServer import LiSBServer
+from core.LiSBServer import LiSBServer, LiSBSupervisor
 from core.GracefulKiller import GracefulKiller
 from core.MailForwarder import MailForwarder
 from core.EmailEnvelope import EmailEnvelope
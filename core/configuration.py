@@ -10,13 +10,14 @@ import time
 from os import listdir
 from smtplib import SMTP
 
-from schema import Schema, And, Or
+from schema import Schema, And, Or, Optional
 
-from core.filtering import Filter, PastFilter
+from core.filtering import Filter, PastFilter, AIFilter
 
 # ALL FILTER CLASSES
 filter_classes = [cls.__name__ for cls in Filter.__subclasses__() if cls.__name__ != 'PastFilter']
 filter_classes.extend(cls.__name__ for cls in PastFilter.__subclasses__())
+filter_classes.extend(cls.__name__ for cls in AIFilter.__subclasses__())
 
 # EMAIL REGEX
 email_regex = re.compile('^(\w|\.|\_|\-)+[@](\w|\_|\-|\.)+[.]\w{2,3}$')
@@ -29,16 +30,60 @@ filtering_schema = Schema(
         "black_listing_threshold": And(int, lambda n: n > 0),
         "black_listed_days": And(int, lambda n: n > 0),
         "time_limit": And(Or(float, int), lambda n: n > 0),
+        "n_session_threads": And(int, lambda n: n >= 0),
+        "n_filtering_threads": And(int, lambda n: n >= 0),
+        "verdict_cache": {
+            "max_size": And(int, lambda n: n >= 0),
+            "ttl": And(Or(float, int), lambda n: n > 0),
+            "stats_frequency": And(Or(float, int), lambda n: n > 0)
+        },
+        "adaptive_ordering": {
+            "reorder_frequency": And(int, lambda n: n >= 0),
+            "pinned_filters": {
+                Optional(And(str, lambda cls: cls in filter_classes)): And(int, lambda n: n >= 0)
+            }
+        },
+        "tiers": [
+            {
+                "name": str,
+                "filters": [And(str, lambda cls: cls in filter_classes)],
+                "time_limit": And(Or(float, int), lambda n: n > 0)
+            }
+        ],
+        "process_pool": {
+            "enabled": bool,
+            "n_processes": And(int, lambda n: n >= 0)
+        },
+        "block_lists": {
+            "sources": [str],
+            "refresh_frequency": And(int, lambda n: n > 0)
+        },
+        "prefetch": {
+            "enabled": bool
+        },
+        "shared_state": {
+            "enabled": bool,
+            "path": str,
+            "poll_interval": And(Or(float, int), lambda n: n > 0)
+        },
+        "dns": {
+            "nameservers": [And(str, lambda ip: ipaddress.ip_address(ip))],
+            "timeout": And(Or(float, int), lambda n: n > 0),
+            "cache_size": And(int, lambda n: n >= 0),
+            "negative_ttl": And(Or(float, int), lambda n: n >= 0),
+            "zone_file": Or(None, str),
+            "offline": bool
+        },
         "disabled_filters": [And(str, lambda cls: cls in filter_classes)],
         "exceptions": {
             "ip_addresses": [
-                And(str, lambda ip: ipaddress.IPv4Address(ip))
+                And(str, lambda ip: ipaddress.ip_network(ip, strict=False))
             ],
             "email_addresses": [
                 And(str, lambda email: re.match(email_regex, email) is not None)
             ],
             "email_domains": [
-                And(str, lambda domain: re.match('^(\w|\_|\-|\.)+[.]\w{2,3}$', domain) is not None)
+                And(str, lambda domain: re.match('^(\*\.)?(\w|\_|\-|\.)+[.]\w{2,3}$', domain) is not None)
             ]
         }
     }
@@ -72,12 +117,34 @@ communications_schema = Schema(
     }
 )
 
+# SCHEMA FOR A TOKEN BUCKET RATE LIMIT
+rate_limit_schema = {
+    "rate": And(Or(float, int), lambda n: n > 0),
+    "burst": And(Or(float, int), lambda n: n > 0)
+}
+
 # SCHEMA FOR THE SERVER PARAMETERS
 server_params_schema = Schema(
     {
         "local_ip": And(str, lambda ip: ipaddress.IPv4Address(ip)),
         "local_port": And(int, lambda port: 0 <= port <= 65353),
-        "SMTP_parameters": dict
+        "n_workers": And(int, lambda n: n >= 0),
+        "SMTP_parameters": dict,
+        "rate_limits": {
+            "enabled": bool,
+            "ipv4_prefix": And(int, lambda n: 0 < n <= 32),
+            "ipv6_prefix": And(int, lambda n: 0 < n <= 128),
+            "per_ip": {
+                "connections": rate_limit_schema,
+                "messages": rate_limit_schema,
+                "bytes": rate_limit_schema
+            },
+            "per_network": {
+                "connections": rate_limit_schema,
+                "messages": rate_limit_schema,
+                "bytes": rate_limit_schema
+            }
+        }
     }
 )
 
@@ -0,0 +1,127 @@
+import ipaddress
+import json
+import logging
+import threading as th
+import urllib.request
+from typing import Sequence
+
+from core.GracefulKiller import GracefulKiller
+from core.filtering.IPRangeIndex import IPRangeIndex
+from core.filtering.filters.BlackListFilter import BlackListFilter
+
+
+class BlockListLoader:
+    sources: Sequence[str]
+    refresh_frequency: int
+    killer: GracefulKiller
+    _URL_TIMEOUT = 30
+
+    def __init__(self, sources: Sequence[str], refresh_frequency: int, killer: GracefulKiller):
+        """
+        This method creates a loader which periodically ingests block lists of IP ranges into a BlackListFilter.
+        :param sources: the paths or HTTP(S) URLs of the block lists, either in Spamhaus DROP/EDROP format (a CIDR
+        per line, followed by '; SBL id' comments), in its JSON lines format or as plain CIDR lists
+        :param refresh_frequency: the frequency in seconds with which the block lists are loaded again
+        :param killer: The GracefulKiller object for graceful shutdown
+        """
+        self.sources = sources
+        self.refresh_frequency = refresh_frequency
+        self.killer = killer
+
+    @staticmethod
+    def parse_block_list(content: str) -> list:
+        """
+        This static method extracts the IP ranges from the contents of a block list. Comments (starting with ';' or
+        '#') and blank lines are skipped, and so are malformed lines and invalid ranges (which are logged).
+        :param content: the contents of the block list
+        :return: the list of IP ranges in CIDR notation
+        """
+        ip_ranges = []
+        n_invalid_entries = 0
+        for line in content.splitlines():
+            line = line.strip()
+            if line.startswith("{"):
+                try:
+                    ip_range = json.loads(line).get("cidr")
+                except (ValueError, AttributeError):
+                    logging.debug(f"Skipping malformed block list entry '{line}'")
+                    n_invalid_entries += 1
+                    continue
+            else:
+                ip_range = line.split(";", 1)[0].split("#", 1)[0].strip()
+            if not ip_range:
+                continue
+            try:
+                if not isinstance(ip_range, str):
+                    raise TypeError(f"'{ip_range}' is not a string")
+                ip_ranges.append(ipaddress.ip_network(ip_range, strict=False).compressed)
+            except (TypeError, ValueError):
+                logging.debug(f"Skipping invalid block list entry '{ip_range}'")
+                n_invalid_entries += 1
+        if n_invalid_entries > 0:
+            logging.warning(f"Skipped {n_invalid_entries} invalid block list entries")
+        return ip_ranges
+
+    def read_source(self, source: str) -> str:
+        """
+        This method reads the contents of a block list from a file or from an HTTP(S) URL
+        :param source: the path or the URL of the block list
+        :return: the contents of the block list
+        """
+        if source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(source, timeout=BlockListLoader._URL_TIMEOUT) as response:
+                return response.read().decode("utf-8", errors="replace")
+        with open(source) as block_list_file:
+            return block_list_file.read()
+
+    def load(self) -> IPRangeIndex:
+        """
+        This method loads all of the block lists and merges them into a new index
+        :return: the new index of IP ranges. None if any of the block lists couldn't be loaded, so that a partial list
+        never replaces a complete one.
+        """
+        ip_ranges = []
+        for source in self.sources:
+            try:
+                ip_ranges.extend(BlockListLoader.parse_block_list(self.read_source(source)))
+            except Exception as e:
+                logging.warning(f"Block list '{source}' couldn't be loaded: {e.__class__.__name__} - {e}")
+                return None
+        return IPRangeIndex(ip_ranges)
+
+    def refresh(self, black_list_filter: BlackListFilter) -> bool:
+        """
+        This method loads the block lists and swaps them into the filter, along with its bundled IP ranges
+        :param black_list_filter: the filter whose block list IP ranges are replaced
+        :return: True, if the IP ranges were replaced; False, if they couldn't be loaded (the filter keeps the \
+        previous ones)
+        """
+        ip_range_index = self.load()
+        if ip_range_index is None:
+            return False
+        black_list_filter.set_block_list_index(ip_range_index)
+        logging.info(f"Loaded {len(ip_range_index)} black-listed IP ranges from {len(self.sources)} block lists")
+        return True
+
+    def launch_loader_daemon(self, black_list_filter: BlackListFilter):
+        """
+        This method launches a daemon which loads the block lists right away and then every 'refresh_frequency'
+        seconds. The new indexes are built in the daemon, so the filter keeps using the previous one meanwhile.
+        :param black_list_filter: the filter whose block list IP ranges are replaced
+        """
+        loader_daemon = th.Thread(target=BlockListLoader.__daemon_job, args=(self, black_list_filter, self.killer),
+                                  name="BlockListLoader", daemon=True)
+        loader_daemon.start()
+
+    @staticmethod
+    def __daemon_job(loader, black_list_filter: BlackListFilter, killer: GracefulKiller):
+        """
+        This static method is used by the loader daemon to refresh the block lists until a shutdown signal is received
+        :param loader: the BlockListLoader instance
+        :param black_list_filter: the filter whose block list IP ranges are replaced
+        :param killer: The GracefulKiller object for graceful shutdown
+        """
+        while not killer.kill_now:
+            loader.refresh(black_list_filter)
+            if killer.wait(loader.refresh_frequency):
+                break
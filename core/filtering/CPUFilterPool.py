@@ -0,0 +1,117 @@
+import logging
+import logging.handlers
+import multiprocessing
+import signal
+import threading as th
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Sequence
+
+from core.EmailEnvelope import EmailEnvelope
+from core.filtering.filters.Filter import Filter
+
+# The filters held by each worker process (class name: filter object), set up once by its initializer
+_worker_filters = {}
+
+
+def _set_up_worker(filters: Sequence[Filter], log_queue: multiprocessing.Queue, log_level: int):
+    """
+    This function is the initializer of each worker process. It receives a copy of the CPU-bound filters along with
+    their data (e.g. the AI models) once, so that it doesn't need to be sent nor decoded again for every message.
+    :param filters: the CPU-bound filters
+    :param log_queue: the queue through which log records are sent to the parent process' handlers
+    :param log_level: the level of the parent process' root logger
+    """
+    # Shutdown signals are handled by the parent process, which shuts down the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # Spawned processes don't inherit the logging configuration, so their records are handled by the parent process
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root_logger.setLevel(log_level)
+    for filter_object in filters:
+        _worker_filters[filter_object.__class__.__name__] = filter_object
+
+
+def _apply_filter(filter_name: str, peer, mail_from, rcpt_tos, content: bytes) -> bool:
+    """
+    This function applies one of the preloaded filters inside a worker process. The message is received as its raw
+    bytes and parsed again here, since that's far cheaper to transfer than a pickled EmailMessage tree.
+    :param filter_name: the class name of the filter to be applied
+    :param peer: the peer of the SMTP session
+    :param mail_from: the envelope originator
+    :param rcpt_tos: the envelope recipients
+    :param content: the raw message
+    :return: True, if the filter detects the message as spam; False, if it doesn't or if it fails
+    """
+    try:
+        return _worker_filters[filter_name].filter(EmailEnvelope.from_bytes(peer, mail_from, rcpt_tos, content))
+    except Exception as e:
+        logging.warning(f"{filter_name} failed while filtering: {e.__class__.__name__} - {e}")
+        return False
+
+
+class CPUFilterPool:
+    n_processes: int
+    executor: ProcessPoolExecutor
+    log_listener: logging.handlers.QueueListener
+
+    def __init__(self, filters: Sequence[Filter], n_processes: int = 0):
+        """
+        This method creates a pool of worker processes in which the CPU-bound filters are applied, so that they
+        aren't serialized by the GIL and the scoring capacity scales with the number of cores.
+        :param filters: the CPU-bound filters, already set up with their initial data
+        :param n_processes: the number of worker processes (0 sizes it from the number of CPUs)
+        """
+        self.n_processes = n_processes if n_processes > 0 else multiprocessing.cpu_count()
+        # Worker processes are spawned rather than forked, since the parent process is already running threads
+        mp_context = multiprocessing.get_context("spawn")
+        log_queue = mp_context.Queue()
+        root_logger = logging.getLogger()
+        self.log_listener = logging.handlers.QueueListener(log_queue, *root_logger.handlers,
+                                                           respect_handler_level=True)
+        self.log_listener.start()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_processes,
+            mp_context=mp_context,
+            initializer=_set_up_worker,
+            initargs=(list(filters), log_queue, root_logger.getEffectiveLevel())
+        )
+        # The futures not finished yet, so that the pending ones can be cancelled on shutdown
+        self._futures = set()
+        self._futures_lock = th.Lock()
+        filter_names = [filter_object.__class__.__name__ for filter_object in filters]
+        logging.info(f"Launched {self.n_processes} filtering processes for {filter_names}")
+
+    def submit(self, msg: EmailEnvelope, filter_object: Filter) -> Future:
+        """
+        This method submits the application of a CPU-bound filter to an email message to the worker processes
+        :param msg: the email message to be filtered
+        :param filter_object: the filter to be applied (its preloaded copy will be used by the worker process)
+        :return: a future whose result is True if the filter detects msg as spam; False, if it doesn't or if it fails
+        """
+        future = self.executor.submit(_apply_filter, filter_object.__class__.__name__, msg.peer, msg.mail_from,
+                                      msg.rcpt_tos, msg.as_bytes())
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard_future)
+        return future
+
+    def _discard_future(self, future: Future):
+        """
+        This method stops tracking a finished future
+        :param future: the finished future
+        """
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def shutdown(self):
+        """
+        This method shuts down the worker processes once their running tasks are finished. The tasks which haven't
+        started yet are cancelled (ProcessPoolExecutor.shutdown only supports 'cancel_futures' from Python 3.9 on).
+        """
+        with self._futures_lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        self.log_listener.stop()
@@ -0,0 +1,116 @@
+import ipaddress
+from typing import Sequence
+
+
+class ExceptionIndex:
+    """
+    This class compiles the filtering exceptions into lookup structures whose cost doesn't depend on the number of
+    exceptions: hash sets for IP addresses and email addresses, a set of network addresses per prefix length for IP
+    networks and a trie of reversed domain labels for email domains (where '*.domain' matches any of its subdomains).
+    """
+    _END = ""
+    _WILDCARD = "*"
+
+    def __init__(self, ip_addresses: Sequence[str], email_addresses: Sequence[str], email_domains: Sequence[str]):
+        """
+        This method compiles the exceptions.
+        :param ip_addresses: the IP addresses or networks (in CIDR notation) of the excepted peers
+        :param email_addresses: the excepted email addresses
+        :param email_domains: the excepted email domains ('*.domain' excepts all of the subdomains of the domain)
+        """
+        # IP addresses and networks, indexed by IP version. The networks are kept as {prefix length: {network int}}
+        self._ip_addresses = {4: set(), 6: set()}
+        self._ip_networks = {4: {}, 6: {}}
+        for ip_address in ip_addresses:
+            ip_network = ipaddress.ip_network(ip_address, strict=False)
+            if ip_network.num_addresses == 1:
+                self._ip_addresses[ip_network.version].add(int(ip_network.network_address))
+            else:
+                self._ip_networks[ip_network.version].setdefault(ip_network.prefixlen, set()).add(
+                    int(ip_network.network_address)
+                )
+        # Masks of every indexed prefix length, from the most to the least specific one
+        self._ip_masks = {
+            version: [
+                (prefix_length, ExceptionIndex._get_mask(version, prefix_length))
+                for prefix_length in sorted(networks, reverse=True)
+            ]
+            for version, networks in self._ip_networks.items()
+        }
+
+        self._email_addresses = {email_address.lower() for email_address in email_addresses}
+
+        self._domain_trie = {}
+        for email_domain in email_domains:
+            node = self._domain_trie
+            for label in reversed(email_domain.lower().split(".")):
+                if label == ExceptionIndex._WILDCARD:
+                    break
+                node = node.setdefault(label, {})
+            else:
+                label = ExceptionIndex._END
+            node[label] = True
+
+    @staticmethod
+    def _get_mask(version: int, prefix_length: int) -> int:
+        """
+        This utility method computes the network mask of a prefix length as an integer
+        :param version: the IP version (4 or 6)
+        :param prefix_length: the prefix length
+        :return: the network mask
+        """
+        n_bits = 32 if version == 4 else 128
+        return ((1 << prefix_length) - 1) << (n_bits - prefix_length)
+
+    def match_ip(self, peer_ip) -> bool:
+        """
+        This method checks whether a peer IP is one of the excepted IP addresses or belongs to an excepted network
+        :param peer_ip: the peer IP
+        :return: True, if it's an exception; False, if it isn't
+        """
+        if peer_ip is None:
+            return False
+        ip_address = ipaddress.ip_address(peer_ip)
+        ip_int = int(ip_address)
+        if ip_int in self._ip_addresses[ip_address.version]:
+            return True
+        networks = self._ip_networks[ip_address.version]
+        return any(ip_int & mask in networks[prefix_length]
+                   for prefix_length, mask in self._ip_masks[ip_address.version])
+
+    def match_email_address(self, email_address) -> bool:
+        """
+        This method checks whether an email address is one of the excepted email addresses
+        :param email_address: the email address
+        :return: True, if it's an exception; False, if it isn't
+        """
+        return email_address is not None and email_address.lower() in self._email_addresses
+
+    def match_email_domain(self, email_domain) -> bool:
+        """
+        This method checks whether an email domain is one of the excepted email domains or one of their subdomains
+        :param email_domain: the email domain
+        :return: True, if it's an exception; False, if it isn't
+        """
+        if email_domain is None:
+            return False
+        node = self._domain_trie
+        for label in reversed(email_domain.lower().split(".")):
+            if ExceptionIndex._WILDCARD in node:
+                return True
+            node = node.get(label)
+            if node is None:
+                return False
+        return ExceptionIndex._END in node
+
+    def match(self, peer_ip, email_address, email_domain) -> bool:
+        """
+        This method checks whether the peer IP, the email address or the email domain is an exception
+        :param peer_ip: the peer IP
+        :param email_address: the email address
+        :param email_domain: the email domain
+        :return: True, if any of them is an exception; False, if none of them is
+        """
+        return self.match_ip(peer_ip) or \
+            self.match_email_address(email_address) or \
+            self.match_email_domain(email_domain)
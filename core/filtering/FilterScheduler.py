@@ -0,0 +1,77 @@
+import logging
+import threading
+from typing import Sequence
+
+from core.filtering.filters.Filter import Filter
+
+
+class FilterScheduler:
+    reorder_frequency: int
+    pinned_filters: dict
+
+    def __init__(self, reorder_frequency: int, pinned_filters: dict = None):
+        """
+        This method creates a scheduler which keeps running cost and spam-hit-rate statistics for each filter and
+        periodically reorders the filter chain in order to minimize the expected cost per verdict (when threading is
+        enabled, the order is the one in which filters are submitted to the filtering pools).
+        :param reorder_frequency: the number of filtered messages between reorderings
+        :param pinned_filters: the filters that must keep a fixed position in the chain, as a dictionary that maps \
+        the filter class names to their positions
+        """
+        self.reorder_frequency = reorder_frequency
+        self.pinned_filters = pinned_filters if pinned_filters is not None else {}
+        self._stats = {}
+        self._priorities = {}
+        self._n_filtered = 0
+        self._lock = threading.Lock()
+
+    def record(self, filter_object: Filter, elapsed_time: float, is_spam: bool):
+        """
+        This method records the result of applying a filter to a message
+        :param filter_object: the applied filter
+        :param elapsed_time: the number of seconds it took to apply it
+        :param is_spam: whether the filter detected the message as spam
+        """
+        with self._lock:
+            stats = self._stats.setdefault(filter_object.__class__.__name__, [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed_time
+            stats[2] += is_spam
+
+    def message_filtered(self):
+        """
+        This method must be called after each message is filtered. It recomputes the priorities of the filters
+        every 'reorder_frequency' messages.
+        """
+        with self._lock:
+            self._n_filtered += 1
+            if self._n_filtered % self.reorder_frequency != 0:
+                return
+            # Applying a chain of independent filters until one detects spam has the minimum expected cost when they
+            # are sorted by their mean cost divided by their probability of detecting spam (Laplace smoothed)
+            self._priorities = {
+                name: (total_time / n_applied) / ((n_spam + 1) / (n_applied + 2))
+                for name, (n_applied, total_time, n_spam) in self._stats.items()
+            }
+        logging.debug(f"Filter priorities updated: {self._priorities}")
+
+    def order(self, filters: Sequence[Filter]) -> list:
+        """
+        This method sorts a sequence of filters by their current priorities, keeping the pinned filters at their
+        positions. The filters without statistics keep their relative order at the beginning of the chain.
+        :param filters: the filters to be sorted
+        :return: the sorted list of filters
+        """
+        priorities = self._priorities
+        pinned = {}
+        unpinned = []
+        for filter_object in filters:
+            position = self.pinned_filters.get(filter_object.__class__.__name__)
+            if position is None:
+                unpinned.append(filter_object)
+            else:
+                pinned[filter_object] = position
+        ordered = sorted(unpinned, key=lambda filter_object: priorities.get(filter_object.__class__.__name__, 0.0))
+        for filter_object, position in sorted(pinned.items(), key=lambda item: item[1]):
+            ordered.insert(min(position, len(ordered)), filter_object)
+        return ordered
@@ -1,13 +1,23 @@
+import asyncio
 import importlib
+import multiprocessing
 import pkgutil
 import logging
-import threading
+import threading as th
 import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from typing import Sequence
 
 from core.EmailEnvelope import EmailEnvelope
 from core.GracefulKiller import GracefulKiller
+from core.filtering.BlockListLoader import BlockListLoader
+from core.filtering.CPUFilterPool import CPUFilterPool
+from core.filtering.ExceptionIndex import ExceptionIndex
+from core.filtering.FilterScheduler import FilterScheduler
+from core.filtering.SharedBlackList import SharedBlackList
 from core.filtering.StorageManager import StorageManager
+from core.filtering.VerdictCache import VerdictCache
 from core.filtering.filters.BlackListFilter import BlackListFilter
 from core.filtering.filters.Filter import Filter
 from core.filtering.filters.PastFilter import PastFilter
@@ -16,6 +26,8 @@ from core.filtering.filters.AIFilter import AIFilter
 
 class FilteringManager:
     filters: Sequence[Filter]
+    filters_by_stage: dict
+    tiers: list
     storage_mgr: StorageManager
     black_list_filter: BlackListFilter = None
     enable_threading: int
@@ -25,10 +37,28 @@ class FilteringManager:
     storing_frequency: int
     disabled_filters: list
     exceptions: dict
+    exception_index: ExceptionIndex
+    defer_early_filters: bool
+    session_executor: ThreadPoolExecutor
+    filtering_executor: ThreadPoolExecutor
+    verdict_cache: VerdictCache = None
+    filter_scheduler: FilterScheduler = None
+    cpu_filter_pool: CPUFilterPool = None
+    block_list_loader: BlockListLoader = None
+    enable_prefetch: bool
+    prefetch_filters: list
+    _MAX_FILTERING_THREADS: int = 64
 
     def __init__(self, enable_threading: int = 1, black_listing_threshold: int = 10,
                  black_listed_days: int = 10, time_limit: float = 1.5, storing_frequency: int = 300,
-                 disabled_filters: list = [], exceptions=None, killer: GracefulKiller = None):
+                 disabled_filters: list = [], exceptions=None, n_session_threads: int = 0,
+                 n_filtering_threads: int = 0, verdict_cache_size: int = 0, verdict_cache_ttl: float = 300,
+                 verdict_cache_stats_frequency: float = 600,
+                 reorder_frequency: int = 0, pinned_filters: dict = None, tiers: list = None,
+                 enable_process_pool: bool = False, n_filtering_processes: int = 0, block_list_sources: list = None,
+                 block_list_refresh_frequency: int = 3600, shared_state_path: str = None,
+                 shared_state_poll_interval: float = 0.05, enable_prefetch: bool = False,
+                 persist_state: bool = True, killer: GracefulKiller = None):
         """
         This method created a FilteringManager instance. It performs the filtering process.
         :param enable_threading: determines whether to use threads during the filtering process.
@@ -37,7 +67,40 @@ class FilteringManager:
         :param time_limit: the time limit in seconds for the filtering process
         :param storing_frequency: the frequency in seconds for dumping the PastFilters data into disk
         :param disabled_filters: a list of disabled filters
-        :param exceptions: email addresses, domains and sender IPs for which the filtering process is skipped.
+        :param exceptions: email addresses, domains ('*.domain' for all of its subdomains) and sender IPs or networks \
+        for which the filtering process is skipped.
+        :param n_session_threads: the number of threads used for filtering messages outside the asyncio event loop \
+        (0 sizes it from the number of CPUs)
+        :param n_filtering_threads: the number of long-lived threads in which filters are applied when threading is \
+        enabled (0 sizes it so that every filter of every concurrent session can run at once, up to 64 threads, \
+        since each SO_REUSEPORT worker has its own pool)
+        :param verdict_cache_size: the maximum number of verdicts cached for duplicate messages (0 disables the cache)
+        :param verdict_cache_ttl: the number of seconds during which a cached verdict is valid
+        :param verdict_cache_stats_frequency: the interval in seconds with which the usage statistics of the verdict \
+        cache are logged
+        :param reorder_frequency: the number of filtered messages between reorderings of the filters of each tier by \
+        expected cost (0 disables adaptive ordering). Filters are applied in that order, or submitted in that order \
+        to the filtering pools if threading is enabled.
+        :param pinned_filters: the filters that keep a fixed position in their tier (class name: position)
+        :param tiers: the tiers in which the filters are applied, in order, as a list of dictionaries with the tier's \
+        'name', its 'filters' (class names) and its 'time_limit'. Spam detected in a tier skips the following ones. \
+        Filters not included in any tier are applied in a last tier with the whole time limit.
+        :param enable_process_pool: determines whether the CPU-bound filters are applied in worker processes (they are \
+        applied in-process if the worker processes can't be launched or break)
+        :param n_filtering_processes: the number of worker processes for CPU-bound filters (0 sizes it from the \
+        number of CPUs)
+        :param block_list_sources: the paths or HTTP(S) URLs of block lists (e.g. Spamhaus DROP) which periodically \
+        replace the black-listed IP ranges of the BlackListFilter (None or empty keeps the stored ones)
+        :param block_list_refresh_frequency: the frequency in seconds with which the block lists are loaded again
+        :param shared_state_path: the path of the SQLite database through which the black-listed peers are shared with \
+        other worker processes (None keeps them in this process only)
+        :param shared_state_poll_interval: the interval in seconds with which other workers' updates are polled
+        :param enable_prefetch: determines whether the filters prefetch the data of the sender domain (e.g. its SPF \
+        policy) as soon as the envelope originator is received
+        :param persist_state: determines whether the PastFilters data is stored to disk. When several worker processes \
+        share the data directory, only one of them stores it (its own view of the data: the black-listed peers of the \
+        other workers are only included if they are shared through 'shared_state_path'), since the files would \
+        otherwise be overwritten with each worker's partial data.
         :param killer: The GracefulKiller object for graceful shutdown
         """
         self.enable_threading = enable_threading
@@ -45,10 +108,51 @@ class FilteringManager:
         self.black_listed_days = black_listed_days
         self.time_limit = time_limit
         self.disabled_filters = disabled_filters
-        self.exceptions = exceptions
+        self.enable_prefetch = enable_prefetch
+        self.exceptions = exceptions if exceptions is not None else \
+            {"ip_addresses": [], "email_addresses": [], "email_domains": []}
+        self.exception_index = ExceptionIndex(
+            ip_addresses=self.exceptions["ip_addresses"],
+            email_addresses=self.exceptions["email_addresses"],
+            email_domains=self.exceptions["email_domains"]
+        )
+        # Email exceptions are matched against the 'From' header, which isn't known before DATA
+        self.defer_early_filters = bool(self.exceptions["email_addresses"] or self.exceptions["email_domains"])
+        if n_session_threads == 0:
+            n_session_threads = min(32, multiprocessing.cpu_count() + 4)
+        self.session_executor = ThreadPoolExecutor(
+            max_workers=n_session_threads,
+            thread_name_prefix="FilteringSession"
+        )
+        if verdict_cache_size > 0:
+            self.verdict_cache = VerdictCache(verdict_cache_size, verdict_cache_ttl, verdict_cache_stats_frequency)
+        if reorder_frequency > 0:
+            self.filter_scheduler = FilterScheduler(reorder_frequency, pinned_filters)
         self.storage_mgr = StorageManager("data/", storing_frequency, killer)
         self.set_up_filters()
-        self.storage_mgr.launch_storage_daemon(self.filters)
+        self.set_up_tiers(tiers if tiers is not None else [])
+        self.prefetch_filters = [
+            filter_object for filter_object in self.filters if type(filter_object).prefetch is not Filter.prefetch
+        ]
+        if shared_state_path and self.black_list_filter:
+            self.black_list_filter.set_shared_black_list(
+                SharedBlackList(shared_state_path, shared_state_poll_interval, killer)
+            )
+        if persist_state:
+            self.storage_mgr.launch_storage_daemon(self.filters)
+        if block_list_sources and self.black_list_filter:
+            self.block_list_loader = BlockListLoader(block_list_sources, block_list_refresh_frequency, killer)
+            self.block_list_loader.launch_loader_daemon(self.black_list_filter)
+        self._cpu_filter_pool_lock = th.Lock()
+        if enable_process_pool:
+            self.set_up_cpu_filter_pool(n_filtering_processes)
+        if n_filtering_threads == 0:
+            n_filtering_threads = max(1, min(FilteringManager._MAX_FILTERING_THREADS,
+                                             len(self.filters) * n_session_threads))
+        self.filtering_executor = ThreadPoolExecutor(
+            max_workers=n_filtering_threads,
+            thread_name_prefix="FilterThread"
+        )
 
     def set_up_filters(self):
         """
@@ -92,11 +196,121 @@ class FilteringManager:
                 data = self.storage_mgr.load_data(filter_class)
                 filter_object.set_initial_data(data)
 
-    def apply_filters(self, msg: EmailEnvelope):
+        # Group filters by the earliest SMTP stage at which they can be applied
+        self.filters_by_stage = {
+            stage: [filter_object for filter_object in self.filters if filter_object.stage == stage]
+            for stage in Filter.STAGES
+        }
+
+    def set_up_cpu_filter_pool(self, n_filtering_processes: int):
+        """
+        This method launches the filtering processes in which the CPU-bound filters are applied, unless there are no
+        such filters. If they can't be launched, the CPU-bound filters are applied in-process instead.
+
+        :param n_filtering_processes: the number of worker processes (0 sizes it from the number of CPUs)
+        """
+        cpu_bound_filters = [filter_object for filter_object in self.filters if filter_object.cpu_bound]
+        if not cpu_bound_filters:
+            return
+        try:
+            self.cpu_filter_pool = CPUFilterPool(cpu_bound_filters, n_filtering_processes)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Filtering processes couldn't be launched: {e.__class__.__name__} - {e}. "
+                            f"Applying the CPU-bound filters in-process instead.")
+
+    def disable_cpu_filter_pool(self, cpu_filter_pool: CPUFilterPool, error: Exception):
+        """
+        This method stops applying the CPU-bound filters in the filtering processes once they are broken (e.g. because
+        one of them was killed), so that they are applied in-process from then on. The broken pool is shut down.
+
+        :param cpu_filter_pool: the broken pool of filtering processes
+        :param error: the error raised by the broken pool
+        """
+        with self._cpu_filter_pool_lock:
+            if self.cpu_filter_pool is not cpu_filter_pool:
+                return
+            self.cpu_filter_pool = None
+        logging.warning(f"Filtering processes are broken: {error.__class__.__name__} - {error}. "
+                        f"Applying the CPU-bound filters in-process from now on.")
+        cpu_filter_pool.shutdown()
+
+    def set_up_tiers(self, tiers: list):
+        """
+        This method sets up the tiers of filters from their configuration, leaving out the disabled filters
+
+        :param tiers: the configured tiers, as a list of dictionaries with 'name', 'filters' and 'time_limit'
+        """
+        filters_by_name = {filter_object.__class__.__name__: filter_object for filter_object in self.filters}
+        self.tiers = []
+        for tier in tiers:
+            tier_filters = [filters_by_name.pop(name) for name in tier["filters"] if name in filters_by_name]
+            self.tiers.append((tier["name"], tier_filters, tier["time_limit"]))
+        if filters_by_name:
+            self.tiers.append(("default", list(filters_by_name.values()), self.time_limit))
+        logging.info("Filtering tiers: " + ", ".join(
+            f"{name} ({', '.join(filter_object.__class__.__name__ for filter_object in tier_filters)}; {time_limit}s)"
+            for name, tier_filters, time_limit in self.tiers
+        ))
+
+    def apply_early_filters(self, stage: str, msg: EmailEnvelope):
+        """
+        This method applies the filters declared for an SMTP stage prior to DATA (CONNECT, MAIL or RCPT), so that spam
+        can be rejected before the message is transferred. These filters are expected to be cheap, so they are applied
+        sequentially. Only the peer IP and the envelope originator can be checked against the exceptions at this point,
+        so if there are exceptions for email addresses or domains (which are matched against the 'From' header), no
+        filter is applied here and they are all deferred to DATA instead (see get_data_stages).
+
+        :param stage: the SMTP stage whose filters will be applied
+        :param msg: The envelope received so far (without message contents)
+        :return: True, if msg is detected as spam; False, if else
+        """
+        if self.defer_early_filters or not self.filters_by_stage[stage]:
+            return False
+        is_exception = self.check_if_exception(
+            peer_ip=msg.peer[0],
+            email_address=msg.mail_from,
+            email_domain=msg.get_envelope_sender_domain()
+        )
+        if is_exception:
+            return False
+
+        for filter_object in self.filters_by_stage[stage]:
+            if filter_object.filter(msg):
+                if self.black_list_filter:
+                    self.black_list_filter.update_black_list(msg.peer[0])
+                return True
+        return False
+
+    async def apply_early_filters_async(self, stage: str, msg: EmailEnvelope):
+        """
+        This asynchronous method applies the filters declared for an SMTP stage prior to DATA without blocking the
+        asyncio event loop (see apply_early_filters). Stages without filters (or whose filters are deferred) return
+        right away, without going through the session executor.
+
+        :param stage: the SMTP stage whose filters will be applied
+        :param msg: The envelope received so far (without message contents)
+        :return: True, if msg is detected as spam; False, if else
+        """
+        if self.defer_early_filters or not self.filters_by_stage[stage]:
+            return False
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.session_executor, self.apply_early_filters, stage, msg)
+
+    def get_data_stages(self) -> tuple:
+        """
+        This method returns the SMTP stages whose filters have to be applied once the message has been received: only
+        DATA, unless the filters of the previous stages were deferred by apply_early_filters
+        :return: the SMTP stages to be passed to apply_filters
+        """
+        return Filter.STAGES if self.defer_early_filters else ("DATA",)
+
+    def apply_filters(self, msg: EmailEnvelope, stages: Sequence[str] = Filter.STAGES):
         """
         When called, this method applies all filters to the email message. Hence, deciding whether it is spam or not.
 
         :param msg: The email message to be filtered
+        :param stages: the SMTP stages whose filters will be applied (all of them by default). Filters belonging to \
+        stages that were already applied through apply_early_filters can be skipped this way.
         :return: True, if msg is detected as spam; False, if else
         """
 
@@ -110,84 +324,305 @@ class FilteringManager:
         if is_exception:
             return False
 
-        # Apply filters to the message.
-        # If threading is enabled, launch a thread for each filter.
-        # If not, then apply filters sequentially.
-        is_spam = False
-        if self.enable_threading:
-
-            # Launch a thread for each filter
-            n_filtering_threads = len(self.filters)
-            all_checks = [0] * n_filtering_threads
-            for filter_index in range(n_filtering_threads):
-                worker = threading.Thread(
-                    target=self.check_if_spam,
-                    name=f"FilterThread-{self.filters[filter_index].__class__.__name__}",
-                    args=(msg, filter_index, all_checks)
-                )
-                worker.start()
-
-            # Check the results of each thread while:
-            #   - All of them haven't finished
-            #   - One detects spam
-            #   - The time limit isn't exceeded
-            n_finished = 0
-            start_time = time.time()
-            current_time = 0.0
-            while not is_spam and n_finished < n_filtering_threads and current_time < self.time_limit:
-                n_finished = 0
-                filter_index = 0
-                n_filters = len(self.filters)
-                while not is_spam and filter_index < n_filters and current_time < self.time_limit:
-                    is_spam = all_checks[filter_index] == -1
-                    if all_checks[filter_index] == 1:
-                        n_finished += 1
-                    filter_index += 1
-                    current_time = time.time() - start_time
-        else:
+        # If an identical message (same normalized body, sender domain and peer network) was recently filtered,
+        # return its cached verdict
+        fingerprint = None
+        if self.verdict_cache is not None:
+            fingerprint = VerdictCache.get_fingerprint(msg, *stages)
+            cached_verdict = self.verdict_cache.get(fingerprint)
+            if cached_verdict is not None:
+                logging.debug(f"Cached verdict found for message (spam: {cached_verdict})")
+                if cached_verdict and self.black_list_filter:
+                    self.black_list_filter.update_black_list(msg.peer[0])
+                return cached_verdict
 
-            # Apply all filters while spam isn't detected and there are filters to apply
-            n_filters = len(self.filters)
-            current_filter = 0
-            start_time = time.time()
-            current_time = 0.0
-            while not is_spam and current_filter < n_filters and current_time < self.time_limit:
-                is_spam = self.filters[current_filter].filter(msg)
-                current_time = time.time() - start_time
-                current_filter += 1
+        # Apply the filters of each tier to the message, each tier within its own time limit (and within the overall
+        # time limit), until one of them detects spam. Once the overall deadline passes, the remaining tiers are skipped.
+        is_spam = False
+        time_limit_exceeded = False
+        start_time = time.monotonic()
+        deadline = start_time + self.time_limit
+        for tier_name, tier_filters, tier_time_limit in self.tiers:
+            filters = [filter_object for filter_object in tier_filters if filter_object.stage in stages]
+            if not filters:
+                continue
+            current_time = time.monotonic()
+            if current_time >= deadline:
+                time_limit_exceeded = True
+                logging.debug(f"Overall time limit reached before the '{tier_name}' tier in filtering process.")
+                break
+            is_spam, tier_time_limit_exceeded = self._run_filters(msg, filters,
+                                                                  min(current_time + tier_time_limit, deadline))
+            if tier_time_limit_exceeded:
+                time_limit_exceeded = True
+                logging.debug(f"Time limit of the '{tier_name}' tier exceeded in filtering process.")
+            if is_spam:
+                break
+        current_time = time.monotonic() - start_time
+        if self.filter_scheduler is not None:
+            self.filter_scheduler.message_filtered()
 
         # If spam is detected, update the black list (if needed) and return True
         if is_spam:
+            if self.verdict_cache is not None:
+                self.verdict_cache.put(fingerprint, True)
             if self.black_list_filter:
                 self.black_list_filter.update_black_list(msg.peer[0])
             return True
 
-        # If the time limit was exceeded, log debug message
-        if current_time >= self.time_limit:
+        # If the time limit was exceeded, log debug message. Else, cache the verdict (inconclusive ones aren't cached)
+        if time_limit_exceeded:
             logging.debug(f"Time limit ({self.time_limit}) exceeded in filtering process ({current_time}). "
                           f"Hence, returning False.")
+        elif self.verdict_cache is not None:
+            self.verdict_cache.put(fingerprint, False)
 
         return False
 
+    def apply_filters_batch(self, msgs: Sequence[EmailEnvelope], stages: Sequence[str] = Filter.STAGES,
+                            update_black_list: bool = True) -> list:
+        """
+        This method applies all filters to several email messages at once (e.g. for re-scoring stored messages or for
+        draining a queue). Each filter is given the whole batch, so that it can share work across it (e.g. one DNS
+        lookup per sender domain or one model prediction per batch). Unlike apply_filters, every filter is applied
+        to every message, with no time limit nor verdict cache, so that the verdict of each filter can be reported.
+
+        :param msgs: The email messages to be filtered
+        :param stages: the SMTP stages whose filters will be applied (all of them by default)
+        :param update_black_list: determines whether the peers of the messages detected as spam are counted towards \
+        black listing, as they would be by apply_filters
+        :return: A list with a dictionary for each message, containing whether it 'is_spam' and the verdict of each \
+        one of the applied 'filters' (by class name). Messages which are exceptions aren't filtered at all.
+        """
+        results = [{"is_spam": False, "filters": {}} for _ in msgs]
+        to_filter = [
+            index for index, msg in enumerate(msgs)
+            if not self.check_if_exception(
+                peer_ip=msg.peer[0],
+                email_address=msg.get_parsed_from(),
+                email_domain=msg.get_sender_domain()
+            )
+        ]
+        batch = [msgs[index] for index in to_filter]
+
+        # Apply each filter to the whole batch (in the filtering thread pool, if threading is enabled)
+        filters = [filter_object for stage in stages for filter_object in self.filters_by_stage[stage]]
+        if self.enable_threading:
+            futures = [self.filtering_executor.submit(self.check_if_spam_batch, batch, filter_object)
+                       for filter_object in filters]
+            verdicts_by_filter = [future.result() for future in futures]
+        else:
+            verdicts_by_filter = [self.check_if_spam_batch(batch, filter_object) for filter_object in filters]
+
+        # Gather the verdicts of each message
+        for filter_object, verdicts in zip(filters, verdicts_by_filter):
+            for index, verdict in zip(to_filter, verdicts):
+                results[index]["filters"][filter_object.__class__.__name__] = verdict
+                results[index]["is_spam"] = results[index]["is_spam"] or verdict
+        if update_black_list and self.black_list_filter:
+            for index in to_filter:
+                if results[index]["is_spam"]:
+                    self.black_list_filter.update_black_list(msgs[index].peer[0])
+
+        logging.info(f"Filtered a batch of {len(msgs)} messages "
+                     f"({sum(result['is_spam'] for result in results)} detected as spam)")
+        return results
+
+    def _run_filters(self, msg: EmailEnvelope, filters: Sequence[Filter], deadline: float) -> tuple:
+        """
+        This method applies a group of filters to the email message until one of them detects spam, all of them are
+        applied or the deadline is reached. If threading is enabled, each filter is applied in the filtering thread
+        pool (or in the filtering processes, if CPU-bound). If not, then filters are applied sequentially (a filter
+        already being applied in this thread can't be interrupted, so it may overrun the deadline).
+
+        :param msg: The email message to be filtered
+        :param filters: The filters to be applied
+        :param deadline: The time.monotonic() timestamp by which the filters must have been applied
+        :return: a tuple with whether msg is detected as spam and whether the deadline was exceeded
+        """
+        is_spam = False
+        if self.filter_scheduler is not None:
+            filters = self.filter_scheduler.order(filters)
+        if self.enable_threading:
+
+            # Submit a task for each filter to the filtering thread pool (or to the filtering processes, if CPU-bound),
+            # in order of expected cost if adaptive ordering is enabled, so that the cheapest filters are started first
+            # when the pools are busy
+            filters_by_future = {self.submit_filter(msg, filter_object): filter_object for filter_object in filters}
+            pending = set(filters_by_future)
+
+            # Block until one of the filters detects spam, all of them finish or the deadline is reached
+            remaining_time = deadline - time.monotonic()
+            while not is_spam and pending and remaining_time > 0:
+                finished, pending = wait(pending, timeout=remaining_time, return_when=FIRST_COMPLETED)
+                is_spam = any(self.get_verdict(future, filters_by_future[future]) for future in finished)
+                remaining_time = deadline - time.monotonic()
+            time_limit_exceeded = not is_spam and bool(pending)
+
+            # Cancel the tasks that haven't started yet. The running ones are abandoned and their results ignored.
+            for future in pending:
+                future.cancel()
+        else:
+
+            # Apply all filters while spam isn't detected and there are filters to apply
+            # (in order of expected cost, if adaptive ordering is enabled)
+            n_filters = len(filters)
+            current_filter = 0
+            while not is_spam and current_filter < n_filters and time.monotonic() < deadline:
+                filter_object = filters[current_filter]
+                if self.cpu_filter_pool is not None and filter_object.cpu_bound:
+                    # The filtering processes can be waited for only until the deadline
+                    future = self.submit_filter(msg, filter_object)
+                    finished, pending = wait([future], timeout=max(0.0, deadline - time.monotonic()))
+                    if pending:
+                        future.cancel()
+                        break
+                    is_spam = self.get_verdict(future, filter_object)
+                else:
+                    is_spam = self.check_if_spam(msg, filter_object)
+                current_filter += 1
+            time_limit_exceeded = not is_spam and current_filter < n_filters
+        return is_spam, time_limit_exceeded
+
+    async def apply_filters_async(self, msg: EmailEnvelope, stages: Sequence[str] = Filter.STAGES):
+        """
+        This asynchronous method applies all filters to the email message without blocking the asyncio event loop.
+        The filtering process is run in the session executor, so that several SMTP sessions can be filtered at once.
+
+        :param msg: The email message to be filtered
+        :param stages: the SMTP stages whose filters will be applied (all of them by default)
+        :return: True, if msg is detected as spam; False, if else
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.session_executor, self.apply_filters, msg, stages)
+
+    def prefetch(self, domain: str):
+        """
+        This method makes the filters prefetch the data they need for a sender domain. The lookups are submitted to
+        the filtering threads and their results are kept in the filters' caches, so this method returns immediately.
+        :param domain: the domain of the envelope originator (nothing is prefetched if it is None or an exception)
+        """
+        if not self.enable_prefetch or domain is None or \
+                self.check_if_exception(peer_ip=None, email_address=None, email_domain=domain):
+            return
+        for filter_object in self.prefetch_filters:
+            self.filtering_executor.submit(FilteringManager.prefetch_for_filter, domain, filter_object)
+
+    @staticmethod
+    def prefetch_for_filter(domain: str, filter_object: Filter):
+        """
+        This static method makes one of the filters prefetch the data of a sender domain. Failures are only logged,
+        since the filter will look the data up again when it is applied.
+        :param domain: the domain of the envelope originator
+        :param filter_object: the filter
+        """
+        try:
+            filter_object.prefetch(domain)
+        except Exception as e:
+            logging.debug(f"{filter_object.__class__.__name__} couldn't prefetch the data of '{domain}': "
+                          f"{e.__class__.__name__} - {e}")
+
     def check_if_exception(self, peer_ip, email_address, email_domain):
         """
         This method checks whether the peer IP, the email address or the email domain from which the email is sent is one of the exceptions described in the 'conf/filterin.json' file.
+        The exceptions are looked up in an index, so the cost of the check doesn't grow with the number of exceptions.
         :param peer_ip: the peer IP which sent the email
         :param email_address: the email sender's email address
         :param email_domain: the email sender's domain
         :return: True, if it's an exception; False, if it isn't
         """
-        return peer_ip in self.exceptions["ip_addresses"] or \
-               email_address in self.exceptions["email_addresses"] or \
-               email_domain in self.exceptions["email_domains"]
+        return self.exception_index.match(peer_ip, email_address, email_domain)
 
-    def check_if_spam(self, msg, filter_index, all_checks):
+    def submit_filter(self, msg: EmailEnvelope, filter_object: Filter) -> Future:
         """
-        This method is executed by the filter threads when 'enable_threading' is set to True for the FilteringManager.
-        Each thread applies one of the filters to the email message and determines whether it is spam or not.
+        This method submits the application of a filter to the email message. CPU-bound filters are applied in the
+        filtering processes (if enabled), since they would be serialized by the GIL in the filtering threads. If the
+        filtering processes are broken, the filter is applied in the filtering threads instead.
         :param msg: the email message to be filtered
-        :param filter_index: the index of the specific filter
-        :param all_checks: a list of 0s, where the thread will write the result of the filter to the filter_index position. It will write -1 if msg is spam and 1 if it isn't.
+        :param filter_object: the filter to be applied
+        :return: a future whose result is True if the filter detects msg as spam; False, if it doesn't or if it fails
+        """
+        cpu_filter_pool = self.cpu_filter_pool
+        if cpu_filter_pool is not None and filter_object.cpu_bound:
+            try:
+                future = cpu_filter_pool.submit(msg, filter_object)
+            except BrokenProcessPool as e:
+                self.disable_cpu_filter_pool(cpu_filter_pool, e)
+                return self.filtering_executor.submit(self.check_if_spam, msg, filter_object)
+            if self.filter_scheduler is not None:
+                submission_time = time.perf_counter()
+                future.add_done_callback(
+                    lambda finished: self.record_filter(finished, filter_object, time.perf_counter() - submission_time)
+                )
+            return future
+        return self.filtering_executor.submit(self.check_if_spam, msg, filter_object)
+
+    def record_filter(self, future: Future, filter_object: Filter, elapsed_time: float):
+        """
+        This method records the application of a filter in the filtering processes for adaptive ordering, unless its
+        task was cancelled or failed
+        :param future: the finished Future of the task applying the filter
+        :param filter_object: the applied filter
+        :param elapsed_time: the number of seconds since the task was submitted
+        """
+        if not future.cancelled() and future.exception() is None:
+            self.filter_scheduler.record(filter_object, elapsed_time, future.result())
+
+    def shutdown(self):
         """
-        is_spam = self.filters[filter_index].filter(msg)
-        all_checks[filter_index] = -1 if is_spam else 1
+        This method shuts down the filtering processes (if any), which aren't stopped automatically in worker processes,
+        and logs the final usage statistics of the verdict cache (if enabled)
+        """
+        if self.verdict_cache is not None:
+            self.verdict_cache.log_stats()
+        if self.cpu_filter_pool is not None:
+            self.cpu_filter_pool.shutdown()
+
+    def check_if_spam_batch(self, msgs: Sequence[EmailEnvelope], filter_object: Filter) -> list:
+        """
+        This method applies one of the filters to several email messages at once
+        :param msgs: the email messages to be filtered
+        :param filter_object: the filter to be applied
+        :return: a list with the verdict of the filter for each message (all of them False if the filter fails)
+        """
+        try:
+            return filter_object.filter_batch(msgs)
+        except Exception as e:
+            logging.warning(f"{filter_object.__class__.__name__} failed while filtering a batch: "
+                            f"{e.__class__.__name__} - {e}")
+            return [False] * len(msgs)
+
+    def check_if_spam(self, msg, filter_object):
+        """
+        This method applies one of the filters to the email message and determines whether it is spam or not. It is
+        executed by the filter threads when 'enable_threading' is set to True for the FilteringManager. The cost and
+        the verdict of the filter are recorded for adaptive ordering (if enabled).
+        :param msg: the email message to be filtered
+        :param filter_object: the filter to be applied
+        :return: True, if the filter detects msg as spam; False, if it doesn't or if it fails
+        """
+        start_time = time.perf_counter()
+        try:
+            is_spam = filter_object.filter(msg)
+        except Exception as e:
+            logging.warning(f"{filter_object.__class__.__name__} failed while filtering: {e.__class__.__name__} - {e}")
+            is_spam = False
+        if self.filter_scheduler is not None:
+            self.filter_scheduler.record(filter_object, time.perf_counter() - start_time, is_spam)
+        return is_spam
+
+    @staticmethod
+    def get_verdict(future: Future, filter_object: Filter) -> bool:
+        """
+        This static method returns the verdict of a filter applied in the filtering thread pool or in the filtering
+        processes. Just like check_if_spam, a filter whose task fails (e.g. because the filtering processes broke) or is
+        cancelled (e.g. while shutting down) counts as not detecting spam.
+        :param future: the finished Future of the task applying the filter
+        :param filter_object: the applied filter
+        :return: True, if the filter detects msg as spam; False, if it doesn't or if it fails
+        """
+        try:
+            return future.result()
+        except (Exception, CancelledError) as e:
+            logging.warning(f"{filter_object.__class__.__name__} failed while filtering: {e.__class__.__name__} - {e}")
+            return False
@@ -0,0 +1,190 @@
+import ipaddress
+import sys
+from bisect import bisect_right
+from typing import Iterable
+
+
+class IPRangeIndex:
+    """
+    This class compiles a set of IP ranges (IPv4 and IPv6) into sorted arrays of disjoint integer intervals, so that
+    checking whether an IP belongs to any of them is a binary search instead of a walk through every range.
+    """
+
+    def __init__(self, ip_ranges: Iterable[str] = ()):
+        """
+        This method compiles the IP ranges. Overlapping and adjacent ranges are merged.
+        :param ip_ranges: the IP ranges in CIDR notation (single IP addresses are also accepted)
+        """
+        intervals = {4: [], 6: []}
+        for ip_range in ip_ranges:
+            ip_network = ipaddress.ip_network(ip_range, strict=False)
+            intervals[ip_network.version].append(
+                (int(ip_network.network_address), int(ip_network.broadcast_address))
+            )
+        self._starts = {}
+        self._ends = {}
+        for version, version_intervals in intervals.items():
+            merged = IPRangeIndex.merge_intervals(version_intervals)
+            self._starts[version] = [start for start, end in merged]
+            self._ends[version] = [end for start, end in merged]
+
+    @staticmethod
+    def merge_intervals(intervals: list) -> list:
+        """
+        This utility method merges the overlapping and adjacent intervals of a list
+        :param intervals: a list of (first IP, last IP) integer tuples
+        :return: the sorted list of merged intervals
+        """
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    @classmethod
+    def _from_intervals(cls, intervals: dict):
+        """
+        This class method creates an index from already merged intervals
+        :param intervals: a dictionary which maps each IP version (4 and 6) to its sorted list of disjoint intervals
+        :return: the new index
+        """
+        ip_range_index = cls()
+        for version, version_intervals in intervals.items():
+            ip_range_index._starts[version] = [start for start, end in version_intervals]
+            ip_range_index._ends[version] = [end for start, end in version_intervals]
+        return ip_range_index
+
+    def _get_intervals(self, version: int) -> list:
+        """
+        This method returns the intervals of an IP version
+        :param version: the IP version (4 or 6)
+        :return: the sorted list of disjoint (first IP, last IP) integer tuples
+        """
+        return list(zip(self._starts[version], self._ends[version]))
+
+    def union(self, other):
+        """
+        This method computes the union of two indexes
+        :param other: the other index
+        :return: a new index with the IPs which belong to either of them
+        """
+        return IPRangeIndex._from_intervals({
+            version: IPRangeIndex.merge_intervals(self._get_intervals(version) + other._get_intervals(version))
+            for version in (4, 6)
+        })
+
+    def difference(self, other):
+        """
+        This method computes the difference of two indexes
+        :param other: the other index
+        :return: a new index with the IPs which belong to this index but not to the other one
+        """
+        intervals = {}
+        for version in (4, 6):
+            remaining = []
+            other_intervals = other._get_intervals(version)
+            other_index = 0
+            for start, end in self._get_intervals(version):
+                # Skip the other intervals which end before this one starts, then cut out the overlapping ones
+                while other_index < len(other_intervals) and other_intervals[other_index][1] < start:
+                    other_index += 1
+                current_index = other_index
+                while start <= end and current_index < len(other_intervals) and \
+                        other_intervals[current_index][0] <= end:
+                    other_start, other_end = other_intervals[current_index]
+                    if other_start > start:
+                        remaining.append((start, other_start - 1))
+                    start = max(start, other_end + 1)
+                    current_index += 1
+                if start <= end:
+                    remaining.append((start, end))
+            intervals[version] = remaining
+        return IPRangeIndex._from_intervals(intervals)
+
+    def find(self, ip) -> tuple:
+        """
+        This method looks for the interval which contains an IP
+        :param ip: the IP, either as a string or as an ipaddress object
+        :return: the (first IP, last IP) tuple of the interval as ipaddress objects. None if the IP isn't in any.
+        """
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        ip_int = int(ip)
+        starts = self._starts[ip.version]
+        index = bisect_right(starts, ip_int) - 1
+        if index >= 0 and ip_int <= self._ends[ip.version][index]:
+            ip_class = type(ip)
+            return ip_class(starts[index]), ip_class(self._ends[ip.version][index])
+        return None
+
+    def __contains__(self, ip) -> bool:
+        """
+        This method checks whether an IP belongs to any of the IP ranges
+        :param ip: the IP, either as a string or as an ipaddress object
+        :return: True, if it does; False, if it doesn't
+        """
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        ip_int = int(ip)
+        index = bisect_right(self._starts[ip.version], ip_int) - 1
+        return index >= 0 and ip_int <= self._ends[ip.version][index]
+
+    def __len__(self) -> int:
+        """
+        This method returns the number of disjoint intervals in the index
+        :return: the number of intervals
+        """
+        return sum(len(starts) for starts in self._starts.values())
+
+    def get_memory_usage(self) -> int:
+        """
+        This method estimates the memory used by the index
+        :return: the approximate number of bytes used by the arrays of bounds and the integers in them
+        """
+        n_bytes = sys.getsizeof(self) + sys.getsizeof(self._starts) + sys.getsizeof(self._ends)
+        for bounds in list(self._starts.values()) + list(self._ends.values()):
+            n_bytes += sys.getsizeof(bounds) + sum(sys.getsizeof(bound) for bound in bounds)
+        return n_bytes
+
+    @classmethod
+    def from_data(cls, data: dict):
+        """
+        This class method restores an index from the data returned by get_data, without parsing any IP range
+        :param data: a dictionary which maps each IP version ('4' and '6') to the flat list of its intervals' bounds
+        :return: the restored index
+        """
+        ip_range_index = cls()
+        for version in (4, 6):
+            bounds = data.get(str(version), [])
+            ip_range_index._starts[version] = bounds[0::2]
+            ip_range_index._ends[version] = bounds[1::2]
+        return ip_range_index
+
+    def get_data(self) -> dict:
+        """
+        This method returns a compact, JSON serializable representation of the index
+        :return: a dictionary which maps each IP version ('4' and '6') to the flat list of its intervals' bounds \
+        ([first IP, last IP, first IP, last IP, ...], as integers)
+        """
+        return {
+            str(version): [bound for interval in zip(self._starts[version], self._ends[version]) for bound in interval]
+            for version in (4, 6)
+            if self._starts[version]
+        }
+
+    def get_ip_ranges(self) -> list:
+        """
+        This method returns the minimal list of IP ranges in CIDR notation which covers the same IPs as the index
+        :return: the list of IP ranges
+        """
+        ip_ranges = []
+        for version, ip_class in ((4, ipaddress.IPv4Address), (6, ipaddress.IPv6Address)):
+            for start, end in zip(self._starts[version], self._ends[version]):
+                ip_ranges.extend(
+                    ip_network.compressed
+                    for ip_network in ipaddress.summarize_address_range(ip_class(start), ip_class(end))
+                )
+        return ip_ranges
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.filtering.IPRangeIndex import IPRangeIndex
+
+
+class SPFCache:
+    """
+    This class caches the IP ranges authorized by the SPF records of sender domains for as long as the records' TTLs
+    allow. The IP ranges of each domain are kept compiled into an IPRangeIndex. Domains whose SPF records couldn't be
+    found are cached too (as negative entries, with a shorter TTL), and the least recently used domains are evicted
+    once the cache is full. Domains whose SPF policies can't be compiled into IP ranges (because they depend on more
+    than the sender IP) are cached with the DYNAMIC marker, so that their policies aren't compiled again, and domains
+    whose SPF policies are invalid are cached with the PERMERROR marker (as negative entries).
+    """
+    DYNAMIC = "dynamic"
+    PERMERROR = "permerror"
+    max_size: int
+    min_ttl: float
+    max_ttl: float
+    negative_ttl: float
+
+    def __init__(self, max_size: int = 100000, min_ttl: float = 60, max_ttl: float = 86400,
+                 negative_ttl: float = 300):
+        """
+        This method creates an empty SPF cache.
+        :param max_size: the maximum number of cached domains
+        :param min_ttl: the minimum number of seconds a domain is cached for, whatever the TTL of its records
+        :param max_ttl: the maximum number of seconds a domain is cached for, whatever the TTL of its records
+        :param negative_ttl: the number of seconds a domain without SPF records is cached for
+        """
+        self.max_size = max_size
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        # Domain: (IPRangeIndex, None if negative, DYNAMIC or PERMERROR, expiry timestamp)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain: str) -> tuple:
+        """
+        This method returns the cached IP ranges of a domain, if they haven't expired
+        :param domain: the domain
+        :return: a tuple with whether the domain is cached and the index of its IP ranges (None for negative entries, \
+        DYNAMIC for dynamic policies and PERMERROR for invalid policies)
+        """
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is None:
+                return False, None
+            ip_ranges, expiry_date = entry
+            if expiry_date <= time.time():
+                del self._entries[domain]
+                return False, None
+            self._entries.move_to_end(domain)
+            return True, ip_ranges
+
+    def put(self, domain: str, ip_ranges, ttl: float):
+        """
+        This method caches the IP ranges of a domain
+        :param domain: the domain
+        :param ip_ranges: the index of the IP ranges authorized by its SPF records (or DYNAMIC)
+        :param ttl: the TTL of its SPF records (it is clamped between 'min_ttl' and 'max_ttl')
+        """
+        self._put(domain, ip_ranges, time.time() + min(max(ttl, self.min_ttl), self.max_ttl))
+
+    def put_negative(self, domain: str, marker: str = None):
+        """
+        This method caches that a domain doesn't have valid SPF records
+        :param domain: the domain
+        :param marker: None if the domain has no SPF records, or PERMERROR if they are invalid
+        """
+        self._put(domain, marker, time.time() + self.negative_ttl)
+
+    def _put(self, domain: str, ip_ranges, expiry_date: float):
+        """
+        This method stores an entry, evicting the least recently used one if the cache is full
+        :param domain: the domain
+        :param ip_ranges: the index of the IP ranges of the domain (None for negative entries, DYNAMIC or PERMERROR)
+        :param expiry_date: the expiry timestamp of the entry
+        """
+        with self._lock:
+            self._entries[domain] = (ip_ranges, expiry_date)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        """
+        This method returns the number of cached domains (including the expired ones not evicted yet)
+        :return: the number of cached domains
+        """
+        return len(self._entries)
+
+    def load_data(self, data: dict):
+        """
+        This method loads the entries stored by get_data, whose indexes are restored without parsing any IP range.
+        Entries in the legacy format (a plain list of IP ranges, without expiry) are cached for 'min_ttl' seconds, so
+        that they are looked up again soon. Entries whose IP ranges are a list of strings are also accepted.
+        :param data: a dictionary which maps domains to {'ip_ranges', 'expiry_date'} dictionaries or to legacy lists
+        """
+        current_time = time.time()
+        for domain, entry in data.items():
+            if isinstance(entry, list):
+                self._put(domain, IPRangeIndex(entry), current_time + self.min_ttl)
+            elif entry["expiry_date"] > current_time:
+                ip_ranges = entry["ip_ranges"]
+                if isinstance(ip_ranges, dict):
+                    ip_ranges = IPRangeIndex.from_data(ip_ranges)
+                elif ip_ranges is not None and ip_ranges not in (SPFCache.DYNAMIC, SPFCache.PERMERROR):
+                    ip_ranges = IPRangeIndex(ip_ranges)
+                self._put(domain, ip_ranges, entry["expiry_date"])
+
+    def get_data(self) -> dict:
+        """
+        This method returns the live entries, in order to be stored
+        :return: a dictionary which maps domains to {'ip_ranges', 'expiry_date'} dictionaries, where the IP ranges \
+        are the compact representation of their index (None for negative entries, 'dynamic' for dynamic policies and \
+        'permerror' for invalid policies)
+        """
+        current_time = time.time()
+        with self._lock:
+            entries = list(self._entries.items())
+        return {
+            domain: {
+                "ip_ranges": ip_ranges.get_data() if isinstance(ip_ranges, IPRangeIndex) else ip_ranges,
+                "expiry_date": expiry_date
+            }
+            for domain, (ip_ranges, expiry_date) in entries
+            if expiry_date > current_time
+        }
@@ -0,0 +1,575 @@
+import asyncio
+import ipaddress
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+
+from core.DNSResolver import DNSResolver
+from core.filtering.IPRangeIndex import IPRangeIndex
+
+
+class SPFPermError(Exception):
+    """
+    This exception is raised when an SPF policy can't be evaluated because of a permanent error (an invalid record,
+    too many DNS lookups, a missing included record...)
+    """
+
+
+class SPFTempError(Exception):
+    """
+    This exception is raised when an SPF policy can't be evaluated because of a transient DNS error
+    """
+
+
+class _LookupLimitError(SPFPermError):
+    """
+    This exception is raised when an evaluation exceeds the limit of DNS lookups or void lookups. While compiling a
+    policy, it only means that the whole tree can't be walked at once (check_host may still decide the result for
+    many sender IPs before reaching the limit), so the policy is evaluated for each message instead.
+    """
+
+
+class _DynamicPolicy(Exception):
+    """
+    This exception is raised while compiling an SPF policy whose result depends on more than the sender IP
+    """
+
+
+class _Evaluation:
+    """
+    This class keeps the state of a single evaluation: the identity being checked and the DNS lookups made so far
+    """
+    __slots__ = ("ip", "sender", "n_lookups", "n_void_lookups", "ttl", "uses_sender")
+
+    def __init__(self, ip=None, sender: str = None):
+        """
+        This method creates the state of an evaluation.
+        :param ip: the sender IP (None when a policy is compiled)
+        :param sender: the envelope sender address (None when a policy is compiled)
+        """
+        self.ip = ip
+        self.sender = sender
+        self.n_lookups = 0
+        self.n_void_lookups = 0
+        self.ttl = sys.maxsize
+        self.uses_sender = False
+
+
+class SPFEvaluator:
+    """
+    This class evaluates SPF policies as described in RFC 7208: all of the mechanisms (all, include, a, mx, ptr, ip4,
+    ip6 and exists), their qualifiers, the redirect modifier and macros, within the limits of 10 DNS lookups, 2 void
+    lookups and 10 MX/PTR names per evaluation. Results are memoized per (IP, domain) for as long as the TTLs of the
+    records involved allow.
+    """
+    timeout: float
+    max_lookups: int
+    max_void_lookups: int = 2
+    max_names: int = 10
+    memo_size: int
+    memo_min_ttl: float = 60
+    memo_max_ttl: float = 3600
+
+    _QUALIFIERS = {"+": "pass", "-": "fail", "~": "softfail", "?": "neutral"}
+    _MECHANISMS = ("all", "include", "a", "mx", "ptr", "ip4", "ip6", "exists")
+    _MODIFIER_REGEX = re.compile(r"^([a-z][a-z0-9_.-]*)=(.*)$", re.IGNORECASE)
+    _MECHANISM_REGEX = re.compile(r"^([-+?~]?)([a-z][a-z0-9_.-]*)([:/].*)?$", re.IGNORECASE)
+    _DUAL_CIDR_REGEX = re.compile(r"^(.*?)(?:/(\d+))?(?://(\d+))?$")
+    _MACRO_REGEX = re.compile(r"%(?:\{([a-z])(\d*)(r?)([.+,/_=-]*)\}|(.))", re.IGNORECASE)
+    _TEMP_ERRORS = (dns.exception.Timeout, dns.resolver.NoNameservers)
+    _VOID_ERRORS = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+    _ALL_IPS = IPRangeIndex(["0.0.0.0/0", "::/0"])
+
+    def __init__(self, timeout: float = 2.0, max_lookups: int = 10, memo_size: int = 100000):
+        """
+        This method creates an SPF evaluator.
+        :param timeout: the deadline in seconds for a whole evaluation (including every lookup it requires)
+        :param max_lookups: the maximum number of DNS lookups of an evaluation (RFC 7208 allows 10)
+        :param memo_size: the maximum number of memoized results
+        """
+        self.timeout = timeout
+        self.max_lookups = max_lookups
+        self.memo_size = memo_size
+        # (IP, domain): (result, expiry timestamp, sender or None if the result doesn't depend on it)
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    async def check_host(self, ip, domain: str, sender: str = None) -> str:
+        """
+        This asynchronous method evaluates the SPF policy of a domain for a sender IP
+        :param ip: the sender IP, either as a string or as an ipaddress object
+        :param domain: the domain whose policy is evaluated
+        :param sender: the envelope sender address (used by macros). 'postmaster@domain' if it isn't passed.
+        :return: the result of the evaluation: 'none', 'neutral', 'pass', 'fail', 'softfail', 'temperror' or \
+        'permerror'
+        """
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        if getattr(ip, "ipv4_mapped", None) is not None:
+            ip = ip.ipv4_mapped
+        domain = domain.rstrip(".").lower()
+        sender = sender if sender and "@" in sender else f"postmaster@{domain}"
+
+        result = self._get_memoized(ip, domain, sender)
+        if result is not None:
+            return result
+
+        evaluation = _Evaluation(ip, sender)
+        try:
+            result = await asyncio.wait_for(self._check_host(evaluation, domain), self.timeout)
+        except SPFPermError:
+            result = "permerror"
+        except (SPFTempError, asyncio.TimeoutError):
+            return "temperror"
+        self._memoize(ip, domain, sender if evaluation.uses_sender else None, result, evaluation.ttl)
+        return result
+
+    async def compile_policy(self, domain: str) -> tuple:
+        """
+        This asynchronous method compiles the SPF policy of a domain into the set of IPs for which it passes. This is
+        only possible when the policy depends on nothing but the sender IP (i.e. it has no 'exists' or 'ptr'
+        mechanisms nor macros) and the whole tree of included policies fits within the lookup limits; otherwise, it
+        has to be evaluated for each message with check_host.
+        :param domain: the domain whose policy is compiled
+        :return: a tuple with the kind of policy ('static', 'dynamic', 'none', 'permerror' or 'temperror'), the \
+        IPRangeIndex of the IPs for which it passes (only for static policies) and the number of seconds it can be \
+        cached for (0 if it has to be decided by the caller, i.e. for permanent and transient errors)
+        """
+        domain = domain.rstrip(".").lower()
+        evaluation = _Evaluation()
+        try:
+            pass_set = await asyncio.wait_for(self._compile(evaluation, domain, True), self.timeout)
+        except (SPFTempError, asyncio.TimeoutError):
+            return "temperror", None, 0
+        except (_DynamicPolicy, _LookupLimitError):
+            return "dynamic", None, evaluation.ttl
+        except SPFPermError:
+            return "permerror", None, 0
+        if pass_set is None:
+            return "none", None, evaluation.ttl
+        return "static", pass_set, evaluation.ttl
+
+    def _get_memoized(self, ip, domain: str, sender: str) -> str:
+        """
+        This method returns a memoized result, if it hasn't expired
+        :param ip: the sender IP
+        :param domain: the evaluated domain
+        :param sender: the envelope sender address
+        :return: the memoized result. None if there isn't any.
+        """
+        key = (ip, domain)
+        with self._memo_lock:
+            entry = self._memo.get(key)
+            if entry is None:
+                return None
+            result, expiry_date, memoized_sender = entry
+            if expiry_date <= time.time():
+                del self._memo[key]
+                return None
+            if memoized_sender is not None and memoized_sender != sender:
+                return None
+            self._memo.move_to_end(key)
+            return result
+
+    def _memoize(self, ip, domain: str, sender: str, result: str, ttl: float):
+        """
+        This method memoizes a result, evicting the least recently used one if the memo is full
+        :param ip: the sender IP
+        :param domain: the evaluated domain
+        :param sender: the envelope sender address (None if the result doesn't depend on it)
+        :param result: the result
+        :param ttl: the minimum TTL of the records involved (it is clamped between 'memo_min_ttl' and 'memo_max_ttl')
+        """
+        expiry_date = time.time() + min(max(ttl, self.memo_min_ttl), self.memo_max_ttl)
+        with self._memo_lock:
+            self._memo[(ip, domain)] = (result, expiry_date, sender)
+            self._memo.move_to_end((ip, domain))
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    async def _lookup(self, evaluation: _Evaluation, name: str, rdtype: str, count_void: bool = True) -> list:
+        """
+        This asynchronous method makes a DNS query through the shared resolver
+        :param evaluation: the state of the evaluation
+        :param name: the queried name
+        :param rdtype: the queried record type
+        :param count_void: whether an empty answer counts as a void lookup
+        :return: the list of records (empty if the name doesn't exist or has no records of that type)
+        """
+        try:
+            answer = await DNSResolver.get_shared().resolve_async(name, rdtype)
+        except SPFEvaluator._VOID_ERRORS:
+            if count_void:
+                evaluation.n_void_lookups += 1
+                if evaluation.n_void_lookups > self.max_void_lookups:
+                    raise _LookupLimitError(f"More than {self.max_void_lookups} void lookups")
+            return []
+        except SPFEvaluator._TEMP_ERRORS as e:
+            raise SPFTempError(f"{rdtype} lookup for '{name}' failed: {e.__class__.__name__} - {e}")
+        except dns.exception.DNSException as e:
+            raise SPFPermError(f"{rdtype} lookup for '{name}' failed: {e.__class__.__name__} - {e}")
+        evaluation.ttl = min(evaluation.ttl, answer.ttl)
+        return list(answer)
+
+    def _count_lookup(self, evaluation: _Evaluation):
+        """
+        This method counts a lookup made by a mechanism or by the redirect modifier
+        :param evaluation: the state of the evaluation
+        """
+        evaluation.n_lookups += 1
+        if evaluation.n_lookups > self.max_lookups:
+            raise _LookupLimitError(f"More than {self.max_lookups} DNS lookups")
+
+    async def _get_record(self, evaluation: _Evaluation, domain: str, count_void: bool) -> str:
+        """
+        This asynchronous method looks up the SPF record of a domain
+        :param evaluation: the state of the evaluation
+        :param domain: the domain
+        :param count_void: whether an empty answer counts as a void lookup
+        :return: the SPF record. None if the domain has no SPF record.
+        """
+        txt_records = await self._lookup(evaluation, domain, "TXT", count_void)
+        spf_records = []
+        for txt_record in txt_records:
+            record = b"".join(txt_record.strings).decode("utf-8", errors="replace")
+            if record.lower() == "v=spf1" or record.lower().startswith("v=spf1 "):
+                spf_records.append(record)
+        if len(spf_records) > 1:
+            raise SPFPermError(f"'{domain}' has more than one SPF record")
+        return spf_records[0] if spf_records else None
+
+    @staticmethod
+    def parse_record(record: str) -> tuple:
+        """
+        This static method parses an SPF record
+        :param record: the SPF record (starting with 'v=spf1')
+        :return: a tuple with the list of (qualifier, mechanism, argument, IPv4 prefix length, IPv6 prefix length) \
+        directives and the dictionary of modifiers
+        :raises SPFPermError: if the record is invalid
+        """
+        directives = []
+        modifiers = {}
+        for term in record.split()[1:]:
+            modifier_match = SPFEvaluator._MODIFIER_REGEX.match(term)
+            if modifier_match is not None:
+                name = modifier_match.group(1).lower()
+                if name in modifiers and name in ("redirect", "exp"):
+                    raise SPFPermError(f"Duplicate '{name}' modifier")
+                modifiers[name] = modifier_match.group(2)
+                continue
+            mechanism_match = SPFEvaluator._MECHANISM_REGEX.match(term)
+            if mechanism_match is None or mechanism_match.group(2).lower() not in SPFEvaluator._MECHANISMS:
+                raise SPFPermError(f"Invalid SPF term '{term}'")
+            qualifier, mechanism, rest = mechanism_match.groups()
+            directives.append((qualifier or "+",) + SPFEvaluator._parse_mechanism(mechanism.lower(), rest or ""))
+        return directives, modifiers
+
+    @staticmethod
+    def _parse_mechanism(mechanism: str, rest: str) -> tuple:
+        """
+        This static method parses the argument of a mechanism
+        :param mechanism: the name of the mechanism
+        :param rest: the part of the term after the name (starting with ':' or '/', if not empty)
+        :return: a tuple with the mechanism, its argument (a domain spec, an ipaddress network or None) and its IPv4 \
+        and IPv6 prefix lengths
+        """
+        if mechanism == "all":
+            if rest:
+                raise SPFPermError(f"Invalid 'all' mechanism 'all{rest}'")
+            return mechanism, None, 32, 128
+        if mechanism in ("ip4", "ip6"):
+            try:
+                ip_network = ipaddress.ip_network(rest[1:], strict=False) if rest.startswith(":") else None
+            except ValueError:
+                ip_network = None
+            if ip_network is None or ip_network.version != int(mechanism[-1]):
+                raise SPFPermError(f"Invalid '{mechanism}' mechanism '{mechanism}{rest}'")
+            return mechanism, ip_network, 32, 128
+
+        domain_spec, cidr4, cidr6 = SPFEvaluator._DUAL_CIDR_REGEX.match(rest).groups()
+        if domain_spec.startswith(":"):
+            domain_spec = domain_spec[1:]
+        elif domain_spec:
+            raise SPFPermError(f"Invalid '{mechanism}' mechanism '{mechanism}{rest}'")
+        if (not domain_spec and mechanism in ("include", "exists")) or \
+                ((cidr4 or cidr6) and mechanism not in ("a", "mx")):
+            raise SPFPermError(f"Invalid '{mechanism}' mechanism '{mechanism}{rest}'")
+        cidr4 = int(cidr4) if cidr4 else 32
+        cidr6 = int(cidr6) if cidr6 else 128
+        if cidr4 > 32 or cidr6 > 128:
+            raise SPFPermError(f"Invalid prefix length in '{mechanism}{rest}'")
+        return mechanism, domain_spec or None, cidr4, cidr6
+
+    @staticmethod
+    def expand(evaluation: _Evaluation, domain_spec: str, domain: str) -> str:
+        """
+        This static method expands the macros of a domain spec. The 'p' macro (the validated reverse name of the
+        sender IP) expands to 'unknown', as RFC 7208 allows, and 'h' expands to the sender domain since the HELO
+        identity isn't checked.
+        :param evaluation: the state of the evaluation
+        :param domain_spec: the domain spec
+        :param domain: the current domain
+        :return: the expanded domain, truncated to 253 characters by removing labels from the left
+        """
+        if "%" not in domain_spec:
+            expanded = domain_spec
+        else:
+            def expand_macro(macro_match):
+                letter, n_parts, reverse, delimiters, escape = macro_match.groups()
+                if escape is not None:
+                    if escape not in "%_-":
+                        raise SPFPermError(f"Invalid macro '%{escape}' in '{domain_spec}'")
+                    return {"%": "%", "_": " ", "-": "%20"}[escape]
+                value = SPFEvaluator._get_macro_value(evaluation, letter.lower(), domain)
+                parts = re.split("[" + re.escape(delimiters or ".") + "]", value)
+                if reverse:
+                    parts.reverse()
+                if n_parts:
+                    if int(n_parts) == 0:
+                        raise SPFPermError(f"Invalid macro in '{domain_spec}'")
+                    parts = parts[-int(n_parts):]
+                value = ".".join(parts)
+                return urllib.parse.quote(value, safe="") if letter.isupper() else value
+
+            expanded = SPFEvaluator._MACRO_REGEX.sub(expand_macro, domain_spec)
+        expanded = expanded.rstrip(".")
+        while len(expanded) > 253 and "." in expanded:
+            expanded = expanded.split(".", 1)[1]
+        return expanded.lower()
+
+    @staticmethod
+    def _get_macro_value(evaluation: _Evaluation, letter: str, domain: str) -> str:
+        """
+        This static method returns the value of a macro letter
+        :param evaluation: the state of the evaluation
+        :param letter: the lowercase macro letter
+        :param domain: the current domain
+        :return: the value of the macro
+        """
+        if letter in "slo":
+            evaluation.uses_sender = True
+        local_part, sender_domain = evaluation.sender.rsplit("@", 1)
+        if letter == "s":
+            return evaluation.sender
+        if letter == "l":
+            return local_part or "postmaster"
+        if letter in "oh":
+            return sender_domain
+        if letter == "d":
+            return domain
+        if letter == "i":
+            if evaluation.ip.version == 4:
+                return str(evaluation.ip)
+            return ".".join(evaluation.ip.exploded.replace(":", ""))
+        if letter == "p":
+            return "unknown"
+        if letter == "v":
+            return "in-addr" if evaluation.ip.version == 4 else "ip6"
+        raise SPFPermError(f"Invalid macro letter '{letter}'")
+
+    async def _check_host(self, evaluation: _Evaluation, domain: str, is_root: bool = True) -> str:
+        """
+        This asynchronous method implements the check_host function of RFC 7208
+        :param evaluation: the state of the evaluation
+        :param domain: the domain whose policy is evaluated
+        :param is_root: whether the domain is the one being checked (rather than an included or redirected one)
+        :return: the result of the evaluation ('none', 'neutral', 'pass', 'fail' or 'softfail')
+        """
+        record = await self._get_record(evaluation, domain, not is_root)
+        if record is None:
+            return "none"
+        directives, modifiers = SPFEvaluator.parse_record(record)
+        for qualifier, mechanism, argument, cidr4, cidr6 in directives:
+            if await self._matches(evaluation, domain, mechanism, argument, cidr4, cidr6):
+                return SPFEvaluator._QUALIFIERS[qualifier]
+        if "redirect" in modifiers:
+            self._count_lookup(evaluation)
+            result = await self._check_host(evaluation, self.expand(evaluation, modifiers["redirect"], domain), False)
+            if result == "none":
+                raise SPFPermError(f"Redirect of '{domain}' has no SPF record")
+            return result
+        return "neutral"
+
+    async def _matches(self, evaluation: _Evaluation, domain: str, mechanism: str, argument, cidr4: int,
+                       cidr6: int) -> bool:
+        """
+        This asynchronous method checks whether a mechanism matches the sender IP
+        :param evaluation: the state of the evaluation
+        :param domain: the current domain
+        :param mechanism: the name of the mechanism
+        :param argument: its argument (a domain spec, an ipaddress network or None)
+        :param cidr4: its IPv4 prefix length
+        :param cidr6: its IPv6 prefix length
+        :return: True, if it matches; False, if it doesn't
+        """
+        ip = evaluation.ip
+        if mechanism == "all":
+            return True
+        if mechanism in ("ip4", "ip6"):
+            return ip.version == argument.version and ip in argument
+
+        self._count_lookup(evaluation)
+        target = self.expand(evaluation, argument, domain) if argument else domain
+        address_type = "A" if ip.version == 4 else "AAAA"
+        prefix_length = cidr4 if ip.version == 4 else cidr6
+        if mechanism == "include":
+            result = await self._check_host(evaluation, target, False)
+            if result == "none":
+                raise SPFPermError(f"Included domain '{target}' has no SPF record")
+            return result == "pass"
+        if mechanism == "exists":
+            return bool(await self._lookup(evaluation, target, "A"))
+        if mechanism == "a":
+            addresses = await self._lookup(evaluation, target, address_type)
+            return SPFEvaluator._in_addresses(ip, addresses, prefix_length)
+        if mechanism == "mx":
+            exchanges = await self._lookup(evaluation, target, "MX")
+            if len(exchanges) > self.max_names:
+                raise SPFPermError(f"'{target}' has more than {self.max_names} MX records")
+            all_addresses = await asyncio.gather(*(
+                self._lookup(evaluation, exchange.exchange.to_text(omit_final_dot=True), address_type, False)
+                for exchange in exchanges
+            ))
+            return any(SPFEvaluator._in_addresses(ip, addresses, prefix_length) for addresses in all_addresses)
+
+        # ptr: validate the names the sender IP resolves to, and check whether any of them is in the target domain
+        names = await self._lookup(evaluation, dns.reversename.from_address(str(ip)).to_text(), "PTR")
+        names = [name.target.to_text(omit_final_dot=True).lower() for name in names[:self.max_names]]
+        all_addresses = await asyncio.gather(
+            *(self._lookup(evaluation, name, address_type, False) for name in names), return_exceptions=True
+        )
+        return any(
+            not isinstance(addresses, Exception) and SPFEvaluator._in_addresses(ip, addresses, ip.max_prefixlen)
+            and (name == target or name.endswith("." + target))
+            for name, addresses in zip(names, all_addresses)
+        )
+
+    @staticmethod
+    def _in_addresses(ip, addresses: list, prefix_length: int) -> bool:
+        """
+        This static method checks whether an IP belongs to the networks of some A or AAAA records
+        :param ip: the IP
+        :param addresses: the A or AAAA records
+        :param prefix_length: the prefix length of the networks
+        :return: True, if it does; False, if it doesn't
+        """
+        return any(
+            ip in ipaddress.ip_network(f"{address.address}/{prefix_length}", strict=False) for address in addresses
+        )
+
+    async def _compile(self, evaluation: _Evaluation, domain: str, is_root: bool = False) -> IPRangeIndex:
+        """
+        This asynchronous method computes the set of IPs for which the policy of a domain passes. The mechanisms of
+        the record (and its redirect) are compiled concurrently, so that the included policies at each level of the
+        tree are looked up at once, and then combined in order, so that the IPs matched by a directive are only
+        decided by it if no previous directive matched them.
+        :param evaluation: the state of the compilation
+        :param domain: the domain whose policy is compiled
+        :param is_root: whether the domain is the one being compiled (rather than an included or redirected one)
+        :return: the IPRangeIndex of the IPs for which it passes. None if the domain has no SPF record.
+        """
+        record = await self._get_record(evaluation, domain, not is_root)
+        if record is None:
+            return None
+        directives, modifiers = SPFEvaluator.parse_record(record)
+
+        # Directives after 'all' are never reached, and neither is the redirect modifier if there is an 'all'
+        all_position = next((position for position, directive in enumerate(directives) if directive[1] == "all"), None)
+        if all_position is not None:
+            directives = directives[:all_position + 1]
+        redirect = modifiers.get("redirect") if all_position is None else None
+        if any(mechanism in ("ptr", "exists") or (isinstance(argument, str) and "%" in argument)
+               for qualifier, mechanism, argument, cidr4, cidr6 in directives) or (redirect and "%" in redirect):
+            raise _DynamicPolicy()
+
+        compilations = [
+            self._compile_mechanism(evaluation, domain, mechanism, argument, cidr4, cidr6)
+            for qualifier, mechanism, argument, cidr4, cidr6 in directives
+        ]
+        if redirect:
+            compilations.append(self._compile_redirect(evaluation, domain, redirect.rstrip(".").lower()))
+        all_matched = await asyncio.gather(*compilations, return_exceptions=True)
+        # The first error in directive order is the one the sequential evaluation would have raised
+        for matched in all_matched:
+            if isinstance(matched, BaseException):
+                raise matched
+
+        pass_set = IPRangeIndex()
+        decided = IPRangeIndex()
+        for (qualifier, mechanism, argument, cidr4, cidr6), matched in zip(directives, all_matched):
+            if qualifier == "+":
+                pass_set = pass_set.union(matched.difference(decided))
+            decided = decided.union(matched)
+        if redirect:
+            pass_set = pass_set.union(all_matched[-1].difference(decided))
+        return pass_set
+
+    async def _compile_redirect(self, evaluation: _Evaluation, domain: str, target: str) -> IPRangeIndex:
+        """
+        This asynchronous method computes the set of IPs for which the policy a domain is redirected to passes
+        :param evaluation: the state of the compilation
+        :param domain: the current domain
+        :param target: the domain of the redirect modifier
+        :return: the IPRangeIndex of the IPs for which the redirected policy passes
+        """
+        self._count_lookup(evaluation)
+        redirect_pass_set = await self._compile(evaluation, target)
+        if redirect_pass_set is None:
+            raise SPFPermError(f"Redirect of '{domain}' has no SPF record")
+        return redirect_pass_set
+
+    async def _compile_mechanism(self, evaluation: _Evaluation, domain: str, mechanism: str, argument, cidr4: int,
+                                 cidr6: int) -> IPRangeIndex:
+        """
+        This asynchronous method computes the set of IPs matched by a mechanism which only depends on the sender IP
+        :param evaluation: the state of the compilation
+        :param domain: the current domain
+        :param mechanism: the name of the mechanism
+        :param argument: its argument (a domain, an ipaddress network or None)
+        :param cidr4: its IPv4 prefix length
+        :param cidr6: its IPv6 prefix length
+        :return: the IPRangeIndex of the matched IPs
+        """
+        if mechanism == "all":
+            return SPFEvaluator._ALL_IPS
+        if mechanism in ("ip4", "ip6"):
+            return IPRangeIndex([argument.compressed])
+
+        self._count_lookup(evaluation)
+        target = argument.rstrip(".").lower() if argument else domain
+        if mechanism == "include":
+            include_pass_set = await self._compile(evaluation, target)
+            if include_pass_set is None:
+                raise SPFPermError(f"Included domain '{target}' has no SPF record")
+            return include_pass_set
+
+        if mechanism == "a":
+            hosts = [target]
+            count_void = True
+        else:
+            exchanges = await self._lookup(evaluation, target, "MX")
+            if len(exchanges) > self.max_names:
+                raise SPFPermError(f"'{target}' has more than {self.max_names} MX records")
+            hosts = [exchange.exchange.to_text(omit_final_dot=True) for exchange in exchanges]
+            count_void = False
+        all_addresses = await asyncio.gather(*(
+            self._lookup(evaluation, host, address_type, False)
+            for host in hosts for address_type in ("A", "AAAA")
+        ))
+        if count_void and not any(all_addresses):
+            # Like check_host, which only makes one of both queries, an 'a' mechanism without addresses is void
+            evaluation.n_void_lookups += 1
+            if evaluation.n_void_lookups > self.max_void_lookups:
+                raise _LookupLimitError(f"More than {self.max_void_lookups} void lookups")
+        return IPRangeIndex(
+            f"{address.address}/{cidr4 if address.rdtype == dns.rdatatype.A else cidr6}"
+            for addresses in all_addresses for address in addresses
+        )
@@ -0,0 +1,162 @@
+import logging
+import os
+import sqlite3
+import threading as th
+from typing import Callable
+
+from core.GracefulKiller import GracefulKiller
+
+
+class SharedBlackList:
+    """
+    This class implements a black list of peers shared by several worker processes (or nodes sharing a local disk)
+    through a SQLite database in WAL mode. Counters are incremented atomically inside the database and every update
+    gets a sequence number, so that each worker can poll for the updates made by the others and apply only those.
+    """
+    path: str
+    poll_interval: float
+    killer: GracefulKiller
+    _BUSY_TIMEOUT = 5.0
+
+    def __init__(self, path: str, poll_interval: float, killer: GracefulKiller):
+        """
+        This method opens (or creates) the shared black list.
+        :param path: the path of the SQLite database file
+        :param poll_interval: the interval in seconds with which other workers' updates are polled
+        :param killer: The GracefulKiller object for graceful shutdown
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.killer = killer
+        self._connections = th.local()
+        connection = self._get_connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS black_list ("
+                "peer_ip TEXT PRIMARY KEY, "
+                "n_times_detected_as_spam INTEGER NOT NULL, "
+                "expiry_date REAL NOT NULL, "
+                "seq INTEGER NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS black_list_seq ON black_list (seq)")
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        This method returns the database connection of the calling thread, opening it if needed (SQLite connections
+        can't be shared between threads)
+        :return: the connection of the calling thread
+        """
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=SharedBlackList._BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._connections.connection = connection
+        return connection
+
+    def seed(self, entries: dict):
+        """
+        This method adds the peers which aren't in the shared black list yet (e.g. those loaded from a data file)
+        :param entries: a dictionary which maps peer IPs to (n_times_detected_as_spam, expiry_date) tuples
+        """
+        connection = self._get_connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            seq = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM black_list").fetchone()[0]
+            connection.executemany(
+                "INSERT OR IGNORE INTO black_list VALUES (?, ?, ?, ?)",
+                [(peer_ip, n_times, expiry_date, seq + 1) for peer_ip, (n_times, expiry_date) in entries.items()]
+            )
+
+    def increment(self, peer_ip: str, current_time: float, expiry_date: float) -> tuple:
+        """
+        This method atomically increments the number of times that a peer has been detected as spam, adding it to the
+        black list if it isn't there (or if its entry has expired)
+        :param peer_ip: the peer IP
+        :param current_time: the current UNIX timestamp
+        :param expiry_date: the expiry timestamp for the peer, if it is added
+        :return: the (n_times_detected_as_spam, expiry_date) tuple of the peer after the update
+        """
+        connection = self._get_connection()
+        parameters = {"peer_ip": peer_ip, "current_time": current_time, "expiry_date": expiry_date}
+        with connection:
+            # UPSERT requires SQLite 3.24, but RETURNING requires 3.35, so the updated entry is read back inside the
+            # same write transaction instead (no other worker can update it in between)
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO black_list VALUES (:peer_ip, 1, :expiry_date, "
+                "(SELECT COALESCE(MAX(seq), 0) + 1 FROM black_list)) "
+                "ON CONFLICT (peer_ip) DO UPDATE SET "
+                "n_times_detected_as_spam = CASE WHEN expiry_date > :current_time "
+                "THEN n_times_detected_as_spam + 1 ELSE 1 END, "
+                "expiry_date = CASE WHEN expiry_date > :current_time "
+                "THEN expiry_date ELSE excluded.expiry_date END, "
+                "seq = excluded.seq",
+                parameters
+            )
+            return connection.execute(
+                "SELECT n_times_detected_as_spam, expiry_date FROM black_list WHERE peer_ip = :peer_ip",
+                parameters
+            ).fetchone()
+
+    def get_updates(self, last_seq: int = 0) -> tuple:
+        """
+        This method returns the updates made after a sequence number
+        :param last_seq: the sequence number of the last update already applied (0 returns all of the peers)
+        :return: a tuple with the list of (peer_ip, n_times_detected_as_spam, expiry_date) tuples and the new last
+        sequence number
+        """
+        connection = self._get_connection()
+        rows = connection.execute(
+            "SELECT peer_ip, n_times_detected_as_spam, expiry_date, seq FROM black_list WHERE seq > ? ORDER BY seq",
+            (last_seq,)
+        ).fetchall()
+        if rows:
+            last_seq = rows[-1][3]
+        return [row[:3] for row in rows], last_seq
+
+    def delete_expired(self, current_time: float) -> int:
+        """
+        This method removes the expired peers from the shared black list
+        :param current_time: the current UNIX timestamp
+        :return: the number of removed peers
+        """
+        connection = self._get_connection()
+        with connection:
+            return connection.execute("DELETE FROM black_list WHERE expiry_date <= ?", (current_time,)).rowcount
+
+    def launch_sync_daemon(self, on_updates: Callable, last_seq: int):
+        """
+        This method launches a daemon which polls the database for updates made by other workers. Checking whether
+        the database has changed ('PRAGMA data_version') is cheap, so it can be done every few milliseconds.
+        :param on_updates: the function to which the lists of updates are passed
+        :param last_seq: the sequence number of the last update already applied
+        """
+        sync_daemon = th.Thread(target=SharedBlackList.__daemon_job, args=(self, on_updates, last_seq, self.killer),
+                                name="SharedBlackListSync", daemon=True)
+        sync_daemon.start()
+
+    @staticmethod
+    def __daemon_job(shared_black_list, on_updates: Callable, last_seq: int, killer: GracefulKiller):
+        """
+        This static method is used by the sync daemon to poll for updates until a shutdown signal is received
+        :param shared_black_list: the SharedBlackList instance
+        :param on_updates: the function to which the lists of updates are passed
+        :param last_seq: the sequence number of the last update already applied
+        :param killer: The GracefulKiller object for graceful shutdown
+        """
+        connection = shared_black_list._get_connection()
+        data_version = None
+        while not killer.wait(shared_black_list.poll_interval):
+            try:
+                current_data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+                if current_data_version != data_version:
+                    data_version = current_data_version
+                    updates, last_seq = shared_black_list.get_updates(last_seq)
+                    if updates:
+                        on_updates(updates)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared black list couldn't be polled: {e.__class__.__name__} - {e}")
@@ -38,8 +38,12 @@ class StorageManager:
         """
         whole_filename = join(self.path, filename + '.json')
         logging.info(f"Storing {filename} data to '{whole_filename}'")
-        with open(join(self.path, filename + '.json'), 'w') as json_file:
+        # Write to a process-specific temporary file and then replace the old one, so that several workers
+        # storing the same file at the same time can never leave it half-written
+        tmp_filename = f"{whole_filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'w') as json_file:
             json.dump(data, json_file, sort_keys=True)
+        os.replace(tmp_filename, whole_filename)
 
     def load_data(self, filename) -> dict:
         """
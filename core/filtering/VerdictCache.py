@@ -0,0 +1,117 @@
+import hashlib
+import ipaddress
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from core.EmailEnvelope import EmailEnvelope
+
+
+class VerdictCache:
+    max_size: int
+    ttl: float
+    stats_frequency: float
+    n_hits: int
+    n_misses: int
+
+    def __init__(self, max_size: int, ttl: float, stats_frequency: float = 600):
+        """
+        This method creates a bounded LRU cache with expiry for filtering verdicts, so that the messages of bulk
+        campaigns don't go through the whole filtering process again and again.
+        :param max_size: the maximum number of verdicts to be cached (the least recently used ones are evicted)
+        :param ttl: the number of seconds during which a cached verdict is valid
+        :param stats_frequency: the interval in seconds with which the usage statistics of the cache are logged
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats_frequency = stats_frequency
+        self.n_hits = 0
+        self.n_misses = 0
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_stats_time = time.monotonic() + stats_frequency
+
+    @staticmethod
+    def get_fingerprint(msg: EmailEnvelope, *extra) -> str:
+        """
+        This static method computes the fingerprint of a message from its normalized body (ignoring whitespace and
+        case), its sender domain, its peer network (/24 for IPv4, /64 for IPv6) and its recipient domains. The header
+        filters compare the envelope with the From, To and Return-Path headers, so the outcome of those comparisons is
+        part of the fingerprint too (but not the recipient mailboxes themselves, so that a campaign sent to many
+        mailboxes of a domain still shares a verdict).
+        :param msg: the message to compute the fingerprint for
+        :param extra: any additional values that the verdict depends on
+        :return: the fingerprint of the message
+        """
+        peer_ip = ipaddress.ip_address(msg.peer[0])
+        peer_network = ipaddress.ip_network(f"{peer_ip}/{24 if peer_ip.version == 4 else 64}", strict=False)
+        rcpt_tos = msg.rcpt_tos if msg.rcpt_tos is not None else []
+        rcpt_domains = sorted({rcpt_to.rsplit("@", 1)[-1].lower() for rcpt_to in rcpt_tos})
+        parsed_return_path = msg.get_parsed_return_path()
+        header_checks = (
+            msg.mail_from == msg.get_parsed_from(),
+            set(rcpt_tos) == set(msg.get_parsed_to_list() or []),
+            parsed_return_path is None or parsed_return_path == msg.mail_from or parsed_return_path in rcpt_tos
+        )
+        fingerprint = hashlib.blake2b(digest_size=16)
+        fingerprint.update(b" ".join(msg.get_body_bytes().split()).lower())
+        for value in (msg.get_sender_domain(), peer_network, rcpt_domains, header_checks) + extra:
+            fingerprint.update(b"\0" + str(value).encode())
+        return fingerprint.hexdigest()
+
+    def get(self, fingerprint: str):
+        """
+        This method returns the cached verdict for a fingerprint, if it hasn't expired
+        :param fingerprint: the fingerprint of the message
+        :return: the cached verdict (True if spam, False if not). None if there isn't any.
+        """
+        current_time = time.monotonic()
+        if current_time >= self._next_stats_time:
+            self._next_stats_time = current_time + self.stats_frequency
+            self.log_stats()
+        with self._lock:
+            cached = self._verdicts.get(fingerprint)
+            if cached is not None:
+                verdict, expiry_time = cached
+                if expiry_time > current_time:
+                    self._verdicts.move_to_end(fingerprint)
+                    self.n_hits += 1
+                    return verdict
+                del self._verdicts[fingerprint]
+            self.n_misses += 1
+            return None
+
+    def put(self, fingerprint: str, verdict: bool):
+        """
+        This method caches the verdict for a fingerprint, evicting the least recently used one if the cache is full
+        :param fingerprint: the fingerprint of the message
+        :param verdict: the verdict to be cached (True if spam, False if not)
+        """
+        with self._lock:
+            self._verdicts[fingerprint] = (verdict, time.monotonic() + self.ttl)
+            self._verdicts.move_to_end(fingerprint)
+            if len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """
+        This method returns the usage statistics of the cache
+        :return: a dictionary with the number of cached verdicts, hits and misses, and the hit ratio
+        """
+        with self._lock:
+            n_lookups = self.n_hits + self.n_misses
+            return {
+                "size": len(self._verdicts),
+                "hits": self.n_hits,
+                "misses": self.n_misses,
+                "hit_ratio": self.n_hits / n_lookups if n_lookups else 0.0
+            }
+
+    def log_stats(self):
+        """
+        This method logs the usage statistics of the cache
+        """
+        stats = self.get_stats()
+        logging.info(f"Verdict cache: {stats['size']} cached verdicts, {stats['hits']} hits, "
+                     f"{stats['misses']} misses ({stats['hit_ratio']:.1%} hit ratio)")
@@ -6,6 +6,7 @@ from typing import Sequence
 
 
 class AIFilter(PastFilter):
+    cpu_bound: bool = True
     checks: Sequence[str] = ["get_count_urls", "get_count_images", "get_from_return_path", "get_from_reply_to",
                              "get_id_email_client"]
     all_content_types = ["text/html", "text/plain", "multipart/mixed", "application/octet-stream",
@@ -37,3 +38,16 @@ class AIFilter(PastFilter):
         if is_spam:
             logging.info(f"An AIFilter has detected the email as spam")
         return is_spam
+
+    def filter_batch(self, envelopes: Sequence[EmailEnvelope]) -> list:
+        """
+        This method classifies several emails at once with a single (vectorized) prediction of the model
+        :param envelopes: emails
+        :return: a list with the classification of each email (True if spam, False if not)
+        """
+        if not envelopes:
+            return []
+        predictions = self.data.predict([envelope.ai_matrix_for_email() for envelope in envelopes])
+        verdicts = [prediction == 1 for prediction in predictions]
+        logging.info(f"An AIFilter has detected {sum(verdicts)} out of {len(verdicts)} emails as spam")
+        return verdicts
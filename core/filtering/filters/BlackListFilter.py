@@ -1,15 +1,36 @@
+import heapq
 import ipaddress
 
 import logging
 import datetime
+import sqlite3
+import sys
+import threading
+import time
+from typing import NamedTuple
 
 from core.EmailEnvelope import EmailEnvelope
+from core.filtering.IPRangeIndex import IPRangeIndex
 from core.filtering.filters.PastFilter import PastFilter
 
 
+class BlackListedPeer(NamedTuple):
+    """
+    This class holds the black list entry of a peer. Entries are immutable and replaced as a whole on every update,
+    so they can be read without locking.
+    """
+    n_times_detected_as_spam: int
+    expiry_date: float
+
+
 class BlackListFilter(PastFilter):
     black_listed_days: int
     black_listing_threshold: int
+    ip_range_index: IPRangeIndex
+    bundled_ip_range_index: IPRangeIndex
+    shared_black_list = None
+    stage = "CONNECT"
+    _N_LOCK_STRIPES = 64
 
     def __init__(self, black_listing_threshold: int, black_listed_days: int):
         """
@@ -18,6 +39,14 @@ class BlackListFilter(PastFilter):
         """
         self.black_listed_days = black_listed_days
         self.black_listing_threshold = black_listing_threshold
+        self.ip_range_index = self.bundled_ip_range_index = IPRangeIndex()
+        self.data = {"ip_addresses": {}, "ip_ranges": []}
+        # Min-heap of (expiry timestamp, peer IP) used to evict black-listed peers once they expire
+        self._expiry_heap = []
+        self._expiry_lock = threading.Lock()
+        # Updates of the same peer are serialized by one of several locks (picked by the peer IP), so that no spam
+        # detection is lost while updates of different peers rarely wait for each other
+        self._peer_locks = [threading.Lock() for _ in range(BlackListFilter._N_LOCK_STRIPES)]
 
     def filter(self, envelope: EmailEnvelope) -> bool:
         """
@@ -28,45 +57,194 @@ class BlackListFilter(PastFilter):
 
         # Get peer ip and check if it is blacklisted or if belongs to a black-listed ip range
         peer_ip: ipaddress.IPv4Address = ipaddress.ip_address(envelope.peer[0])
-        if peer_ip.compressed in self.data["ip_addresses"]:
-            n_times_detected_as_spam = self.data["ip_addresses"][peer_ip.compressed]["n_times_detected_as_spam"]
-            if n_times_detected_as_spam > self.black_listing_threshold:
+        peer_entry = self.data["ip_addresses"].get(peer_ip.compressed)
+        if peer_entry is not None and peer_entry.expiry_date > time.time():
+            if peer_entry.n_times_detected_as_spam > self.black_listing_threshold:
                 logging.info(f"Sender IP {peer_ip} has been previously black-listed")
                 return True
         else:
-            for ip_range in self.data["ip_ranges"]:
-                if peer_ip in ipaddress.ip_network(ip_range):
-                    logging.info(f"Sender IP {peer_ip} belongs to a black-listed IP network {ip_range}")
-                    return True
+            ip_range = self.ip_range_index.find(peer_ip)
+            if ip_range is not None:
+                logging.info(f"Sender IP {peer_ip} belongs to a black-listed IP range {ip_range[0]}-{ip_range[1]}")
+                return True
 
         return False
 
     def set_initial_data(self, data):
         """
         This method overwrites the default set_initial_data method by loading in the initial filter data only the info whose info is not expired
+        Expiry dates are stored as UNIX timestamps, although ISO dates (UTC) from older data files are also accepted.
         :param data: the data to be filtered by expiry date and then loaded
         """
         filtered_data = {}
-        current_date = datetime.datetime.utcnow()
+        expiry_heap = []
+        current_time = time.time()
         for peer in data["ip_addresses"]:
-            peer_expiry_date = datetime.datetime.fromisoformat(data["ip_addresses"][peer]["expiry_date"])
-            if peer_expiry_date > current_date:
-                filtered_data[peer] = data["ip_addresses"][peer]
+            peer_expiry_date = data["ip_addresses"][peer]["expiry_date"]
+            if isinstance(peer_expiry_date, str):
+                peer_expiry_date = datetime.datetime.fromisoformat(peer_expiry_date).replace(
+                    tzinfo=datetime.timezone.utc
+                ).timestamp()
+            if peer_expiry_date > current_time:
+                filtered_data[peer] = BlackListedPeer(
+                    n_times_detected_as_spam=data["ip_addresses"][peer]["n_times_detected_as_spam"],
+                    expiry_date=peer_expiry_date
+                )
+                expiry_heap.append((peer_expiry_date, peer))
+        heapq.heapify(expiry_heap)
         self.data["ip_addresses"] = filtered_data
+        self._expiry_heap = expiry_heap
         self.data["ip_ranges"] = data["ip_ranges"]
+        self.ip_range_index = self.bundled_ip_range_index = IPRangeIndex(data["ip_ranges"])
+
+    def set_block_list_index(self, block_list_index: IPRangeIndex):
+        """
+        This method replaces the IP ranges loaded from block lists, which are black-listed along with the bundled ones
+        (those of the data file). Only the bundled ones are stored, so that the ranges removed from the block lists
+        don't linger on. The new index is swapped in with a single assignment, so the filtering threads never have to
+        wait for it nor see it half-built.
+        :param block_list_index: the index of the IP ranges loaded from the block lists
+        """
+        self.ip_range_index = self.bundled_ip_range_index.union(block_list_index)
 
     def update_black_list(self, peer_ip):
         """
         This method updates the black list by including the peer_ip in it or by incrementing the number of times that it has been detected as spam
         :param peer_ip: the peer IP to be updated in the black list
         """
-        if self.data["ip_addresses"].get(peer_ip) is None:
-            self.data["ip_addresses"][peer_ip] = {}
-            self.data["ip_addresses"][peer_ip]["expiry_date"] = (datetime.datetime.utcnow() + \
-                                                                 datetime.timedelta(
-                                                                     days=self.black_listed_days
-                                                                 )).isoformat()
-            n_times_detected_as_spam = 1
-        else:
-            n_times_detected_as_spam = 1 + self.data["ip_addresses"][peer_ip]["n_times_detected_as_spam"]
-        self.data["ip_addresses"][peer_ip]["n_times_detected_as_spam"] = n_times_detected_as_spam
+        self.expire_black_list()
+        current_time = time.time()
+        if self.shared_black_list is not None:
+            try:
+                n_times_detected_as_spam, expiry_date = self.shared_black_list.increment(
+                    peer_ip, current_time, current_time + self.black_listed_days * 24 * 60 * 60
+                )
+                self.apply_shared_updates([(peer_ip, n_times_detected_as_spam, expiry_date)])
+                return
+            except sqlite3.Error as e:
+                logging.warning(f"Shared black list couldn't be updated: {e.__class__.__name__} - {e}")
+        is_new_peer = False
+        with self._get_peer_lock(peer_ip):
+            peer_entry = self.data["ip_addresses"].get(peer_ip)
+            if peer_entry is None:
+                is_new_peer = True
+                peer_entry = BlackListedPeer(
+                    n_times_detected_as_spam=1,
+                    expiry_date=current_time + self.black_listed_days * 24 * 60 * 60
+                )
+            else:
+                peer_entry = peer_entry._replace(n_times_detected_as_spam=peer_entry.n_times_detected_as_spam + 1)
+            self.data["ip_addresses"][peer_ip] = peer_entry
+        if is_new_peer:
+            with self._expiry_lock:
+                heapq.heappush(self._expiry_heap, (peer_entry.expiry_date, peer_ip))
+
+    def set_shared_black_list(self, shared_black_list):
+        """
+        This method makes the filter share its black-listed peers with other workers through a SharedBlackList. The
+        peers loaded by this worker are added to it, the ones added by other workers are loaded and a daemon keeps
+        applying the updates made by the other workers.
+        :param shared_black_list: the SharedBlackList instance
+        """
+        shared_black_list.seed(self.data["ip_addresses"].copy())
+        updates, last_seq = shared_black_list.get_updates()
+        self.apply_shared_updates(updates)
+        self.shared_black_list = shared_black_list
+        shared_black_list.launch_sync_daemon(self.apply_shared_updates, last_seq)
+        logging.info(f"BlackListFilter is sharing {len(updates)} black-listed peers in '{shared_black_list.path}'")
+
+    def apply_shared_updates(self, updates):
+        """
+        This method applies the updates of the shared black list to the black-listed peers of this worker
+        :param updates: a list of (peer_ip, n_times_detected_as_spam, expiry_date) tuples
+        """
+        new_expiry_dates = []
+        for peer_ip, n_times_detected_as_spam, expiry_date in updates:
+            with self._get_peer_lock(peer_ip):
+                peer_entry = self.data["ip_addresses"].get(peer_ip)
+                if peer_entry is None or peer_entry.expiry_date != expiry_date:
+                    new_expiry_dates.append((expiry_date, peer_ip))
+                self.data["ip_addresses"][peer_ip] = BlackListedPeer(n_times_detected_as_spam, expiry_date)
+        if new_expiry_dates:
+            with self._expiry_lock:
+                for new_expiry_date in new_expiry_dates:
+                    heapq.heappush(self._expiry_heap, new_expiry_date)
+
+    def _get_peer_lock(self, peer_ip) -> threading.Lock:
+        """
+        This method returns the lock which serializes the updates of a peer
+        :param peer_ip: the peer IP
+        :return: the lock of the peer
+        """
+        return self._peer_locks[hash(peer_ip) % BlackListFilter._N_LOCK_STRIPES]
+
+    def expire_black_list(self):
+        """
+        This method evicts the black-listed peers whose expiry date has passed. Since the peers are kept in a heap
+        sorted by expiry date, only the expired ones are visited.
+        """
+        current_time = time.time()
+        expired = []
+        with self._expiry_lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= current_time:
+                expired.append(heapq.heappop(self._expiry_heap))
+        n_expired = 0
+        for expiry_date, peer_ip in expired:
+            with self._get_peer_lock(peer_ip):
+                peer_entry = self.data["ip_addresses"].get(peer_ip)
+                if peer_entry is not None and peer_entry.expiry_date == expiry_date:
+                    del self.data["ip_addresses"][peer_ip]
+                    n_expired += 1
+        if n_expired:
+            logging.info(f"{n_expired} black-listed peers have expired")
+        if expired and self.shared_black_list is not None:
+            try:
+                self.shared_black_list.delete_expired(current_time)
+            except sqlite3.Error as e:
+                logging.warning(f"Shared black list couldn't be cleaned: {e.__class__.__name__} - {e}")
+
+    def get_data(self):
+        """
+        This method overwrites the default get_data method by evicting the expired peers and returning a consistent
+        snapshot of the data to be stored, which is taken without blocking the filtering threads
+        :return: a snapshot of the filter data
+        """
+        self.expire_black_list()
+        memory_usage = self.get_memory_usage()
+        logging.info(f"BlackListFilter holds {memory_usage['n_ip_addresses']} black-listed peers and "
+                     f"{memory_usage['n_ip_ranges']} IP ranges ({memory_usage['bytes'] // 1024} KiB)")
+        # Copying a dictionary is atomic and its entries are immutable, so the snapshot is consistent
+        ip_addresses = self.data["ip_addresses"].copy()
+        return {
+            "ip_addresses": {
+                peer_ip: {
+                    "expiry_date": peer_entry.expiry_date,
+                    "n_times_detected_as_spam": peer_entry.n_times_detected_as_spam
+                }
+                for peer_ip, peer_entry in ip_addresses.items()
+            },
+            "ip_ranges": self.data["ip_ranges"]
+        }
+
+    def get_memory_usage(self) -> dict:
+        """
+        This method estimates the memory used by the black-listed peers (with their expiry heap) and IP ranges (the
+        index that is looked up, the index of the bundled ones and their CIDR notation, which is stored)
+        :return: a dictionary with the number of black-listed peers ('n_ip_addresses'), the number of black-listed
+        IP ranges ('n_ip_ranges') and the approximate number of 'bytes' used by both of them
+        """
+        ip_addresses = self.data["ip_addresses"].copy()
+        n_bytes = sys.getsizeof(ip_addresses) + sys.getsizeof(self._expiry_heap)
+        for peer_ip, peer_entry in ip_addresses.items():
+            n_bytes += sys.getsizeof(peer_ip) + sys.getsizeof(peer_entry) + sys.getsizeof((0.0, peer_ip))
+        ip_range_index = self.ip_range_index
+        n_bytes += ip_range_index.get_memory_usage()
+        if self.bundled_ip_range_index is not ip_range_index:
+            n_bytes += self.bundled_ip_range_index.get_memory_usage()
+        ip_ranges = self.data["ip_ranges"]
+        n_bytes += sys.getsizeof(ip_ranges) + sum(sys.getsizeof(ip_range) for ip_range in ip_ranges)
+        return {
+            "n_ip_addresses": len(ip_addresses),
+            "n_ip_ranges": len(ip_range_index),
+            "bytes": n_bytes
+        }
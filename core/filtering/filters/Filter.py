@@ -1,7 +1,15 @@
+from typing import Sequence
+
 from core.EmailEnvelope import EmailEnvelope
 
 
 class Filter:
+    # The SMTP stages at which a filter can be applied, in the order in which they take place
+    STAGES = ("CONNECT", "MAIL", "RCPT", "DATA")
+    # The earliest stage at which the filter has all the information it needs (by default, the whole message)
+    stage: str = "DATA"
+    # Whether the filter is CPU bound, so that it can be applied in a worker process instead of a thread
+    cpu_bound: bool = False
 
     def filter(self, envelope: EmailEnvelope) -> bool:
         """
@@ -11,3 +19,23 @@ class Filter:
         :return: True if the message is detected as spam, False if it passes the filter
         """
         raise NotImplementedError("This method needs to be implemented")
+
+    def filter_batch(self, envelopes: Sequence[EmailEnvelope]) -> list:
+        """
+        Base method for filtering several messages at once. By default, each message is filtered on its own, but
+        filters can override it in order to share work (e.g. lookups or model predictions) across the batch.
+
+        :param envelopes: The email messages to be filtered
+        :return: A list with the verdict for each message (True if it is detected as spam, False if it passes)
+        """
+        return [self.filter(envelope) for envelope in envelopes]
+
+    def prefetch(self, domain: str):
+        """
+        Base method for looking up, ahead of filtering, the data that the filter will need for a sender domain. It is
+        called in the background as soon as the envelope originator is accepted, so that the lookups overlap with the
+        transfer of the message. By default, nothing is prefetched.
+
+        :param domain: The domain of the envelope originator
+        """
+        pass
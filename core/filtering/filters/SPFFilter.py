@@ -1,30 +1,255 @@
-import ipaddress
+import asyncio
+import threading as th
 
 import logging
+from typing import Sequence
 
 from core.EmailEnvelope import EmailEnvelope
+from core.filtering.SPFCache import SPFCache
+from core.filtering.SPFEvaluator import SPFEvaluator
 from core.filtering.filters.PastFilter import PastFilter
 
 
 class SPFFilter(PastFilter):
+    # The deadline in seconds for evaluating the SPF policy of a domain, and the maximum number of lookups it can take
+    lookup_timeout: float = 2.0
+    max_lookups: int = 10
+    # The SPF results for which the email is detected as spam
+    _SPAM_RESULTS = ("fail", "softfail", "neutral", "permerror")
+    cache: SPFCache
+    evaluator: SPFEvaluator
+
+    def __init__(self):
+        """
+        This method creates a filter which checks the sender IP against the SPF policy of the sender domain
+        """
+        self.cache = SPFCache()
+        self.evaluator = SPFEvaluator(self.lookup_timeout, self.max_lookups)
+        # Domain: Event set once the policy being compiled for the domain (e.g. by a prefetch) is cached
+        self._pending_policies = {}
+        self._pending_lock = th.Lock()
+        # The event loop of each filtering thread, in which its evaluations are run
+        self._loops = th.local()
+
+    def set_initial_data(self, data):
+        """
+        This method overwrites the default set_initial_data method by loading the stored data into the SPF cache
+        :param data: the stored SPF cache entries
+        """
+        self.cache = SPFCache()
+        self.cache.load_data(data)
+        self.evaluator = SPFEvaluator(self.lookup_timeout, self.max_lookups)
+
+    def get_data(self):
+        """
+        This method overwrites the default get_data method so that only the live SPF cache entries are stored
+        :return: the live SPF cache entries
+        """
+        return self.cache.get_data()
 
     def filter(self, envelope: EmailEnvelope) -> bool:
         """
         This filter detected whether the senders IP really belongs to its domain by using the Sender Policy Framework (SPF)
 
         :param envelope: the email to be filtered
-        :return: True, if the sender's IP does not belong to the sender's domain (detected as spam). False, if it does.
+        :return: True, if the SPF policy of the sender's domain doesn't pass for the sender's IP (detected as spam). \
+        False, if it does or if the domain has no SPF policy (or it couldn't be looked up).
         """
 
-        # Get sender domain and check if we have data for it. If we don't then look up the IP ranges.
-        # Check if the IP belongs to the domain.
-        domain = envelope.get_sender_domain()
-        if domain not in self.data:
-            self.data[domain] = envelope.get_all_sender_ip_ranges()
+        # Get sender domain and check if we have its policy. If we don't then compile it.
+        # Check the IP against the IP ranges of a static policy, or evaluate a dynamic one for this email.
+        domain = SPFFilter.get_checked_domain(envelope)
+        if domain is None:
+            return False
+        policy = self._get_policy(domain)
+        if policy is None:
+            return False
 
         sender_ip = envelope.peer[0]
-        for ip_range in self.data[domain]:
-            if ipaddress.ip_address(sender_ip) in ipaddress.ip_network(ip_range):
-                return False
+        if policy == SPFCache.PERMERROR:
+            return self._is_spam_result(sender_ip, domain, "permerror")
+        if policy == SPFCache.DYNAMIC:
+            result = self._run(self.evaluator.check_host(sender_ip, domain, envelope.mail_from))
+            return self._is_spam_result(sender_ip, domain, result)
+        if sender_ip in policy:
+            return False
         logging.info(f"Sender IP '{sender_ip}' does not belong to the sender domain '{domain}'")
         return True
+
+    def filter_batch(self, envelopes: Sequence[EmailEnvelope]) -> list:
+        """
+        This method filters several emails at once, compiling the SPF policy of each sender domain only once for the
+        whole batch
+
+        :param envelopes: the emails to be filtered
+        :return: a list with the verdict for each email (True if the SPF policy of the sender's domain doesn't pass \
+        for the sender's IP; False, if it does or if the domain has no SPF policy)
+        """
+        envelopes_by_domain = {}
+        for index, envelope in enumerate(envelopes):
+            domain = SPFFilter.get_checked_domain(envelope)
+            if domain is not None:
+                envelopes_by_domain.setdefault(domain, []).append(index)
+
+        # Get the policies of the cached domains and compile the rest, all of them concurrently
+        policies_by_domain = {}
+        unknown_domains = []
+        for domain in envelopes_by_domain:
+            is_cached, policy = self.cache.get(domain)
+            if is_cached:
+                policies_by_domain[domain] = policy
+            else:
+                unknown_domains.append(domain)
+        all_compiled_policies = self._run(self._compile_policies(unknown_domains))
+        for domain, compiled_policy in zip(unknown_domains, all_compiled_policies):
+            policies_by_domain[domain] = self._store_policy(domain, *compiled_policy)
+
+        verdicts = [False] * len(envelopes)
+        dynamic_checks = []
+        for domain, indexes in envelopes_by_domain.items():
+            policy = policies_by_domain[domain]
+            if policy is None:
+                continue
+            for index in indexes:
+                sender_ip = envelopes[index].peer[0]
+                if policy == SPFCache.PERMERROR:
+                    verdicts[index] = self._is_spam_result(sender_ip, domain, "permerror")
+                elif policy == SPFCache.DYNAMIC:
+                    dynamic_checks.append((index, sender_ip, domain, envelopes[index].mail_from))
+                else:
+                    verdicts[index] = sender_ip not in policy
+                    if verdicts[index]:
+                        logging.info(f"Sender IP '{sender_ip}' does not belong to the sender domain '{domain}'")
+        all_results = self._run(self._check_hosts(dynamic_checks))
+        for (index, sender_ip, domain, mail_from), result in zip(dynamic_checks, all_results):
+            verdicts[index] = self._is_spam_result(sender_ip, domain, result)
+        return verdicts
+
+    @staticmethod
+    def get_checked_domain(envelope: EmailEnvelope):
+        """
+        This static method returns the domain whose SPF policy is checked: the domain of the envelope originator (the
+        MAIL FROM identity of RFC 7208), which is also the one prefetched when MAIL FROM is accepted. Bounces have no
+        envelope originator, so the domain of the 'From' header is checked for them instead.
+        :param envelope: the email to be filtered
+        :return: the checked domain. None if there is none.
+        """
+        domain = envelope.get_envelope_sender_domain()
+        return domain if domain is not None else envelope.get_sender_domain()
+
+    def prefetch(self, domain: str):
+        """
+        This method overwrites the default prefetch method by compiling the SPF policy of the sender domain into the
+        SPF cache, unless it is already there
+        :param domain: the domain of the envelope originator
+        """
+        self._get_policy(domain)
+
+    def _get_policy(self, domain: str):
+        """
+        This method returns the policy of a domain from the SPF cache, compiling it if it isn't cached. If the policy
+        is already being compiled by another thread (e.g. by a prefetch), its result is awaited instead of compiling
+        it again.
+        :param domain: the sender domain
+        :return: the policy to be applied: the IPRangeIndex of a static policy, SPFCache.DYNAMIC, SPFCache.PERMERROR \
+        or None if the domain has no policy (or it couldn't be looked up)
+        """
+        is_cached, policy = self.cache.get(domain)
+        if is_cached:
+            return policy
+        with self._pending_lock:
+            pending_policy = self._pending_policies.get(domain)
+            is_compiling = pending_policy is None
+            if is_compiling:
+                pending_policy = self._pending_policies[domain] = th.Event()
+        if not is_compiling:
+            pending_policy.wait(self.lookup_timeout)
+            is_cached, policy = self.cache.get(domain)
+            return policy if is_cached else None
+        try:
+            return self._store_policy(domain, *self._run(self.evaluator.compile_policy(domain)))
+        finally:
+            with self._pending_lock:
+                del self._pending_policies[domain]
+            pending_policy.set()
+
+    def _store_policy(self, domain: str, kind: str, pass_set, ttl: float):
+        """
+        This method caches a compiled SPF policy
+        :param domain: the sender domain
+        :param kind: the kind of policy ('static', 'dynamic', 'none', 'permerror' or 'temperror')
+        :param pass_set: the IPRangeIndex of the IPs for which a static policy passes
+        :param ttl: the number of seconds the policy can be cached for
+        :return: the policy to be applied: the IPRangeIndex of a static policy, SPFCache.DYNAMIC, SPFCache.PERMERROR \
+        or None if the domain has no policy (or it couldn't be looked up)
+        """
+        if kind == "static":
+            self.cache.put(domain, pass_set, ttl)
+            return pass_set
+        if kind == "dynamic":
+            self.cache.put(domain, SPFCache.DYNAMIC, ttl)
+            return SPFCache.DYNAMIC
+        if kind == "permerror":
+            # An invalid policy is cached like a missing one, since it may be fixed soon
+            logging.info(f"SPF policy of '{domain}' is invalid")
+            self.cache.put_negative(domain, SPFCache.PERMERROR)
+            return SPFCache.PERMERROR
+        if kind == "none":
+            logging.info(f"Sender domain '{domain}' has no SPF record")
+            self.cache.put_negative(domain)
+        else:
+            logging.warning(f"SPF policy of '{domain}' couldn't be looked up")
+        return None
+
+    @staticmethod
+    def _is_spam_result(sender_ip: str, domain: str, result: str) -> bool:
+        """
+        This static method turns the result of an SPF evaluation into a verdict
+        :param sender_ip: the sender IP
+        :param domain: the sender domain
+        :param result: the result of the evaluation
+        :return: True, if the result is 'fail', 'softfail', 'neutral' or 'permerror'; False, otherwise
+        """
+        if result in SPFFilter._SPAM_RESULTS:
+            logging.info(f"SPF policy of the sender domain '{domain}' returned '{result}' for sender IP '{sender_ip}'")
+            return True
+        return False
+
+    def _run(self, coroutine):
+        """
+        This method runs a coroutine in the event loop of the calling thread, which is created the first time and
+        reused afterwards (instead of creating and closing one per message, as asyncio.run does). Just like
+        asyncio.run, any task left behind by the coroutine is cancelled before returning, so that it doesn't hold up
+        the DNS queries shared with other threads.
+        :param coroutine: the coroutine to be run
+        :return: the result of the coroutine
+        """
+        loop = getattr(self._loops, "loop", None)
+        if loop is None:
+            loop = self._loops.loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            leftover_tasks = asyncio.all_tasks(loop)
+            for task in leftover_tasks:
+                task.cancel()
+            if leftover_tasks:
+                loop.run_until_complete(asyncio.gather(*leftover_tasks, return_exceptions=True))
+
+    async def _compile_policies(self, domains: Sequence[str]) -> list:
+        """
+        This asynchronous method compiles the SPF policies of several domains concurrently
+        :param domains: the domains whose policies are compiled
+        :return: a list with the (kind, pass set, TTL) tuple of each domain
+        """
+        return await asyncio.gather(*(self.evaluator.compile_policy(domain) for domain in domains))
+
+    async def _check_hosts(self, checks: Sequence[tuple]) -> list:
+        """
+        This asynchronous method evaluates several dynamic SPF policies concurrently
+        :param checks: the (index, sender IP, domain, envelope sender) tuples to be evaluated
+        :return: a list with the result of each evaluation
+        """
+        return await asyncio.gather(
+            *(self.evaluator.check_host(sender_ip, domain, mail_from) for index, sender_ip, domain, mail_from in checks)
+        )
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from core.filtering.filters.AIFilter import AIFilter
+from core.filtering.tests import test_AnyFilter
+
+
+class TestAIFilter(TestCase):
+
+    def test_batch(self):
+        predictions = []
+        # The labels predicted by the model, in order: for the batch and then for each message on its own
+        labels = iter([0, 1, 0] * 2)
+
+        class Model:
+            def predict(self, matrix):
+                predictions.append(len(matrix))
+                return [next(labels) for _ in matrix]
+
+        tested_filter = AIFilter()
+        tested_filter.data = Model()
+        envelopes = [
+            test_AnyFilter.TestAnyFilter.create_email(
+                peer=("192.168.1.10", 1025),
+                mail_from="from@mail.com",
+                rcpt_tos=["to@mail.com"],
+                email_from=("Author", "from@mail.com"),
+                email_tos=[("Recipient", "to@mail.com")],
+                email_subject="Batch",
+                email_contents=email_contents
+            )
+            for email_contents in ("This is a valid mail", "This is a spam mail", "This is another valid mail")
+        ]
+
+        # The whole batch is classified with a single prediction, with the same verdicts as the single ones
+        self.assertEqual(tested_filter.filter_batch(envelopes), [False, True, False])
+        self.assertEqual(predictions, [3])
+        self.assertEqual([tested_filter.filter(envelope) for envelope in envelopes], [False, True, False])
+        self.assertEqual(tested_filter.filter_batch([]), [])
+        self.assertEqual(predictions, [3, 1, 1, 1])
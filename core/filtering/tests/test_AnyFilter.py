@@ -148,6 +148,27 @@ class TestAnyFilter(TestCase):
             not_spam = self.tested_filter.filter(valid)
             self.assertFalse(not_spam, "Filter detected spam incorrectly")
 
+    def test_valid_from_bytes(self):
+        if type(self) == TestAnyFilter:
+            self.assertTrue(True)
+        else:
+            valid = self.create_email(
+                peer=self.peer,
+                mail_from="from@mail.com",
+                rcpt_tos=["to1@mail.com", "to2@mail.com"],
+                email_from=("Author", "from@mail.com"),
+                email_tos=[("Recipient1", "to1@mail.com"), ("Recipient2", "to2@mail.com")],
+                email_subject="Valid",
+                email_contents="This is a valid mail for testing purposes",
+                other_headers={
+                    'Return-Path': 'from@mail.com'
+                }
+            )
+            valid = EmailEnvelope.from_bytes(valid.peer, valid.mail_from, valid.rcpt_tos, valid.as_bytes())
+            print("TESTING VALID FROM BYTES:\n", valid)
+            not_spam = self.tested_filter.filter(valid)
+            self.assertFalse(not_spam, "Filter detected spam incorrectly")
+
     def test_spam_1(self):
         self.assertTrue(True,True)
 
@@ -1,7 +1,9 @@
 import datetime
 import json
+import threading
 from unittest import TestCase
 
+from core.filtering.IPRangeIndex import IPRangeIndex
 from core.filtering.filters.BlackListFilter import BlackListFilter
 from core.filtering.tests.test_AnyFilter import TestAnyFilter
 
@@ -40,3 +42,38 @@ class TestBlackListFilter(TestCase):
         envelope = TestAnyFilter.read_test_msg(self.ip_in_bl_range)
         is_spam = self.tested_filter.filter(envelope)
         self.assertTrue(is_spam, "BlackListFilter detected spam as ham")
+
+    def test_ip_range_index(self):
+        ip_range_index = IPRangeIndex(["10.0.0.0/24", "10.0.1.0/24", "10.0.0.128/25", "2001:db8::/32"])
+        self.assertEqual(2, len(ip_range_index), "Overlapping and adjacent IP ranges weren't merged")
+        self.assertIn("10.0.1.255", ip_range_index)
+        self.assertNotIn("10.0.2.0", ip_range_index)
+        self.assertIn("2001:db8:ffff::1", ip_range_index)
+        self.assertNotIn("2001:db9::1", ip_range_index)
+        self.assertEqual(["10.0.0.0/23", "2001:db8::/32"], ip_range_index.get_ip_ranges())
+
+    def test_memory_usage(self):
+        black_list_filter = BlackListFilter(black_listing_threshold=10, black_listed_days=100)
+        empty_memory_usage = black_list_filter.get_memory_usage()["bytes"]
+        ip_ranges = [f"10.{i}.0.0/24" for i in range(0, 200, 2)]
+        black_list_filter.set_initial_data({"ip_addresses": {}, "ip_ranges": ip_ranges})
+        memory_usage = black_list_filter.get_memory_usage()
+        self.assertEqual(100, memory_usage["n_ip_ranges"])
+        self.assertGreater(memory_usage["bytes"],
+                           empty_memory_usage + black_list_filter.ip_range_index.get_memory_usage(),
+                           "IP ranges weren't counted in the memory usage")
+
+    def test_concurrent_updates(self):
+        peer_ip = '203.0.113.7'
+        n_threads, n_updates = 8, 500
+        threads = [
+            threading.Thread(target=lambda: [self.tested_filter.update_black_list(peer_ip) for _ in range(n_updates)])
+            for _ in range(n_threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stored_data = self.tested_filter.get_data()
+        self.assertEqual(n_threads * n_updates, stored_data["ip_addresses"][peer_ip]["n_times_detected_as_spam"],
+                         "BlackListFilter lost concurrent updates")
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from core.GracefulKiller import GracefulKiller
+from core.filtering.BlockListLoader import BlockListLoader
+from core.filtering.filters.BlackListFilter import BlackListFilter
+
+
+class TestBlockListLoader(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.black_list_filter = BlackListFilter(black_listing_threshold=10, black_listed_days=100)
+        self.black_list_filter.set_initial_data({"ip_addresses": {}, "ip_ranges": ["192.0.2.0/24"]})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_block_list(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as block_list_file:
+            block_list_file.write(content)
+        return path
+
+    def test_formats(self):
+        drop = "; Spamhaus DROP List\n1.10.16.0/20 ; SBL256894\n\n2001:db8::/32 ; SBL1\n"
+        json_lines = '{"cidr": "1.19.0.0/16", "sblid": "SBL434604", "rir": "apnic"}\n' \
+                     '{"type": "metadata", "timestamp": 1700000000}\n'
+        plain = "# Plain list\n203.0.113.0/24\n198.51.100.7\n"
+        self.assertEqual(BlockListLoader.parse_block_list(drop), ["1.10.16.0/20", "2001:db8::/32"])
+        self.assertEqual(BlockListLoader.parse_block_list(json_lines), ["1.19.0.0/16"])
+        self.assertEqual(BlockListLoader.parse_block_list(plain), ["203.0.113.0/24", "198.51.100.7/32"])
+
+    def test_invalid_entries(self):
+        content = '{"cidr": "1.19.0.0/16"}\n{"cidr": "1.20.0.0/16"\n["not", "an", "object"]\n{"cidr": 42}\n' \
+                  '999.0.0.0/8\n10.0.0.0/8\n'
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(BlockListLoader.parse_block_list(content), ["1.19.0.0/16", "10.0.0.0/8"])
+
+    def test_refresh(self):
+        sources = [
+            self.write_block_list("drop.txt", "1.10.16.0/20 ; SBL256894\n"),
+            self.write_block_list("drop_v4.json", '{"cidr": "1.19.0.0/16"}\n')
+        ]
+        loader = BlockListLoader(sources, 3600, GracefulKiller())
+        self.assertTrue(loader.refresh(self.black_list_filter))
+
+        # The block lists are merged with the bundled IP ranges, but only the bundled ones are stored
+        for ip in ("192.0.2.1", "1.10.16.1", "1.19.0.1"):
+            self.assertIn(ip, self.black_list_filter.ip_range_index)
+        self.assertEqual(self.black_list_filter.get_data()["ip_ranges"], ["192.0.2.0/24"])
+
+    def test_failure_fallback(self):
+        sources = [self.write_block_list("drop.txt", "1.10.16.0/20 ; SBL256894\n")]
+        self.assertTrue(BlockListLoader(sources, 3600, GracefulKiller()).refresh(self.black_list_filter))
+
+        # A block list that can't be loaded keeps the previous IP ranges, instead of replacing them with a partial list
+        sources.append(os.path.join(self.directory.name, "missing.txt"))
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(BlockListLoader(sources, 3600, GracefulKiller()).refresh(self.black_list_filter))
+        self.assertIn("1.10.16.1", self.black_list_filter.ip_range_index)
+        self.assertIn("192.0.2.1", self.black_list_filter.ip_range_index)
@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from core.filtering.CPUFilterPool import CPUFilterPool
+from core.filtering.filters.FromFilter import FromFilter
+from core.filtering.tests import test_AnyFilter
+
+
+class TestCPUFilterPool(TestCase):
+
+    @staticmethod
+    def create_email(email_from: str):
+        return test_AnyFilter.TestAnyFilter.create_email(
+            peer=("192.168.1.10", 1025),
+            mail_from="from@mail.com",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", email_from),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Test",
+            email_contents="This is a mail for testing purposes"
+        )
+
+    def test_pool(self):
+        cpu_filter_pool = CPUFilterPool([FromFilter()], n_processes=1)
+        self.addCleanup(cpu_filter_pool.shutdown)
+
+        # The message is sent as raw bytes and filtered by the copy of the filter preloaded in the worker process
+        self.assertFalse(cpu_filter_pool.submit(self.create_email("from@mail.com"), FromFilter()).result(timeout=30))
+        self.assertTrue(cpu_filter_pool.submit(self.create_email("other@mail.com"), FromFilter()).result(timeout=30))
@@ -0,0 +1,71 @@
+import asyncio
+from unittest import TestCase
+
+import dns.resolver
+
+from core.DNSResolver import DNSResolver
+
+
+class TestDNSResolver(TestCase):
+
+    def test_zone_file(self):
+        resolver = DNSResolver(zone_file="zones/test.zone", offline=True)
+        answer = resolver.resolve("Mail.Test.", "mx")
+        self.assertEqual([record.exchange.to_text() for record in answer], ["mx1.mail.test."])
+        self.assertEqual(answer.ttl, 300)
+        self.assertRaises(dns.resolver.NoAnswer, resolver.resolve, "mail.test", "TXT")
+        self.assertRaises(dns.resolver.NXDOMAIN, resolver.resolve, "unknown.test", "A")
+
+    def test_cache_and_coalescing(self):
+        resolver = DNSResolver(negative_ttl=60)
+        n_queries = {}
+        answer = DNSResolver(zone_file="zones/test.zone").resolve("mechanisms.test", "A")
+
+        class UpstreamResolver:
+            async def resolve(self, name, rdtype):
+                n_queries[name] = n_queries.get(name, 0) + 1
+                await asyncio.sleep(0.05)
+                if name == "unknown.test":
+                    raise dns.resolver.NXDOMAIN()
+                return type("Answer", (), {"rrset": answer})
+
+        async def resolve_concurrently(name):
+            return await asyncio.gather(*(resolver.resolve_async(name, "A") for _ in range(10)),
+                                        return_exceptions=True)
+
+        resolver._resolver = UpstreamResolver()
+        answers = asyncio.run(resolve_concurrently("mechanisms.test"))
+        self.assertTrue(all(cached_answer is answer for cached_answer in answers))
+        self.assertEqual(len(resolver.resolve("mechanisms.test", "A")), 1)
+        errors = asyncio.run(resolve_concurrently("unknown.test"))
+        self.assertTrue(all(isinstance(error, dns.resolver.NXDOMAIN) for error in errors))
+        self.assertRaises(dns.resolver.NXDOMAIN, resolver.resolve, "unknown.test", "A")
+        self.assertEqual(n_queries, {"mechanisms.test": 1, "unknown.test": 1})
+        self.assertEqual(len(resolver), 2)
+
+    def test_coalesced_waiter_timeout(self):
+        resolver = DNSResolver()
+        answer = DNSResolver(zone_file="zones/test.zone").resolve("mechanisms.test", "A")
+
+        class UpstreamResolver:
+            async def resolve(self, name, rdtype):
+                await asyncio.sleep(0.1)
+                return type("Answer", (), {"rrset": answer})
+
+        async def wait(timeout):
+            await asyncio.sleep(0.01)
+            try:
+                return await asyncio.wait_for(resolver.resolve_async("mechanisms.test", "A"), timeout)
+            except asyncio.TimeoutError as e:
+                return e
+
+        async def resolve_with_waiters():
+            waiters = [asyncio.create_task(wait(timeout)) for timeout in (0.02, 1, 1)]
+            owner_answer = await resolver.resolve_async("mechanisms.test", "A")
+            return [owner_answer] + [await waiter for waiter in waiters]
+
+        resolver._resolver = UpstreamResolver()
+        owner_answer, expired_answer, *other_answers = asyncio.run(resolve_with_waiters())
+        self.assertIs(owner_answer, answer)
+        self.assertIsInstance(expired_answer, asyncio.TimeoutError)
+        self.assertTrue(all(other_answer is answer for other_answer in other_answers))
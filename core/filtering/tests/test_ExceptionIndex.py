@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from core.filtering.ExceptionIndex import ExceptionIndex
+
+
+class TestExceptionIndex(TestCase):
+
+    def setUp(self):
+        self.exception_index = ExceptionIndex(
+            ip_addresses=["10.0.0.1", "192.168.0.0/16", "172.16.4.0/22", "2001:db8::/32"],
+            email_addresses=["Partner@mail.com"],
+            email_domains=["partner.com", "*.trusted.org"]
+        )
+
+    def test_ip_addresses(self):
+        self.assertTrue(self.exception_index.match_ip("10.0.0.1"))
+        self.assertFalse(self.exception_index.match_ip("10.0.0.2"))
+        self.assertTrue(self.exception_index.match_ip("192.168.25.3"))
+        self.assertTrue(self.exception_index.match_ip("172.16.7.255"))
+        self.assertFalse(self.exception_index.match_ip("172.16.8.0"))
+        self.assertTrue(self.exception_index.match_ip("2001:db8:1::25"))
+        self.assertFalse(self.exception_index.match_ip("2001:db9::25"))
+        self.assertFalse(self.exception_index.match_ip(None))
+
+    def test_email_addresses(self):
+        self.assertTrue(self.exception_index.match_email_address("partner@mail.com"))
+        self.assertFalse(self.exception_index.match_email_address("other@mail.com"))
+
+    def test_email_domains(self):
+        self.assertTrue(self.exception_index.match_email_domain("partner.com"))
+        self.assertFalse(self.exception_index.match_email_domain("mail.partner.com"))
+        self.assertTrue(self.exception_index.match_email_domain("mail.trusted.org"))
+        self.assertTrue(self.exception_index.match_email_domain("a.b.Trusted.org"))
+        self.assertFalse(self.exception_index.match_email_domain("trusted.org"))
+        self.assertFalse(self.exception_index.match_email_domain("untrusted.org"))
+
+    def test_match(self):
+        self.assertTrue(self.exception_index.match("8.8.8.8", None, "mail.trusted.org"))
+        self.assertFalse(self.exception_index.match("8.8.8.8", "other@mail.com", "mail.com"))
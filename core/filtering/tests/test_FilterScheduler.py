@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from core.filtering.FilterScheduler import FilterScheduler
+
+
+def create_filter(name: str):
+    return type(name, (), {})()
+
+
+class TestFilterScheduler(TestCase):
+
+    def setUp(self):
+        self.cheap, self.expensive, self.effective, self.new = (
+            create_filter(name) for name in ("CheapFilter", "ExpensiveFilter", "EffectiveFilter", "NewFilter")
+        )
+
+    def record(self, scheduler: FilterScheduler):
+        for n_message in range(10):
+            scheduler.record(self.cheap, 0.001, False)
+            scheduler.record(self.expensive, 0.1, False)
+            # As expensive as ExpensiveFilter, but it detects spam half of the time
+            scheduler.record(self.effective, 0.1, n_message % 2 == 0)
+            scheduler.message_filtered()
+
+    def test_ordering(self):
+        scheduler = FilterScheduler(reorder_frequency=10)
+        filters = [self.expensive, self.effective, self.cheap]
+
+        self.record(scheduler)
+        self.assertEqual(scheduler.order(filters), [self.cheap, self.effective, self.expensive])
+
+        # Filters without statistics go first
+        self.assertEqual(scheduler.order(filters + [self.new]), [self.new, self.cheap, self.effective, self.expensive])
+
+    def test_reorder_frequency(self):
+        scheduler = FilterScheduler(reorder_frequency=20)
+        filters = [self.expensive, self.effective, self.cheap]
+        self.record(scheduler)
+        self.assertEqual(scheduler.order(filters), filters)
+        self.record(scheduler)
+        self.assertEqual(scheduler.order(filters), [self.cheap, self.effective, self.expensive])
+
+    def test_pinned_filters(self):
+        scheduler = FilterScheduler(reorder_frequency=10, pinned_filters={"ExpensiveFilter": 0, "NewFilter": 10})
+        self.record(scheduler)
+        self.assertEqual(scheduler.order([self.new, self.cheap, self.effective, self.expensive]),
+                         [self.expensive, self.cheap, self.effective, self.new])
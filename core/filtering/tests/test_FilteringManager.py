@@ -0,0 +1,243 @@
+import asyncio
+import os
+import pkgutil
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+from unittest.mock import patch
+
+from core.filtering.FilteringManager import FilteringManager
+from core.filtering.filters.FromFilter import FromFilter
+from core.filtering.tests import test_AnyFilter
+
+
+def create_filter(name: str, is_spam: bool, stage: str = "DATA", applied: list = None):
+    """
+    This function creates a stub filter with the given class name, which records its applications
+    """
+    def filter_msg(self, envelope):
+        if applied is not None:
+            applied.append(name)
+        return is_spam
+
+    return type(name, (), {"stage": stage, "cpu_bound": False, "filter": filter_msg})()
+
+
+class TestFilteringManager(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.working_directory = os.getcwd()
+        self.filters_directory = os.path.join(self.working_directory, "../filters")
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    def create_manager(self, filters: list, tiers: list = None, **kwargs) -> FilteringManager:
+        # Every filter is disabled, so that only the given stub filters are applied
+        disabled_filters = [name for module_loader, name, is_pkg in pkgutil.iter_modules([self.filters_directory])
+                            if name not in ("Filter", "PastFilter", "AIFilter")]
+        filtering_mgr = FilteringManager(disabled_filters=disabled_filters, persist_state=False, **kwargs)
+        filtering_mgr.filters = filters
+        filtering_mgr.filters_by_stage = {
+            stage: [filter_object for filter_object in filters if filter_object.stage == stage]
+            for stage in ("CONNECT", "MAIL", "RCPT", "DATA")
+        }
+        filtering_mgr.set_up_tiers(tiers if tiers is not None else [])
+        return filtering_mgr
+
+    @staticmethod
+    def create_email(email_from: str = "from@mail.com"):
+        return test_AnyFilter.TestAnyFilter.create_email(
+            peer=("192.168.1.10", 1025),
+            mail_from="from@mail.com",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", email_from),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Test",
+            email_contents="This is a mail for testing purposes"
+        )
+
+    def test_early_filters(self):
+        applied = []
+        filtering_mgr = self.create_manager([create_filter("ConnectFilter", True, "CONNECT", applied)])
+        self.assertTrue(asyncio.run(filtering_mgr.apply_early_filters_async("CONNECT", self.create_email())))
+        self.assertEqual(filtering_mgr.get_data_stages(), ("DATA",))
+        self.assertEqual(applied, ["ConnectFilter"])
+
+        # Stages without filters don't go through the session executor
+        filtering_mgr.session_executor.shutdown()
+        self.assertFalse(asyncio.run(filtering_mgr.apply_early_filters_async("MAIL", self.create_email())))
+        self.assertFalse(asyncio.run(filtering_mgr.apply_early_filters_async("RCPT", self.create_email())))
+
+    def test_deferred_early_filters(self):
+        applied = []
+        filtering_mgr = self.create_manager(
+            [create_filter("ConnectFilter", True, "CONNECT", applied)],
+            exceptions={"ip_addresses": [], "email_addresses": ["allowed@mail.com"], "email_domains": []}
+        )
+
+        # The 'From' header isn't known before DATA, so the early filters are deferred to it
+        self.assertFalse(filtering_mgr.apply_early_filters("CONNECT", self.create_email()))
+        self.assertEqual(applied, [])
+        stages = filtering_mgr.get_data_stages()
+        self.assertIn("CONNECT", stages)
+        self.assertFalse(filtering_mgr.apply_filters(self.create_email("allowed@mail.com"), stages))
+        self.assertEqual(applied, [])
+        self.assertTrue(filtering_mgr.apply_filters(self.create_email(), stages))
+        self.assertEqual(applied, ["ConnectFilter"])
+
+    def test_adaptive_ordering(self):
+        applied = []
+        filters = [
+            type(name, (), {"stage": "DATA", "cpu_bound": False, "filter": filter_msg})()
+            for name, filter_msg in (
+                ("SlowFilter", lambda self, envelope: applied.append("SlowFilter") or time.sleep(0.01) or False),
+                ("FastFilter", lambda self, envelope: applied.append("FastFilter") or False)
+            )
+        ]
+        # A single filtering thread applies the filters in the order in which they are submitted
+        filtering_mgr = self.create_manager(filters, reorder_frequency=2, n_filtering_threads=1)
+        for n_message in range(3):
+            self.assertFalse(filtering_mgr.apply_filters(self.create_email()))
+        self.assertEqual(applied, ["SlowFilter", "FastFilter"] * 2 + ["FastFilter", "SlowFilter"])
+
+    def test_tiers(self):
+        for enable_threading in (True, False):
+            applied = []
+            filters = [
+                create_filter("HeaderFilter", False, applied=applied),
+                create_filter("NetworkFilter", True, applied=applied),
+                create_filter("ModelFilter", True, applied=applied),
+                create_filter("UntieredFilter", False, applied=applied)
+            ]
+            tiers = [
+                {"name": "header", "filters": ["HeaderFilter"], "time_limit": 1},
+                {"name": "network", "filters": ["NetworkFilter"], "time_limit": 1},
+                {"name": "ml", "filters": ["ModelFilter"], "time_limit": 1}
+            ]
+            filtering_mgr = self.create_manager(filters, tiers, enable_threading=enable_threading)
+            self.assertEqual([tier[0] for tier in filtering_mgr.tiers], ["header", "network", "ml", "default"])
+
+            # Spam detected in a tier skips the following ones
+            self.assertTrue(filtering_mgr.apply_filters(self.create_email()))
+            self.assertEqual(applied, ["HeaderFilter", "NetworkFilter"])
+
+    def test_overall_time_limit(self):
+        for enable_threading in (True, False):
+            applied = []
+            filters = [
+                type("SlowFilter", (), {"stage": "DATA", "cpu_bound": False,
+                                        "filter": lambda self, envelope: time.sleep(0.1) or False})(),
+                create_filter("SpamFilter", True, applied=applied)
+            ]
+            tiers = [
+                {"name": "slow", "filters": ["SlowFilter"], "time_limit": 1},
+                {"name": "spam", "filters": ["SpamFilter"], "time_limit": 1}
+            ]
+            filtering_mgr = self.create_manager(filters, tiers, enable_threading=enable_threading, time_limit=0.05)
+
+            # The slow tier uses up the overall time limit, so the following tier isn't applied
+            start_time = time.monotonic()
+            self.assertFalse(filtering_mgr.apply_filters(self.create_email()))
+            self.assertEqual(applied, [])
+            if enable_threading:
+                self.assertLess(time.monotonic() - start_time, 0.1)
+
+    def test_async_deadlines(self):
+        applied = []
+        filters = [
+            type("SlowFilter", (), {"stage": "DATA", "cpu_bound": False,
+                                    "filter": lambda self, envelope: time.sleep(0.2) or True})(),
+            create_filter("HamFilter", False, applied=applied),
+            create_filter("SpamFilter", True, applied=applied)
+        ]
+        tiers = [
+            {"name": "slow", "filters": ["SlowFilter"], "time_limit": 0.05},
+            {"name": "ham", "filters": ["HamFilter"], "time_limit": 1},
+            {"name": "spam", "filters": ["SpamFilter"], "time_limit": 1}
+        ]
+
+        # A tier which misses its deadline is skipped (its late verdict is ignored) and the next tiers are applied
+        filtering_mgr = self.create_manager(filters, tiers, time_limit=1, n_filtering_threads=4)
+        start_time = time.monotonic()
+        self.assertTrue(asyncio.run(filtering_mgr.apply_filters_async(self.create_email())))
+        self.assertLess(time.monotonic() - start_time, 0.2)
+        self.assertEqual(applied, ["HamFilter", "SpamFilter"])
+
+        # Once the overall deadline passes, the remaining tiers aren't applied
+        applied.clear()
+        filtering_mgr = self.create_manager(filters, tiers, time_limit=0.05, n_filtering_threads=4)
+        start_time = time.monotonic()
+        self.assertFalse(asyncio.run(filtering_mgr.apply_filters_async(self.create_email())))
+        self.assertLess(time.monotonic() - start_time, 0.2)
+        self.assertEqual(applied, [])
+
+    def test_batch(self):
+        for enable_threading in (True, False):
+            batch_sizes = {}
+
+            def create_batch_filter(name: str, is_spam):
+                def filter_batch(self, envelopes):
+                    batch_sizes[name] = len(envelopes)
+                    return [is_spam(envelope) for envelope in envelopes]
+
+                return type(name, (), {"stage": "DATA", "cpu_bound": False, "filter_batch": filter_batch})()
+
+            filters = [
+                create_batch_filter("HamFilter", lambda envelope: False),
+                create_batch_filter("PeerFilter", lambda envelope: envelope.peer[0] == "192.0.2.1"),
+                create_batch_filter("FailingFilter", lambda envelope: 1 / 0)
+            ]
+            filtering_mgr = self.create_manager(
+                filters, enable_threading=enable_threading,
+                exceptions={"ip_addresses": ["198.51.100.0/24"], "email_addresses": [], "email_domains": []}
+            )
+            msgs = [self.create_email() for _ in range(3)]
+            msgs[1].peer = ("192.0.2.1", 1025)
+            msgs[2].peer = ("198.51.100.1", 1025)
+            with self.assertLogs(level="WARNING"):
+                results = filtering_mgr.apply_filters_batch(msgs, update_black_list=False)
+
+            # The verdict of each filter is reported, and the message matched by an exception isn't filtered
+            self.assertEqual(results, [
+                {"is_spam": False, "filters": {"HamFilter": False, "PeerFilter": False, "FailingFilter": False}},
+                {"is_spam": True, "filters": {"HamFilter": False, "PeerFilter": True, "FailingFilter": False}},
+                {"is_spam": False, "filters": {}}
+            ])
+            self.assertEqual(batch_sizes, {"HamFilter": 2, "PeerFilter": 2, "FailingFilter": 2})
+
+    def create_cpu_bound_manager(self, enable_threading: bool) -> FilteringManager:
+        # A real filter, so that it can be sent to the filtering processes
+        from_filter = FromFilter()
+        from_filter.cpu_bound = True
+        filtering_mgr = self.create_manager([from_filter], enable_threading=enable_threading, time_limit=30)
+        filtering_mgr.set_up_cpu_filter_pool(1)
+        self.addCleanup(filtering_mgr.shutdown)
+        return filtering_mgr
+
+    def test_broken_process_pool(self):
+        for enable_threading in (True, False):
+            filtering_mgr = self.create_cpu_bound_manager(enable_threading)
+            cpu_filter_pool = filtering_mgr.cpu_filter_pool
+            self.assertTrue(filtering_mgr.apply_filters(self.create_email("other@mail.com")))
+
+            # Once a filtering process is killed, the CPU-bound filters are applied in-process
+            for process in list(cpu_filter_pool.executor._processes.values()):
+                process.kill()
+            with self.assertRaises(BrokenProcessPool):
+                cpu_filter_pool.submit(self.create_email(), filtering_mgr.filters[0]).result(timeout=30)
+            with self.assertLogs(level="WARNING"):
+                self.assertTrue(filtering_mgr.apply_filters(self.create_email("other@mail.com")))
+            self.assertIsNone(filtering_mgr.cpu_filter_pool)
+            self.assertFalse(filtering_mgr.apply_filters(self.create_email()))
+
+    def test_unavailable_process_pool(self):
+        with patch("core.filtering.FilteringManager.CPUFilterPool", side_effect=OSError("No space left on device")):
+            with self.assertLogs(level="WARNING"):
+                filtering_mgr = self.create_cpu_bound_manager(enable_threading=True)
+        self.assertIsNone(filtering_mgr.cpu_filter_pool)
+        self.assertTrue(filtering_mgr.apply_filters(self.create_email("other@mail.com")))
@@ -16,3 +16,25 @@ class TestFromFilter(TestAnyFilter):
         print("TESTING SPAM 1:\n", invalid)
         is_spam = self.tested_filter.filter(invalid)
         self.assertTrue(is_spam, "FromFilter didn't detect spam")
+
+    def test_batch(self):
+        valid = self.create_email(
+            peer=self.peer,
+            mail_from="from@mail.com",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Sender", "from@mail.com"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Valid",
+            email_contents="This is a valid mail for testing purposes"
+        )
+        invalid = self.create_email(
+            peer=self.peer,
+            mail_from="from@mail.com",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Other", "other_from@mail.com"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Spam",
+            email_contents="This is a spam mail for testing purposes"
+        )
+        verdicts = self.tested_filter.filter_batch([valid, invalid, valid])
+        self.assertEqual([False, True, False], verdicts, "FromFilter batch verdicts differ from single ones")
@@ -0,0 +1,80 @@
+import multiprocessing
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+from core.GracefulKiller import GracefulKiller
+from core.LiSBServer import LiSBSupervisor
+
+# Released by each worker once it handles the shutdown signals
+workers_ready = multiprocessing.Semaphore(0)
+
+
+def fail(conf: dict, persist_state: bool):
+    sys.exit(1)
+
+
+def serve(conf: dict, persist_state: bool):
+    # Like a LiSBServer worker, serve until a shutdown signal is received
+    killer = GracefulKiller()
+    workers_ready.release()
+    killer.wait()
+
+
+class TestLiSBSupervisor(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("core.LiSBServer.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check_restart(self, supervisor: LiSBSupervisor, restart_delay: int):
+        worker = supervisor.workers[0]
+        worker.join()
+        with self.assertLogs(level="ERROR") as logs:
+            supervisor.check_workers()
+        self.assertIn(f"exited unexpectedly with code 1. Restarting it in {restart_delay} s", logs.output[0])
+        self.assertIs(supervisor.workers[0], worker)
+
+        # The worker is only restarted once its restart delay has elapsed
+        self.now += restart_delay - 0.5
+        supervisor.check_workers()
+        self.assertIs(supervisor.workers[0], worker)
+        self.now += 0.5
+        supervisor.check_workers()
+        self.assertIsNot(supervisor.workers[0], worker)
+
+    @patch.object(LiSBSupervisor, "_run_worker", fail)
+    def test_restart_backoff(self):
+        supervisor = LiSBSupervisor({"server_params": {"n_workers": 1}})
+        supervisor.start_workers()
+        self.addCleanup(supervisor.stop_workers)
+
+        # A worker which keeps failing right after being started is restarted after a delay which doubles each time
+        self.check_restart(supervisor, 1)
+        self.check_restart(supervisor, 2)
+        self.check_restart(supervisor, 4)
+
+        # Once a worker has been up for long enough, its restart delay is reset
+        self.now += LiSBSupervisor._STABLE_UPTIME
+        self.check_restart(supervisor, 1)
+
+    @patch.object(LiSBSupervisor, "_run_worker", serve)
+    def test_shutdown(self):
+        supervisor = LiSBSupervisor({"server_params": {"n_workers": 3}})
+        supervisor.start_workers()
+        for worker in supervisor.workers:
+            self.assertTrue(workers_ready.acquire(timeout=30))
+        supervisor.check_workers()
+        self.assertTrue(all(worker.is_alive() for worker in supervisor.workers))
+
+        # Every worker is shut down gracefully, and none of them is restarted once the supervisor is being killed
+        supervisor.killer.exit_gracefully(None, None)
+        workers = list(supervisor.workers)
+        supervisor.workers[0].terminate()
+        supervisor.workers[0].join()
+        supervisor.check_workers()
+        self.assertEqual(supervisor.workers, workers)
+        supervisor.stop_workers()
+        self.assertEqual([worker.exitcode for worker in supervisor.workers], [0, 0, 0])
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from core.RateLimiter import RateLimiter
+
+
+def create_limits(connections: tuple = (1, 100), messages: tuple = (1, 100), bytes_: tuple = (1000, 100000)) -> dict:
+    return {
+        "connections": {"rate": connections[0], "burst": connections[1]},
+        "messages": {"rate": messages[0], "burst": messages[1]},
+        "bytes": {"rate": bytes_[0], "burst": bytes_[1]}
+    }
+
+
+class TestRateLimiter(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch("core.RateLimiter.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        rate_limiter = RateLimiter(per_ip=create_limits(connections=(1, 2)), per_network=create_limits())
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.1"))
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.1"))
+        self.assertFalse(rate_limiter.allow_connection("192.0.2.1"))
+        # Each peer IP has its own bucket
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.2"))
+
+        # Buckets are refilled at their rate, up to their burst
+        self.now += 1
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.1"))
+        self.assertFalse(rate_limiter.allow_connection("192.0.2.1"))
+        self.now += 60
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.1"))
+        self.assertTrue(rate_limiter.allow_connection("192.0.2.1"))
+        self.assertFalse(rate_limiter.allow_connection("192.0.2.1"))
+
+    def test_network_aggregation(self):
+        rate_limiter = RateLimiter(per_ip=create_limits(), per_network=create_limits(messages=(1, 3)),
+                                   ipv4_prefix=24, ipv6_prefix=64)
+        self.assertEqual(rate_limiter.get_network("192.0.2.77"), "192.0.2.0/24")
+        self.assertEqual(rate_limiter.get_network("2001:db8::1"), "2001:db8::/64")
+        for peer_ip in ("192.0.2.1", "192.0.2.2", "192.0.2.3"):
+            self.assertTrue(rate_limiter.allow_message(peer_ip))
+        # The network bucket is shared by every IP of the network
+        self.assertFalse(rate_limiter.allow_message("192.0.2.4"))
+        self.assertTrue(rate_limiter.allow_message("198.51.100.1"))
+
+    def test_size_precheck(self):
+        rate_limiter = RateLimiter(per_ip=create_limits(bytes_=(100, 1000)), per_network=create_limits())
+        self.assertTrue(rate_limiter.allow_message("192.0.2.1", declared_size=600))
+        rate_limiter.charge_bytes("192.0.2.1", 600)
+        # The declared size no longer fits in the bucket
+        self.assertFalse(rate_limiter.allow_message("192.0.2.1", declared_size=600))
+        self.assertTrue(rate_limiter.allow_message("192.0.2.1", declared_size=400))
+
+        # Messages larger than the burst are accepted as long as the bucket is full, and leave it in debt
+        self.now += 10
+        self.assertTrue(rate_limiter.allow_message("192.0.2.1", declared_size=5000))
+        rate_limiter.charge_bytes("192.0.2.1", 5000)
+        self.now += 10
+        self.assertFalse(rate_limiter.allow_message("192.0.2.1"))
+        self.now += 40
+        self.assertTrue(rate_limiter.allow_message("192.0.2.1"))
+
+    def test_sweep(self):
+        rate_limiter = RateLimiter(per_ip=create_limits(), per_network=create_limits())
+        rate_limiter.allow_connection("192.0.2.1")
+        rate_limiter.allow_connection("198.51.100.1")
+        rate_limiter.charge_bytes("198.51.100.1", 1000000)
+        self.assertEqual(rate_limiter.get_n_tracked(), 4)
+
+        # Only the buckets that are full again are forgotten (192.0.2.1 and its network), since the byte buckets of
+        # 198.51.100.1 and its network are still in debt
+        self.now += 61
+        rate_limiter.allow_connection("198.51.100.2")
+        self.assertEqual(rate_limiter.get_n_tracked(), 3)
@@ -1,7 +1,12 @@
+import asyncio
 import email
+import threading
+import time
 from unittest import TestCase
 
-from core.EmailEnvelope import EmailEnvelope
+from core.DNSResolver import DNSResolver
+from core.filtering.SPFCache import SPFCache
+from core.filtering.SPFEvaluator import SPFEvaluator
 from core.filtering.filters.SPFFilter import SPFFilter
 from core.filtering.tests.test_AnyFilter import TestAnyFilter
 
@@ -9,19 +14,29 @@ from core.filtering.tests.test_AnyFilter import TestAnyFilter
 class TestSPFFilter(TestCase):
     tested_filter = SPFFilter()
 
+    @classmethod
+    def setUpClass(cls):
+        DNSResolver.configure(zone_file="zones/test.zone", offline=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        DNSResolver.configure()
+
     def test_valid_1(self):
         envelope = TestAnyFilter.create_email(
             peer=('51.4.72.10', 1025),
-            mail_from="from@uvigo.gal",
+            mail_from="from@mail.com",
             rcpt_tos=["to1@mail.com", "to2@mail.com"],
             email_from=("Author", "from@mail.com"),
             email_tos=[("Recipient1", "to1@mail.com"), ("Recipient2", "to2@mail.com")],
             email_subject="Valid",
             email_contents="This is a valid mail for testing purposes"
         )
+        # The sender IP is only authorized by spfd.protection.outlook.com, two includes below the policy of mail.com
         self.tested_filter.set_initial_data({})
         is_spam = self.tested_filter.filter(envelope)
         self.assertFalse(is_spam, "SPFFilter detected ham as spam")
+        self.assertTrue(self.tested_filter.cache.get("mail.com")[0], "SPFFilter didn't compile the policy of mail.com")
 
     def test_valid_2(self):
         envelope = TestAnyFilter.create_email(
@@ -35,7 +50,7 @@ class TestSPFFilter(TestCase):
         )
         self.tested_filter.set_initial_data(
             {
-                'gmail.com': EmailEnvelope.get_all_domain_ip_ranges('gmail.com')
+                'gmail.com': asyncio.run(SPFEvaluator().compile_policy('gmail.com'))[1].get_ip_ranges()
             }
         )
         is_spam = self.tested_filter.filter(envelope)
@@ -53,8 +68,186 @@ class TestSPFFilter(TestCase):
         )
         self.tested_filter.set_initial_data(
             {
-                'gmail.com': EmailEnvelope.get_all_domain_ip_ranges('gmail.com')
+                'gmail.com': asyncio.run(SPFEvaluator().compile_policy('gmail.com'))[1].get_ip_ranges()
             }
         )
         is_spam = self.tested_filter.filter(envelope)
         self.assertTrue(is_spam, "SPFFilter detected ham as spam")
+
+    def test_batch(self):
+        spf_filter = SPFFilter()
+        compiled_domains = []
+        compile_policy = spf_filter.evaluator.compile_policy
+
+        async def count_compilations(domain):
+            compiled_domains.append(domain)
+            return await compile_policy(domain)
+
+        spf_filter.evaluator.compile_policy = count_compilations
+        envelopes = [
+            TestAnyFilter.create_email(
+                peer=(peer_ip, 1025),
+                mail_from=mail_from,
+                rcpt_tos=["to@mail.com"],
+                email_from=("Author", mail_from),
+                email_tos=[("Recipient", "to@mail.com")],
+                email_subject="Batch",
+                email_contents="This is a mail for testing purposes"
+            )
+            for peer_ip, mail_from in (
+                ("51.4.72.10", "from@mail.com"),
+                ("192.0.2.1", "other@mail.com"),
+                ("72.14.192.15", "from@gmail.com"),
+                ("203.0.113.1", "alice@macros.test"),
+                ("203.0.113.1", "bob@macros.test")
+            )
+        ]
+
+        # The verdicts are the same as the single ones, but each domain is compiled only once for the whole batch
+        self.assertEqual(spf_filter.filter_batch(envelopes), [False, True, False, False, True])
+        self.assertEqual(sorted(compiled_domains), ["gmail.com", "macros.test", "mail.com"])
+        self.assertEqual([spf_filter.filter(envelope) for envelope in envelopes], [False, True, False, False, True])
+        self.assertEqual(len(compiled_domains), 3)
+
+    def test_mechanisms(self):
+        evaluator = SPFEvaluator()
+
+        def check_host(ip, domain, sender=None):
+            return asyncio.run(evaluator.check_host(ip, domain, sender))
+
+        self.assertEqual(check_host("198.51.100.10", "mechanisms.test"), "pass")
+        self.assertEqual(check_host("198.51.100.20", "mechanisms.test"), "pass")
+        self.assertEqual(check_host("192.0.2.200", "mechanisms.test"), "neutral")
+        self.assertEqual(check_host("192.0.2.1", "mechanisms.test"), "fail")
+        self.assertEqual(check_host("203.0.113.5", "mechanisms.test"), "softfail")
+        self.assertEqual(check_host("203.0.113.1", "redirect.test"), "pass")
+        self.assertEqual(check_host("192.0.2.1", "redirect.test"), "fail")
+        self.assertEqual(check_host("203.0.113.1", "macros.test", "alice@macros.test"), "pass")
+        self.assertEqual(check_host("203.0.113.1", "macros.test", "bob-alice@macros.test"), "fail")
+        self.assertEqual(check_host("203.0.113.1", "loop.test"), "permerror")
+        self.assertEqual(check_host("203.0.113.1", "uvigo.gal"), "none")
+
+    def test_compiled_policies(self):
+        evaluator = SPFEvaluator()
+        kind, pass_set, ttl = asyncio.run(evaluator.compile_policy("mechanisms.test"))
+        self.assertEqual(kind, "static")
+        self.assertEqual(pass_set.get_ip_ranges(), ["198.51.100.10/32", "198.51.100.20/32"])
+        self.assertEqual(asyncio.run(evaluator.compile_policy("macros.test"))[0], "dynamic")
+        self.assertEqual(asyncio.run(evaluator.compile_policy("uvigo.gal"))[0], "none")
+
+    def test_envelope_domain(self):
+        envelope = TestAnyFilter.create_email(
+            peer=('192.0.2.1', 1025),
+            mail_from="from@mechanisms.test",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", "from@uvigo.gal"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Spam",
+            email_contents="This is a spam mail for testing purposes"
+        )
+        self.assertEqual(SPFFilter.get_checked_domain(envelope), "mechanisms.test")
+        spf_filter = SPFFilter()
+        self.assertTrue(spf_filter.filter(envelope), "SPFFilter didn't check the envelope sender domain")
+        envelope.mail_from = ""
+        self.assertEqual(SPFFilter.get_checked_domain(envelope), "uvigo.gal")
+
+    def test_prefetch(self):
+        spf_filter = SPFFilter()
+        n_compilations = []
+        compile_policy = spf_filter.evaluator.compile_policy
+
+        async def count_compilations(domain):
+            n_compilations.append(domain)
+            await asyncio.sleep(0.1)
+            return await compile_policy(domain)
+
+        spf_filter.evaluator.compile_policy = count_compilations
+        envelope = TestAnyFilter.create_email(
+            peer=('198.51.100.10', 1025),
+            mail_from="from@mechanisms.test",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", "from@mechanisms.test"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Valid",
+            email_contents="This is a valid mail for testing purposes"
+        )
+
+        # A message filtered while its domain is being prefetched waits for the prefetched policy
+        prefetch_thread = threading.Thread(target=spf_filter.prefetch, args=("mechanisms.test",))
+        prefetch_thread.start()
+        time.sleep(0.02)
+        self.assertFalse(spf_filter.filter(envelope), "SPFFilter detected ham as spam")
+        prefetch_thread.join()
+        self.assertEqual(n_compilations, ["mechanisms.test"])
+
+        # Once prefetched, the policy is served from the SPF cache
+        self.assertTrue(spf_filter.cache.get("mechanisms.test")[0])
+        envelope.peer = ('192.0.2.1', 1025)
+        self.assertTrue(spf_filter.filter(envelope), "SPFFilter didn't detect spam")
+        self.assertEqual(n_compilations, ["mechanisms.test"])
+
+    def test_permerror(self):
+        self.assertEqual(asyncio.run(SPFEvaluator().compile_policy("invalid.test")), ("permerror", None, 0))
+        spf_filter = SPFFilter()
+        envelope = TestAnyFilter.create_email(
+            peer=('203.0.113.1', 1025),
+            mail_from="from@invalid.test",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", "from@invalid.test"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Spam",
+            email_contents="This is a spam mail for testing purposes"
+        )
+        self.assertTrue(spf_filter.filter(envelope), "SPFFilter didn't detect spam")
+
+        # Invalid policies are cached for as long as missing ones
+        expiry_date = spf_filter.get_data()["invalid.test"]["expiry_date"]
+        self.assertEqual(spf_filter.cache.get("invalid.test"), (True, SPFCache.PERMERROR))
+        self.assertLessEqual(expiry_date, time.time() + spf_filter.cache.negative_ttl)
+        self.assertEqual(spf_filter.filter_batch([envelope]), [True])
+
+    def test_lookup_limit(self):
+        # The tree of includes takes more than 10 lookups, but check_host can still decide the first sender IPs
+        evaluator = SPFEvaluator()
+        self.assertEqual(asyncio.run(evaluator.check_host("192.0.2.1", "large.test")), "pass")
+        self.assertEqual(asyncio.run(evaluator.check_host("198.51.100.11", "large.test")), "permerror")
+        self.assertEqual(asyncio.run(evaluator.compile_policy("large.test"))[0], "dynamic")
+
+        spf_filter = SPFFilter()
+        envelope = TestAnyFilter.create_email(
+            peer=('192.0.2.1', 1025),
+            mail_from="from@large.test",
+            rcpt_tos=["to@mail.com"],
+            email_from=("Author", "from@large.test"),
+            email_tos=[("Recipient", "to@mail.com")],
+            email_subject="Valid",
+            email_contents="This is a valid mail for testing purposes"
+        )
+        self.assertFalse(spf_filter.filter(envelope), "SPFFilter detected ham as spam")
+        self.assertEqual(spf_filter.cache.get("large.test"), (True, SPFCache.DYNAMIC))
+        envelope.peer = ('198.51.100.11', 1025)
+        self.assertTrue(spf_filter.filter(envelope), "SPFFilter didn't detect spam")
+
+    def test_concurrent_compilation(self):
+        resolver = DNSResolver.configure(zone_file="zones/test.zone", offline=True)
+        self.addCleanup(DNSResolver.configure, zone_file="zones/test.zone", offline=True)
+        resolve_async = resolver.resolve_async
+        queried_names = []
+
+        async def delay_queries(name, rdtype="A"):
+            queried_names.append(name)
+            await asyncio.sleep(0.05)
+            return await resolve_async(name, rdtype)
+
+        resolver.resolve_async = delay_queries
+        # The included policies at each level of the tree are looked up at once: 3 rounds of queries instead of 7
+        start_time = time.monotonic()
+        kind, pass_set, ttl = asyncio.run(SPFEvaluator().compile_policy("mail.com"))
+        self.assertLess(time.monotonic() - start_time, 0.25)
+        self.assertEqual(len(queried_names), 7)
+
+        # The policy is the same as if the directives were compiled in order
+        self.assertEqual(kind, "static")
+        for ip in ("51.4.72.10", "72.14.192.15", "2a01:111:f400::1"):
+            self.assertIn(ip, pass_set)
+        self.assertNotIn("192.0.2.1", pass_set)
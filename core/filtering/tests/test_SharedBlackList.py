@@ -0,0 +1,65 @@
+import os
+import tempfile
+import threading as th
+from unittest import TestCase
+
+from core.GracefulKiller import GracefulKiller
+from core.filtering.SharedBlackList import SharedBlackList
+
+
+class TestSharedBlackList(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "black_list.db")
+        self.killer = GracefulKiller()
+
+    def tearDown(self):
+        self.killer.exit_gracefully(None, None)
+        self.directory.cleanup()
+
+    def test_increment(self):
+        shared_black_list = SharedBlackList(self.path, 0.01, self.killer)
+        self.assertEqual(shared_black_list.increment("1.1.1.1", 100, 200), (1, 200))
+        self.assertEqual(shared_black_list.increment("1.1.1.1", 150, 250), (2, 200))
+        # Expired entries start over
+        self.assertEqual(shared_black_list.increment("1.1.1.1", 200, 300), (1, 300))
+        self.assertEqual(shared_black_list.increment("2.2.2.2", 200, 300), (1, 300))
+
+    def test_seq(self):
+        shared_black_list = SharedBlackList(self.path, 0.01, self.killer)
+        shared_black_list.seed({"1.1.1.1": (3, 200), "2.2.2.2": (1, 200)})
+        updates, last_seq = shared_black_list.get_updates()
+        self.assertEqual(sorted(updates), [("1.1.1.1", 3, 200), ("2.2.2.2", 1, 200)])
+        self.assertEqual(shared_black_list.get_updates(last_seq), ([], last_seq))
+
+        # Seeding doesn't overwrite existing peers, and only the updates after last_seq are returned
+        shared_black_list.seed({"1.1.1.1": (1, 100), "3.3.3.3": (1, 200)})
+        shared_black_list.increment("1.1.1.1", 100, 200)
+        updates, new_last_seq = shared_black_list.get_updates(last_seq)
+        self.assertEqual(updates, [("3.3.3.3", 1, 200), ("1.1.1.1", 4, 200)])
+        self.assertEqual(new_last_seq, last_seq + 2)
+
+        self.assertEqual(shared_black_list.delete_expired(150), 0)
+        self.assertEqual(shared_black_list.delete_expired(200), 3)
+
+    def test_sync_daemon(self):
+        worker_1 = SharedBlackList(self.path, 0.01, self.killer)
+        worker_2 = SharedBlackList(self.path, 0.01, self.killer)
+        received_updates = []
+        has_received_updates = th.Event()
+
+        def on_updates(updates):
+            received_updates.extend(updates)
+            has_received_updates.set()
+
+        worker_1.launch_sync_daemon(on_updates, worker_1.get_updates()[1])
+        worker_2.increment("1.1.1.1", 100, 200)
+        self.assertTrue(has_received_updates.wait(5))
+        self.assertEqual(received_updates, [("1.1.1.1", 1, 200)])
+
+        # Changes made by another connection bump 'PRAGMA data_version', so every update is picked up
+        has_received_updates.clear()
+        worker_2.increment("1.1.1.1", 150, 250)
+        self.assertTrue(has_received_updates.wait(5))
+        self.assertEqual(received_updates, [("1.1.1.1", 1, 200), ("1.1.1.1", 2, 200)])
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from core.filtering.VerdictCache import VerdictCache
+from core.filtering.tests import test_AnyFilter
+
+
+class TestVerdictCache(TestCase):
+
+    @staticmethod
+    def create_email(peer_ip="192.168.1.10", rcpt_tos=("to@mail.com",), email_tos=(("To", "to@mail.com"),),
+                     email_contents="This is a mail for testing purposes"):
+        return test_AnyFilter.TestAnyFilter.create_email(
+            peer=(peer_ip, 1025),
+            mail_from="from@mail.com",
+            rcpt_tos=list(rcpt_tos),
+            email_from=("Author", "from@mail.com"),
+            email_tos=list(email_tos),
+            email_subject="Test",
+            email_contents=email_contents
+        )
+
+    def test_ttl(self):
+        cache = VerdictCache(max_size=10, ttl=60)
+        with patch("core.filtering.VerdictCache.time.monotonic", return_value=1000):
+            cache.put("fingerprint", True)
+        with patch("core.filtering.VerdictCache.time.monotonic", return_value=1059):
+            self.assertTrue(cache.get("fingerprint"))
+        with patch("core.filtering.VerdictCache.time.monotonic", return_value=1060):
+            self.assertIsNone(cache.get("fingerprint"))
+        self.assertEqual(cache.get_stats(), {"size": 0, "hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+    def test_lru(self):
+        cache = VerdictCache(max_size=2, ttl=60)
+        cache.put("a", True)
+        cache.put("b", False)
+        self.assertTrue(cache.get("a"))
+        cache.put("c", True)
+        self.assertIsNone(cache.get("b"))
+        self.assertTrue(cache.get("a"))
+        self.assertTrue(cache.get("c"))
+
+    def test_fingerprint_normalization(self):
+        fingerprint = VerdictCache.get_fingerprint(self.create_email())
+
+        # Whitespace, case and the peer IP within its /24 network don't matter
+        self.assertEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(
+            peer_ip="192.168.1.200", email_contents="  THIS is a mail\n for   testing purposes ")))
+        # Neither does the recipient mailbox within the same domain
+        self.assertEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(
+            rcpt_tos=["other@mail.com"], email_tos=[("Other", "other@mail.com")])))
+
+        # But the body, the peer network, the recipient domain and the header checks do
+        self.assertNotEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(
+            email_contents="This is another mail for testing purposes")))
+        self.assertNotEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(peer_ip="192.168.2.10")))
+        self.assertNotEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(
+            rcpt_tos=["to@other.com"], email_tos=[("To", "to@other.com")])))
+        self.assertNotEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(
+            email_tos=[("Other", "other@mail.com")])))
+        self.assertNotEqual(fingerprint, VerdictCache.get_fingerprint(self.create_email(), "connect"))
@@ -3,7 +3,7 @@ import logging
 from schema import SchemaError
 
 from core import configuration
-from core.LiSBServer import LiSBServer
+from core.LiSBServer import LiSBServer, LiSBSupervisor
 
 if __name__ == '__main__':
 
@@ -11,9 +11,13 @@ if __name__ == '__main__':
         # Load initial configurations
         server_conf = configuration.load_server_config()
         configuration.config_logging(server_conf)
-        # Launch LiSBServer
-        server = LiSBServer(server_conf)
-        server.launch_server()
+        # Launch LiSBServer (or a pool of LiSBServer workers if more than one is configured)
+        if server_conf["server_params"]["n_workers"] == 1:
+            server = LiSBServer(server_conf)
+            server.launch_server()
+        else:
+            supervisor = LiSBSupervisor(server_conf)
+            supervisor.launch_workers()
     except SchemaError as e:
         logging.error(f"There was a syntax error in one of the configuration files: {e}")
     except Exception as e: